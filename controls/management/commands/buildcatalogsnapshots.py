@@ -0,0 +1,78 @@
+# Usage:
+#   python manage.py buildcatalogsnapshots [--catalog <catalog_key> ...] [--force]
+#
+# Writes a precompiled snapshot of each catalog to GR_CATALOG_SNAPSHOT_DIR
+# (see controls.snapshots) so that worker processes don't have to load and
+# parse catalogs from the database. Run it after deploying or loading new
+# or changed catalogs. Until then, processes load catalogs whose snapshots
+# are missing or out of date from the database.
+#
+# Example:
+#   python3 manage.py buildcatalogsnapshots
+#
+# Example Docker:
+#   docker exec -it govready-q-dev python3 manage.py buildcatalogsnapshots --catalog NIST_SP-800-53_rev4
+
+import os
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from controls.oscal import Catalog, CatalogData
+from controls.snapshots import CatalogSnapshot, get_snapshot_dir, get_snapshot_path
+
+
+class Command(BaseCommand):
+    help = "Write precompiled snapshots of catalogs that worker processes memory-map instead of loading catalogs from the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--catalog",
+            metavar="catalog_key",
+            nargs="+",
+            help="Only build snapshots of these catalogs (default all catalogs)",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Rebuild snapshots even if they are up to date",
+        )
+
+    def handle(self, *args, **options):
+        if get_snapshot_dir() is None:
+            raise CommandError("Catalog snapshots are turned off (gr-catalog-snapshot-dir).")
+
+        catalog_keys = list(
+            CatalogData.objects.order_by("catalog_key").values_list("catalog_key", flat=True)
+        )
+        if options["catalog"]:
+            missing = set(options["catalog"]) - set(catalog_keys)
+            if missing:
+                raise CommandError("There is no catalog {}.".format(", ".join(sorted(missing))))
+            catalog_keys = options["catalog"]
+
+        for catalog_key in catalog_keys:
+            path = get_snapshot_path(catalog_key)
+            if options["force"] and os.path.exists(path):
+                os.unlink(path)
+            # Write a new snapshot if the catalog doesn't have one for its
+            # current version.
+            Catalog.forget_catalog_version(catalog_key)
+            start = perf_counter()
+            catalog = Catalog(catalog_key=catalog_key)
+            if catalog.snapshot is None:
+                if catalog.status != "ok":
+                    raise CommandError("Could not load {}.".format(catalog_key))
+                try:
+                    CatalogSnapshot.write(catalog, catalog.catalog_version)
+                except OSError as e:
+                    raise CommandError("Could not write a snapshot of {}: {}".format(catalog_key, e))
+            built = perf_counter() - start
+
+            # Time loading the catalog again from the snapshot.
+            start = perf_counter()
+            if Catalog(catalog_key=catalog_key).snapshot is None:
+                raise CommandError("Could not write a snapshot of {}.".format(catalog_key))
+            loaded = perf_counter() - start
+            print("{}: {} ({:.1f} MB), loaded or built in {:.0f} ms, loads from snapshot in {:.0f} ms".format(
+                catalog_key, path, os.path.getsize(path) / 1024 / 1024, built * 1000, loaded * 1000))
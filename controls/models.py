@@ -943,75 +943,71 @@ class System(auto_prefetch.Model):
     def control_implementation_as_dict(self):
         pid_current = None
 
-        # Fetch all selected controls
+        # Fetch all selected controls, keyed by control id and catalog
         elm = self.root_element
-        selected_controls = elm.controls.all().values("oscal_ctl_id", "uuid")
+        selected_controls = list(
+            elm.controls.all().values("oscal_ctl_id", "oscal_catalog_key", "uuid")
+        )
+        elementcontrol_uuids = {}
+        for ec in selected_controls:
+            elementcontrol_uuids.setdefault(
+                (ec["oscal_ctl_id"], ec["oscal_catalog_key"]), ec["uuid"]
+            )
         # Get the smts_control_implementations ordered by part, e.g. pid
-        smts = elm.statements_consumed.filter(
-            statement_type=StatementTypeEnum.CONTROL_IMPLEMENTATION.name
-        ).order_by("pid")
+        smts = (
+            elm.statements_consumed.filter(
+                statement_type=StatementTypeEnum.CONTROL_IMPLEMENTATION.name
+            )
+            .select_related("producer_element")
+            .order_by("pid")
+        )
 
         smts_as_dict = {}
+        # Fragments of each control's combined statement, joined at the end
+        combined_smts = {}
+        # Status checkboxes, by status
+        status_strs = {}
 
         # Retrieve all of the existing statements
         for smt in smts:
             if smt.sid in smts_as_dict:
                 smts_as_dict[smt.sid]["control_impl_smts"].append(smt)
             else:
-
-                try:
-                    elementcontrol = self.root_element.controls.get(
-                        oscal_ctl_id=smt.sid, oscal_catalog_key=smt.sid_class
-                    )
-                    smts_as_dict[smt.sid] = {
-                        "control_impl_smts": [smt],
-                        "common_controls": [],
-                        "combined_smt": "",
-                        "elementcontrol_uuid": elementcontrol.uuid,
-                        "combined_smt_uuid": uuid.uuid4(),
-                    }
-                except ElementControl.DoesNotExist:
-                    # Handle case where Element control does not exist
-                    elementcontrol = None
-                    smts_as_dict[smt.sid] = {
-                        "control_impl_smts": [smt],
-                        "common_controls": [],
-                        "combined_smt": "",
-                        "elementcontrol_uuid": None,
-                        "combined_smt_uuid": uuid.uuid4(),
-                    }
+                # Element control is None if it does not exist
+                smts_as_dict[smt.sid] = {
+                    "control_impl_smts": [smt],
+                    "common_controls": [],
+                    "combined_smt": "",
+                    "elementcontrol_uuid": elementcontrol_uuids.get(
+                        (smt.sid, smt.sid_class)
+                    ),
+                    "combined_smt_uuid": uuid.uuid4(),
+                }
+                combined_smts[smt.sid] = []
+            combined_smt = combined_smts[smt.sid]
 
             # Build combined statement
 
-            # Define status options
-            impl_statuses = [
-                "Not implemented",
-                "Planned",
-                "Partially implemented",
-                "Implemented",
-                "Unknown",
-            ]
-            status_str = ""
-            for status in impl_statuses:
-                if (smt.status is not None) and (smt.status.lower() == status.lower()):
-                    status_str += f"[x] {status} "
-                else:
-                    status_str += f'<span style="color: #888;">[ ] {status}</span> '
-
             if smt.pid != "" and smt.pid != pid_current:
-                smts_as_dict[smt.sid]["combined_smt"] += f"{smt.pid}.\n"
+                combined_smt.append(f"{smt.pid}.\n")
                 pid_current = smt.pid
 
             if smt.producer_element:
+                if smt.status not in status_strs:
+                    status_strs[smt.status] = self._get_status_checkboxes(smt.status)
+                status_str = status_strs[smt.status]
                 smt_formatted = smt.body.replace("\n", "<br/>")
                 # TODO: Clean up special characters
                 smt_formatted = smt_formatted.replace("\u2019", "'").replace(
                     "\u2022", "<li>"
                 )
-                smts_as_dict[smt.sid][
-                    "combined_smt"
-                ] += f"<i>{smt.producer_element.name}</i><br/>{status_str}<br/><br/>\
+                combined_smt.append(
+                    f"<i>{smt.producer_element.name}</i><br/>{status_str}<br/><br/>\
                     {smt_formatted}<br/><br/>"
+                )
+
+        for sid, combined_smt in combined_smts.items():
+            smts_as_dict[sid]["combined_smt"] = "".join(combined_smt)
 
         # Populate any controls from assigned baseline that do not have statements
         for ec in selected_controls:
@@ -1020,13 +1016,33 @@ class System(auto_prefetch.Model):
                     "control_impl_smts": [],
                     "common_controls": [],
                     "combined_smt": "",
-                    "elementcontrol_uuid": ec.get("ec.uuid"),
+                    "elementcontrol_uuid": ec.get("uuid"),
                     "combined_smt_uuid": uuid.uuid4(),
                 }
 
         # Return the dictionary
         return smts_as_dict
 
+    @staticmethod
+    def _get_status_checkboxes(smt_status):
+        """Return a statement's implementation status as a row of checkboxes"""
+
+        # Define status options
+        impl_statuses = [
+            "Not implemented",
+            "Planned",
+            "Partially implemented",
+            "Implemented",
+            "Unknown",
+        ]
+        status_str = ""
+        for status in impl_statuses:
+            if (smt_status is not None) and (smt_status.lower() == status.lower()):
+                status_str += f"[x] {status} "
+            else:
+                status_str += f'<span style="color: #888;">[ ] {status}</span> '
+        return status_str
+
     @cached_property
     def controls_status_count(self):
         """Retrieve counts of control status"""
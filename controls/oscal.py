@@ -1,16 +1,33 @@
 import os
 import re
+import time
 from collections import defaultdict
+from collections.abc import Mapping
 from typing import List
 
 import auto_prefetch
 from django.db import models
+from structlog import get_logger
 
+from controls.snapshots import CatalogSnapshot
 from controls.utilities import de_oscalize_control_id, uhash
+from siteapp.utils.caches import LRUCache, approximate_sizeof
+
+logger = get_logger()
 
 CATALOG_PATH = os.path.join(os.path.dirname(__file__), "data", "catalogs")
 BASELINE_PATH = os.path.join(os.path.dirname(__file__), "data", "baselines")
 
+# Catalog.GetInstance keeps loaded Catalogs in a bounded cache, by catalog key,
+# catalog data version, and organization-defined parameter values. Catalogs
+# with parameter values share everything but the parameter-substituted
+# control descriptions with the Catalog without parameter values.
+CATALOG_CACHE_MAX_INSTANCES = 50
+CATALOG_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# How long to trust the CatalogData version seen by this process before
+# checking the database again for changes made by other processes.
+CATALOG_VERSION_CHECK_SECONDS = 10
+
 
 class CatalogData(auto_prefetch.Model):
     catalog_key = models.CharField(
@@ -33,6 +50,11 @@ class CatalogData(auto_prefetch.Model):
     created = models.DateTimeField(auto_now_add=True, db_index=True)
     updated = models.DateTimeField(auto_now=True, db_index=True)
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Catalogs loaded by this process from the old data are now stale.
+        Catalog.forget_catalog_version(self.catalog_key)
+
     def __str__(self):
         return "'%s id=%d'" % (self.catalog_key, self.id)
 
@@ -44,27 +66,38 @@ class CatalogData(auto_prefetch.Model):
 class Catalog(object):
     """Represent a catalog"""
 
-    # Create a singleton instance of this class per catalog. GetInstance returns
-    # that singleton instance. Instead of doing
+    # Get a shared instance of this class per catalog. GetInstance returns
+    # a cached instance. Instead of doing
     # `cg = Catalog(catalog_key='NIST_SP-800-53_rev4')`,
     # do `cg = Catalog.GetInstance(catalog_key='NIST_SP-800-53_rev4')`.
     @classmethod
     def GetInstance(cls, catalog_key="NIST_SP-800-53_rev4", parameter_values=dict()):
         # Create a new instance of Catalog() the first time for each
-        # catalog key / parameter combo
-        # this method is called. Keep it in memory indefinitely.
-        # Clear cache only if a catalog itself changes
+        # catalog key / catalog version / parameter combo this method is
+        # called. Keep it in memory until it is evicted by more recently
+        # used catalogs or until the catalog itself changes.
 
-        catalog_instance_key = Catalog._catalog_instance_key(
-            catalog_key, parameter_values
+        catalog_instance_key = (
+            Catalog._catalog_instance_key(catalog_key, parameter_values),
+            Catalog._get_catalog_version(catalog_key),
         )
 
-        if not hasattr(cls, catalog_instance_key):
-            new_catalog = Catalog(
-                catalog_key=catalog_key, parameter_values=parameter_values
+        def load_catalog():
+            # Catalogs with parameter values share the parts of the catalog
+            # that don't depend on parameter values with the default instance.
+            shared = None
+            if parameter_values:
+                shared = Catalog.GetInstance(catalog_key=catalog_key)
+            catalog = Catalog(
+                catalog_key=catalog_key,
+                parameter_values=parameter_values,
+                shared=shared,
             )
-            setattr(cls, catalog_instance_key, new_catalog)
-        return getattr(cls, catalog_instance_key)
+            # Controls flattened later are counted toward its cache entry's size.
+            catalog.cache_key = catalog_instance_key
+            return catalog
+
+        return catalog_cache.get_or_set(catalog_instance_key, load_catalog)
 
     @staticmethod
     def _catalog_instance_key(catalog_key, parameter_values):
@@ -74,9 +107,40 @@ class Catalog(object):
             catalog_instance_key += "_" + str(parameter_values_hash)
         return catalog_instance_key.replace("-", "_")
 
-    def __init__(self, catalog_key="NIST_SP-800-53_rev4", parameter_values=dict()):
+    # Map from catalog keys to (time checked, CatalogData updated timestamp).
+    catalog_versions = {}
+
+    @staticmethod
+    def _get_catalog_version(catalog_key):
+        now = time.monotonic()
+        checked = Catalog.catalog_versions.get(catalog_key)
+        if checked is None or now - checked[0] > CATALOG_VERSION_CHECK_SECONDS:
+            version = (
+                CatalogData.objects.filter(catalog_key=catalog_key)
+                .values_list("updated", flat=True)
+                .first()
+            )
+            checked = (now, version)
+            Catalog.catalog_versions[catalog_key] = checked
+        return checked[1]
+
+    @staticmethod
+    def forget_catalog_version(catalog_key):
+        """Check the database for the catalog's version the next time it is used"""
+        Catalog.catalog_versions.pop(catalog_key, None)
+
+    def __init__(
+        self, catalog_key="NIST_SP-800-53_rev4", parameter_values=dict(), shared=None
+    ):
         self.catalog_key = catalog_key
         self.catalog_key_display = catalog_key.replace("_", " ")
+        self.parameter_values = parameter_values
+        self.shared = shared
+        self.snapshot = None
+        self.cache_key = None
+        if shared is not None:
+            self._init_from_shared(shared)
+            return
         try:
             self.oscal = self._load_catalog_json()
             self.status = "ok"
@@ -91,23 +155,113 @@ class Catalog(object):
             self.catalog_id = None
             self.info = {}
             self.info["groups"] = None
-        # Precalculate the flattened versions of controls to improve performance
-        # WARNING TODO: This precalculation along with instance caching of controls
-        # may cause a problem in multi-tenant environment where different tenants have
-        # have different organizational defined parameters.
-        self.parameter_values = parameter_values
-        self.flattened_controls_all_as_dict = self.get_flattened_controls_all_as_dict()
-        self.flattened_controls_all_as_dict_list = (
-            self.get_flattened_controls_all_as_dict_list()
-        )
+        self._build_index()
+        # Controls are flattened the first time they are used. See FlattenedControls.
+        self.flattened_controls = FlattenedControls(self)
         self.parameters_by_control = self._cache_parameters_by_control()
 
+    def _init_from_shared(self, shared):
+        """Share everything but parameter-substituted prose with another instance of the catalog"""
+        for attr in (
+            "oscal", "status", "status_message", "catalog_id", "info",
+            "_groups_by_id", "_group_ids_by_prefix", "_controls_all",
+            "_controls_by_id", "_parent_id_by_control_id",
+            "_enhancement_ids_by_control_id", "_properties_by_control_id",
+            "_parts_by_control_id", "parameters_by_control",
+        ):
+            setattr(self, attr, getattr(shared, attr))
+
+        # Controls whose prose doesn't mention one of the parameters are the
+        # same as the shared instance's, so they are shared too.
+        self.parameter_patterns = ["{{ " + key + " }}" for key in self.parameter_values]
+        self.flattened_controls = FlattenedControls(self)
+
+    def _uses_parameter_values(self, control):
+        """Return whether the flattened control differs from the shared instance's"""
+        if any(
+            parameter["id"] in self.parameter_values
+            for parameter in control.get("parameters", [])
+        ):
+            return True
+        description = self.shared.get_flattened_control_as_dict(control)["description"]
+        return any(pattern in description for pattern in self.parameter_patterns)
+
+    def get_approximate_size(self):
+        """Estimate the memory held by this instance, not counting what it shares with another instance"""
+        # Only controls flattened so far are counted. FlattenedControls adds
+        # the controls flattened later to the size of the cache entry.
+        own_data = self.flattened_controls.flattened
+        if self.shared is None:
+            return approximate_sizeof([self.oscal, own_data])
+        shared_ids = set()
+        for cl_dict in self.shared.flattened_controls.flattened.values():
+            shared_ids.add(id(cl_dict))
+            shared_ids.update(id(value) for value in cl_dict.values())
+        return approximate_sizeof(own_data, exclude=shared_ids)
+
+    def _build_index(self):
+        """Index groups, controls and their properties and parts by id and name"""
+        # Where ids or names are repeated, the first one wins, to match
+        # what a linear search would find.
+        self._groups_by_id = {}
+        self._group_ids_by_prefix = {}
+        self._controls_all = []
+        self._controls_by_id = {}
+        self._parent_id_by_control_id = {}
+        self._enhancement_ids_by_control_id = {}
+        self._properties_by_control_id = {}
+        self._parts_by_control_id = {}
+        for group in self.get_groups():
+            self._groups_by_id.setdefault(group["id"], group)
+            self._group_ids_by_prefix.setdefault(group["id"].lower(), group["id"])
+            for control in group["controls"]:
+                self._index_control(control)
+                for control_e in control.get("controls", []):
+                    self._index_control(control_e, parent=control)
+
+    def _index_control(self, control, parent=None):
+        self._controls_all.append(control)
+        if control["id"] in self._controls_by_id:
+            return
+        self._controls_by_id[control["id"]] = control
+        if parent is not None:
+            self._parent_id_by_control_id[control["id"]] = parent["id"]
+            self._enhancement_ids_by_control_id.setdefault(parent["id"], []).append(
+                control["id"]
+            )
+        if "properties" in control:
+            properties = {}
+            for prop in control["properties"]:
+                properties.setdefault(prop["name"], prop)
+            self._properties_by_control_id[control["id"]] = properties
+        if "parts" in control:
+            parts = {}
+            for part in control["parts"]:
+                parts.setdefault(part["name"], part)
+            self._parts_by_control_id[control["id"]] = parts
+
+    def _is_indexed_control(self, control):
+        return self._controls_by_id.get(control.get("id")) is control
+
     def _load_catalog_json(self):
         """Read catalog file - JSON"""
 
+        # Use the catalog's snapshot, if there is one for the current version
+        # of the catalog, instead of loading and parsing it from the database.
+        self.snapshot = CatalogSnapshot.open(
+            self.catalog_key, Catalog._get_catalog_version(self.catalog_key)
+        )
+        if self.snapshot is not None:
+            return self.snapshot.load_oscal()
+
         # Get catalog from database
         # TODO: check for DB miss
         catalog_record = CatalogData.objects.get(catalog_key=self.catalog_key)
+        self.catalog_version = catalog_record.updated
+        Catalog.catalog_versions[self.catalog_key] = (
+            time.monotonic(),
+            self.catalog_version,
+        )
         oscal = catalog_record.catalog_json["catalog"]
         return oscal
 
@@ -135,7 +289,7 @@ class Catalog(object):
         return [item["id"] for item in search_collection]
 
     def get_group_title_by_id(self, id):
-        group = self.find_dict_by_value(self.get_groups(), "id", id)
+        group = self._groups_by_id.get(id)
         if group is None:
             return None
         return group["title"]
@@ -144,16 +298,7 @@ class Catalog(object):
         """Return group id given id of a control"""
 
         # For 800-53, 800-171, CMMC, we can match by first few characters of control ID
-        group_ids = self.get_group_ids()
-        if group_ids:
-            for group_id in group_ids:
-                if group_id.lower() == control_id[:2].lower():
-                    return group_id
-        else:
-            return None
-
-        # Group ID was not matched
-        return None
+        return self._group_ids_by_prefix.get(control_id[:2].lower())
 
     def get_controls(self):
         controls = []
@@ -166,13 +311,7 @@ class Catalog(object):
         return [item["id"] for item in search_collection]
 
     def get_controls_all(self):
-        controls = []
-        for group in self.get_groups():
-            for control in group["controls"]:
-                controls.append(control)
-                if "controls" in control:
-                    controls += [control_e for control_e in control["controls"]]
-        return controls
+        return list(self._controls_all)
 
     def get_controls_all_ids(self):
         search_collection = self.get_controls_all()
@@ -180,19 +319,24 @@ class Catalog(object):
 
     def get_control_by_id(self, control_id):
         """Return the dictionary in an array of dictionaries with a key matching a value"""
-        search_array = self.get_controls_all()
-        search_key = "id"
-        search_value = control_id
-        result_dict = next(
-            (sub for sub in search_array if sub[search_key] == search_value), None
-        )
-        return result_dict
+        return self._controls_by_id.get(control_id)
+
+    def get_control_parent_id(self, control_id):
+        """Return the id of the control that a control enhancement enhances"""
+        return self._parent_id_by_control_id.get(control_id)
+
+    def get_control_enhancement_ids(self, control_id):
+        """Return the ids of the enhancements of a control"""
+        return list(self._enhancement_ids_by_control_id.get(control_id, []))
 
     def get_control_property_by_name(self, control, property_name):
         """Return value of a property of a control by name of property"""
         if control is None:
             return None
-        prop = self.find_dict_by_value(control["properties"], "name", property_name)
+        if self._is_indexed_control(control) and "properties" in control:
+            prop = self._properties_by_control_id[control["id"]].get(property_name)
+        else:
+            prop = self.find_dict_by_value(control["properties"], "name", property_name)
         if prop is None:
             return None
         return prop["value"]
@@ -200,6 +344,8 @@ class Catalog(object):
     def get_control_part_by_name(self, control, part_name):
         """Return value of a part of a control by name of part"""
         if "parts" in control:
+            if self._is_indexed_control(control):
+                return self._parts_by_control_id[control["id"]].get(part_name)
             part = self.find_dict_by_value(control["parts"], "name", part_name)
             return part
         else:
@@ -369,6 +515,18 @@ class Catalog(object):
         If parameter_values is supplied, it will override any paramters set
         in the catalog.
         """
+        # Controls in this catalog are flattened once and kept.
+        if control is not None and self._is_indexed_control(control):
+            return self.flattened_controls[control["id"]]
+        return self._flatten_control(control)
+
+    def _flatten_control(self, control):
+        if (
+            self.shared is not None
+            and control is not None
+            and not self._uses_parameter_values(control)
+        ):
+            return self.shared.get_flattened_control_as_dict(control)
         if control is None:
             family_id = None
             description = self.get_control_prose_as_markdown(
@@ -423,25 +581,22 @@ class Catalog(object):
 
     def get_flattened_controls_all_as_dict(self):
         """Return all controls as a simplified flattened Python dictionary indexed by control ids"""
-        # Create an empty dictionary
-        cl_all_dict = {}
-        # Get all the controls
-        for cl in self.get_controls_all():
-            # Get flattened control and add to dictionary of controls
-            cl_dict = self.get_flattened_control_as_dict(cl)
-            cl_all_dict[cl_dict["id"]] = cl_dict
-        return cl_all_dict
+        # Each control is flattened when it is first looked up.
+        return self.flattened_controls
 
     def get_flattened_controls_all_as_dict_list(self):
         """Return all control dictionary in a nested Python list"""
-        # Create an empty list
-        cl_all_list = []
-        # Get all the controls
-        for cl in self.get_controls_all():
-            # Get flattened control and add to list of controls
-            cl_dict = self.get_flattened_control_as_dict(cl)
-            cl_all_list.append(cl_dict)
-        return cl_all_list
+        # Flattens every control that hasn't been flattened yet, for exporters
+        # that use the whole catalog.
+        return [self.flattened_controls[cl["id"]] for cl in self._controls_all]
+
+    @property
+    def flattened_controls_all_as_dict(self):
+        return self.get_flattened_controls_all_as_dict()
+
+    @property
+    def flattened_controls_all_as_dict_list(self):
+        return self.get_flattened_controls_all_as_dict_list()
 
     def _cache_parameters_by_control(self):
         cache = defaultdict(list)
@@ -463,6 +618,68 @@ class Catalog(object):
         return metadata.get("title", "")
 
 
+class FlattenedControls(Mapping):
+    """
+    A read-only dictionary of a catalog's flattened controls indexed by
+    control ids, which flattens each control the first time it is looked
+    up and keeps it.
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.flattened = {}
+
+    def __getitem__(self, control_id):
+        cl_dict = self.flattened.get(control_id)
+        if cl_dict is None:
+            control = self.catalog.get_control_by_id(control_id)
+            if control is None:
+                raise KeyError(control_id)
+            # Snapshots hold controls flattened without parameter values.
+            snapshot = self.catalog.snapshot
+            if (
+                snapshot is not None
+                and not self.catalog.parameter_values
+                and snapshot.has_flattened_control(control_id)
+            ):
+                cl_dict = snapshot.load_flattened_control(control_id)
+            else:
+                cl_dict = self.catalog._flatten_control(control)
+            stored = self.flattened.setdefault(control_id, cl_dict)
+            if stored is cl_dict:
+                self._count_bytes(control_id, cl_dict)
+            cl_dict = stored
+        return cl_dict
+
+    def _count_bytes(self, control_id, cl_dict):
+        # Add a newly flattened control to the size of the catalog's entry
+        # in catalog_cache, so that catalogs that are flattened after they
+        # are cached still count toward CATALOG_CACHE_MAX_BYTES.
+        if self.catalog.cache_key is None:
+            return
+        shared_ids = set()
+        if self.catalog.shared is not None:
+            shared_cl_dict = self.catalog.shared.flattened_controls.flattened.get(control_id)
+            if shared_cl_dict is not None:
+                shared_ids.add(id(shared_cl_dict))
+                shared_ids.update(id(value) for value in shared_cl_dict.values())
+        catalog_cache.add_bytes(
+            self.catalog.cache_key,
+            self.catalog,
+            approximate_sizeof(cl_dict, exclude=shared_ids),
+        )
+
+    def __contains__(self, control_id):
+        # Don't flatten a control just to check if it exists.
+        return control_id in self.catalog._controls_by_id
+
+    def __iter__(self):
+        return iter(self.catalog._controls_by_id)
+
+    def __len__(self):
+        return len(self.catalog._controls_by_id)
+
+
 class Catalogs:
     """
     Service class for enumerating Catalogs
@@ -493,3 +710,11 @@ class Catalogs:
     def catalogs(cls) -> List[Catalog]:
         """Returns a list of all Catalogs"""
         return [cls.get(key) for key in cls.keys()]
+
+
+catalog_cache = LRUCache(
+    "catalogs",
+    CATALOG_CACHE_MAX_INSTANCES,
+    maxbytes=CATALOG_CACHE_MAX_BYTES,
+    sizeof=Catalog.get_approximate_size,
+)
@@ -0,0 +1,194 @@
+"""
+Precompiled catalog snapshots.
+
+A snapshot holds a catalog's OSCAL JSON and all of its flattened controls
+(see Catalog.get_flattened_control_as_dict), each encoded with marshal, and
+an index of where each one is in the file. Worker processes memory-map the
+snapshot read-only, so the operating system shares its pages between them,
+and decode the OSCAL JSON, which is much faster than loading and parsing it
+from the database, and each flattened control only when it is first used.
+
+Snapshots are labeled with the CatalogData.updated timestamp of the catalog
+they were made from and are ignored when the catalog changes, until the
+buildcatalogsnapshots management command rebuilds them. Processes that load
+catalogs for requests never write snapshots.
+They are also specific to the Python version that wrote them because the
+marshal format can change between versions.
+"""
+
+import fcntl
+import marshal
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+from django.conf import settings
+from structlog import get_logger
+
+logger = get_logger()
+
+SNAPSHOT_MAGIC = b"GRQ-CATALOG-SNAPSHOT\n"
+SNAPSHOT_FORMAT = 1
+HEADER_LENGTH = struct.Struct("<Q")
+
+
+def get_snapshot_dir():
+    return getattr(settings, "GR_CATALOG_SNAPSHOT_DIR", None) or None
+
+
+def get_snapshot_path(catalog_key):
+    snapshot_dir = get_snapshot_dir()
+    if snapshot_dir is None:
+        return None
+    return os.path.join(snapshot_dir, catalog_key + ".snapshot")
+
+
+def get_snapshot_version(updated):
+    """Return the label of snapshots of a catalog last updated at the given time"""
+    if updated is None:
+        return None
+    return "{}/py{}.{}/marshal{}/format{}".format(
+        updated.isoformat(),
+        sys.version_info[0],
+        sys.version_info[1],
+        marshal.version,
+        SNAPSHOT_FORMAT,
+    )
+
+
+class CatalogSnapshot(object):
+    """A memory-mapped catalog snapshot"""
+
+    def __init__(self, path, data):
+        self.path = path
+        self.data = data
+        if data[: len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError("{} is not a catalog snapshot".format(path))
+        pos = len(SNAPSHOT_MAGIC)
+        (header_length,) = HEADER_LENGTH.unpack_from(data, pos)
+        pos += HEADER_LENGTH.size
+        header = marshal.loads(data[pos : pos + header_length])
+        self.body_offset = pos + header_length
+        self.catalog_key = header["catalog_key"]
+        self.version = header["version"]
+        self.oscal_span = header["oscal"]
+        self.control_spans = header["controls"]
+
+    @staticmethod
+    def open(catalog_key, updated):
+        """Return the snapshot of a catalog, or None if there isn't one for this version of the catalog"""
+        path = get_snapshot_path(catalog_key)
+        version = get_snapshot_version(updated)
+        if path is None or version is None or not os.path.exists(path):
+            return None
+        data = None
+        try:
+            with open(path, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            snapshot = CatalogSnapshot(path, data)
+        except (OSError, ValueError, EOFError, TypeError, struct.error) as e:
+            if data is not None:
+                data.close()
+            logger.warning(
+                event="catalog_snapshot_unreadable",
+                object={"object": "catalog", "catalog_key": catalog_key},
+                path=path,
+                error=str(e),
+            )
+            return None
+        if snapshot.catalog_key != catalog_key or snapshot.version != version:
+            snapshot.close()
+            return None
+        return snapshot
+
+    def close(self):
+        self.data.close()
+
+    def _load(self, span):
+        offset, length = span
+        start = self.body_offset + offset
+        return marshal.loads(self.data[start : start + length])
+
+    def load_oscal(self):
+        return self._load(self.oscal_span)
+
+    def has_flattened_control(self, control_id):
+        return control_id in self.control_spans
+
+    def load_flattened_control(self, control_id):
+        return self._load(self.control_spans[control_id])
+
+    @staticmethod
+    def write(catalog, updated):
+        """Write a snapshot of a Catalog, replacing any existing snapshot of an older version of the catalog"""
+        path = get_snapshot_path(catalog.catalog_key)
+        version = get_snapshot_version(updated)
+        if path is None or version is None:
+            return None
+
+        # Only one process at a time writes a catalog's snapshot, and it
+        # isn't written again if another process just wrote it.
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            snapshot = CatalogSnapshot.open(catalog.catalog_key, updated)
+            if snapshot is not None:
+                snapshot.close()
+                return path
+            CatalogSnapshot._write(catalog, path, version)
+        return path
+
+    @staticmethod
+    def _write(catalog, path, version):
+        # Encode the parts of the snapshot.
+        parts = [marshal.dumps(catalog.oscal)]
+        controls = {}
+        offset = len(parts[0])
+        for control in catalog.get_controls_all():
+            if control["id"] in controls:
+                continue
+            # Flatten without keeping the flattened control in the Catalog,
+            # which will read it from the snapshot when it's used.
+            part = marshal.dumps(catalog._flatten_control(control))
+            controls[control["id"]] = (offset, len(part))
+            parts.append(part)
+            offset += len(part)
+        header = marshal.dumps(
+            {
+                "catalog_key": catalog.catalog_key,
+                "version": version,
+                "oscal": (0, len(parts[0])),
+                "controls": controls,
+            }
+        )
+
+        # Write to a temporary file and then move it into place, so that
+        # other processes never see a partially written snapshot. Processes
+        # that have mapped the old snapshot keep using it. mkstemp creates
+        # the file readable only by its owner, so it is given the usual
+        # permissions of a new file.
+        fd, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path), prefix=".", suffix=".tmp"
+        )
+        umask = os.umask(0)
+        os.umask(umask)
+        try:
+            os.fchmod(fd, 0o666 & ~umask)
+            with os.fdopen(fd, "wb") as f:
+                f.write(SNAPSHOT_MAGIC)
+                f.write(HEADER_LENGTH.pack(len(header)))
+                f.write(header)
+                for part in parts:
+                    f.write(part)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        logger.info(
+            event="catalog_snapshot_write",
+            object={"object": "catalog", "catalog_key": catalog.catalog_key},
+            path=path,
+            version=version,
+        )
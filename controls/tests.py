@@ -19,6 +19,7 @@ from controls.models import (
     STATEMENT_SYNCHED,
     Deployment,
     Element,
+    ElementControl,
     ElementRole,
     ImportRecord,
     OrgParams,
@@ -27,7 +28,8 @@ from controls.models import (
     System,
 )
 from controls.oscal import Catalog, Catalogs, de_oscalize_control_id
-from controls.views import OSCAL_ssp_export
+from controls.views import OSCAL_ssp_export, iter_controls_with_statement_bodies
+from guidedmodules.tests import TestCaseWithFixtureData
 from siteapp.models import Organization, OrganizationalSetting, Project, User
 from siteapp.tests import (
     OrganizationSiteFunctionalTests,
@@ -757,6 +759,84 @@ class SystemUnitTests(TestCase):
         self.assertTrue(smt_2_updated.status, control_status)
 
 
+    def test_control_implementation_as_dict(self):
+        sre = Element.objects.create(name="New Element", element_type="system")
+        s = System.objects.create(root_element=sre)
+        catalog_key = "NIST_SP-800-53_rev4"
+        ec_uuids = {}
+        for sid in ("au-3", "au-4", "au-5"):
+            ec_uuids[sid] = ElementControl.objects.create(element=sre, oscal_ctl_id=sid, oscal_catalog_key=catalog_key).uuid
+        components = [Element.objects.create(name="Component {}".format(i), element_type="system_element") for i in range(3)]
+        for component in components:
+            for sid, pid in (("au-3", ""), ("au-4", "a"), ("au-4", "b"), ("ac-2", "")):
+                Statement.objects.create(
+                    sid=sid,
+                    sid_class=catalog_key,
+                    pid=pid,
+                    body="{} statement\nfor {}.".format(component.name, sid),
+                    statement_type=StatementTypeEnum.CONTROL_IMPLEMENTATION.name,
+                    status="Implemented" if sid == "au-3" else "Planned",
+                    producer_element=component,
+                    consumer_element=sre,
+                )
+
+        # The number of queries doesn't depend on the number of controls or statements.
+        s = System.objects.select_related("root_element").get(id=s.id)
+        with self.assertNumQueries(2):
+            smts_as_dict = s.control_implementation_as_dict
+        self.assertEqual(list(smts_as_dict), ["au-3", "ac-2", "au-4", "au-5"])
+        self.assertEqual(len(smts_as_dict["au-4"]["control_impl_smts"]), 6)
+        self.assertEqual(smts_as_dict["au-3"]["elementcontrol_uuid"], ec_uuids["au-3"])
+        self.assertIsNone(smts_as_dict["ac-2"]["elementcontrol_uuid"])
+        self.assertEqual(smts_as_dict["au-5"]["elementcontrol_uuid"], ec_uuids["au-5"])
+        self.assertEqual(smts_as_dict["au-5"]["combined_smt"], "")
+        combined_smt = smts_as_dict["au-3"]["combined_smt"]
+        self.assertTrue(combined_smt.startswith("<i>Component 0</i><br/>"))
+        self.assertEqual(combined_smt.count("[x] Implemented "), 3)
+        self.assertIn("Component 2 statement<br/>for au-3.<br/><br/>", combined_smt)
+        self.assertEqual(smts_as_dict["au-4"]["combined_smt"].count("a.\n"), 1)
+        self.assertEqual(smts_as_dict["au-4"]["combined_smt"].count("b.\n"), 1)
+        self.assertIn('<span style="color: #888;">[ ] Implemented</span> ', smts_as_dict["au-4"]["combined_smt"])
+
+    def test_controls_selected_export_xacta_xslx(self):
+        import io
+
+        from openpyxl import load_workbook
+
+        sre = Element.objects.create(name="New Element", element_type="system")
+        s = System.objects.create(root_element=sre)
+        catalog_key = "NIST_SP-800-53_rev5"
+        for sid in ("au-3", "au-4", "au-5"):
+            ElementControl.objects.create(element=sre, oscal_ctl_id=sid, oscal_catalog_key=catalog_key)
+        for i in range(2):
+            component = Element.objects.create(name="Component {}".format(i), element_type="system_element")
+            for sid in ("au-3", "au-4", "ac-2"):
+                Statement.objects.create(sid=sid, sid_class=catalog_key, body="{} for {}. ".format(component.name, sid),
+                                         statement_type=StatementTypeEnum.CONTROL_IMPLEMENTATION.name,
+                                         producer_element=component, consumer_element=sre)
+        u = User.objects.create(username="Jane2", email="jane@example.com")
+        s.assign_owner_permissions(u)
+        self.client.force_login(u)
+
+        # Statements are read a chunk of controls at a time.
+        with self.assertNumQueries(5):
+            controls = list(iter_controls_with_statement_bodies(sre, chunk_size=2))
+        self.assertEqual([(control.oscal_ctl_id, len(smts)) for control, smts in controls],
+                         [("au-3", 2), ("au-4", 2), ("au-5", 0)])
+
+        resp = self.client.get("/systems/{}/controls/selected/export/xacta/xlsx".format(s.id))
+        self.assertEqual(resp.status_code, 200)
+        ws = load_workbook(io.BytesIO(b"".join(resp.streaming_content))).active
+        self.assertEqual(ws.title, "Controls_Implementation")
+        self.assertEqual([c.value for c in ws[1]][:3], ["Paragraph/ReqID", "Title", "Private Implementation"])
+        self.assertEqual(ws.max_column, 17)
+        self.assertEqual(ws.column_dimensions["C"].width, 80)
+        self.assertEqual([[c.value for c in row][:3] for row in ws.iter_rows(min_row=2)], [
+            ["AU-3", "Content of Audit Records", "Component 0 for au-3. Component 1 for au-3. "],
+            ["AU-4", "Audit Log Storage Capacity", "Component 0 for au-4. Component 1 for au-4. "],
+            ["AU-5", "Response to Audit Logging Process Failures", None],
+        ])
+
 class SystemUITests(OrganizationSiteFunctionalTests):
 
     # Skip test since it's reliant on a new project being created.
@@ -830,6 +910,39 @@ class PoamUnitTests(TestCase):
         self.assertTrue(poam.poam_group == "New POA&M Group")
         poam.save()
 
+    def test_poam_export(self):
+        import csv
+        import io
+
+        from openpyxl import load_workbook
+
+        e = Element.objects.create(name="New Element 2", element_type="system")
+        s = System.objects.create(root_element=e)
+        for i in range(3):
+            smt = Statement.objects.create(body="Weakness {}".format(i), statement_type="POAM", status="Open", consumer_element=e)
+            Poam.objects.create(statement=smt, poam_id=i + 1, weakness_name="Weakness Name {}".format(i))
+        u = User.objects.create(username="Jane2", email="jane@example.com")
+        s.assign_owner_permissions(u)
+        self.client.force_login(u)
+
+        resp = self.client.get("/systems/{}/poams/export/csv".format(s.id))
+        self.assertEqual(resp.status_code, 200)
+        rows = list(csv.reader(io.StringIO(b"".join(resp.streaming_content).decode("utf8"))))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[0][:3], ["POA&M ID", "POA&M Group", "Weakness Name"])
+        self.assertEqual(rows[0][-2:], ["Scheduled Completion Date", "URL"])
+        self.assertEqual(rows[1][:3], ["V-1", "", "Weakness Name 0"])
+        self.assertEqual(rows[3][4:6], ["Weakness 2", "Open"])
+        self.assertTrue(rows[3][-1].endswith("/systems/{}/poams/{}/edit".format(s.id, smt.id)))
+
+        resp = self.client.get("/systems/{}/poams/export/xlsx".format(s.id))
+        self.assertEqual(resp.status_code, 200)
+        ws = load_workbook(io.BytesIO(b"".join(resp.streaming_content))).active
+        self.assertEqual(ws.title, "POA&Ms")
+        self.assertEqual([[c.value for c in row] for row in ws.iter_rows()], [
+            [None if value == "" else value for value in row] for row in rows
+        ])
+
 
 class OrgParamTests(SeleniumTest):
     """Class for OrgParam Unit Tests"""
@@ -1207,6 +1320,59 @@ class ControlComponentTests(OrganizationSiteFunctionalTests):
         submit_comp_statement.click()
 
 
+class ProjectExportTests(TestCaseWithFixtureData):
+    def setUp(self):
+        self.system = System.objects.create(root_element=Element.objects.create(name="My System", element_type="system"))
+        self.project.system = self.system
+        self.project.save()
+        self.system.assign_owner_permissions(self.user)
+        self.client.force_login(self.user)
+
+    def export(self, **params):
+        resp = self.client.get("/systems/{}/export".format(self.project.id), params)
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp["Content-Disposition"].startswith('attachment; filename="'))
+        return b"".join(resp.streaming_content).decode("utf8")
+
+    def test_project_export(self):
+        from datetime import datetime, timezone
+        root_element = self.system.root_element
+        for name in ("Component B", "Component A"):
+            component = Element.objects.create(name=name, element_type="system_element")
+            for sid in ("ac-2", "ac-3"):
+                Statement.objects.create(sid=sid, sid_class="NIST_SP-800-53_rev4", body="{} {}".format(name, sid),
+                                         statement_type=StatementTypeEnum.CONTROL_IMPLEMENTATION.name,
+                                         producer_element=component, consumer_element=root_element)
+        for i in range(3):
+            smt = Statement.objects.create(body="Weakness {}".format(i), statement_type="POAM", status="Open", consumer_element=root_element)
+            Poam.objects.create(statement=smt, poam_id=i + 1,
+                                scheduled_completion_date=datetime(2021, 10, i + 1, tzinfo=timezone.utc))
+
+        content = self.export()
+        data = json.loads(content)
+        # The streamed JSON is formatted like json.dumps.
+        self.assertEqual(content, json.dumps(data, indent=2))
+        self.assertEqual(data["schema"], "GovReady Q Project Export Data 1.0")
+        self.assertEqual(data["project"]["title"], self.project.title)
+        self.assertEqual(
+            [comp["component-definition"]["metadata"]["title"] for comp in data["component-definitions"]],
+            ["Component A", "Component B"])
+        self.assertEqual(
+            [impl["implemented-requirements"][0]["description"] for impl in
+             data["component-definitions"][0]["component-definition"]["components"][0]["control-implementations"]],
+            ["Component A ac-2", "Component A ac-3"])
+        self.assertEqual([poam["statement"]["body"] for poam in data["poams"]], ["Weakness 0", "Weakness 1", "Weakness 2"])
+        self.assertEqual(data["poams"][2]["scheduled_completion_date"], "2021-10-03T00:00:00Z")
+
+    def test_project_export_file_references(self):
+        from unittest.mock import patch
+        from siteapp.models import Project as ProjectModel
+        with patch.object(ProjectModel, "export_json", return_value={ "schema": "schema", "project": {} }) as export_json:
+            data = json.loads(self.export(file_content="references"))
+        export_json.assert_called_once_with(include_metadata=True, include_file_content=False)
+        self.assertEqual(data, { "schema": "schema", "project": {}, "component-definitions": [], "poams": [] })
+
+
 class ControlTestHelper(object):
     def create_simple_import_record(self):
         # Create an Import Record with a component and statement
@@ -1314,6 +1480,149 @@ class CatalogTests(TestCase):
         )
         self.assertEqual(catalog.catalog_title, expected_title)
 
+    def test_catalog_index(self):
+        catalog = Catalog.GetInstance(Catalogs.NIST_SP_800_53_rev5)
+        controls = catalog.get_controls_all()
+        self.assertGreater(len(controls), 1000)
+        for control in controls:
+            self.assertIs(catalog.get_control_by_id(control["id"]), control)
+            self.assertEqual(
+                catalog.get_control_property_by_name(control, "sort-id"),
+                catalog.find_dict_by_value(control["properties"], "name", "sort-id")["value"],
+            )
+        self.assertIsNone(catalog.get_control_by_id("xx-1"))
+        self.assertEqual(catalog.get_group_id_by_control_id("ac-2"), "ac")
+        self.assertEqual(catalog.get_group_id_by_control_id("AC-2"), "ac")
+        self.assertIsNone(catalog.get_group_id_by_control_id("xx-2"))
+        self.assertEqual(catalog.get_group_title_by_id("ac"), "Access Control")
+        self.assertEqual(catalog.get_control_parent_id("ac-2.1"), "ac-2")
+        self.assertIsNone(catalog.get_control_parent_id("ac-2"))
+        self.assertIn("ac-2.1", catalog.get_control_enhancement_ids("ac-2"))
+        control = catalog.get_control_by_id("ac-2")
+        self.assertEqual(catalog.get_control_part_by_name(control, "guidance")["name"], "guidance")
+        self.assertIsNone(catalog.get_control_part_by_name(control, "xyzzy"))
+
+        # The flattened map and list share their dicts.
+        flat = catalog.get_flattened_controls_all_as_dict()
+        self.assertEqual(len(catalog.get_flattened_controls_all_as_dict_list()), len(controls))
+        for cl_dict in catalog.get_flattened_controls_all_as_dict_list():
+            self.assertIs(flat[cl_dict["id"]], cl_dict)
+        self.assertEqual(flat["ac-2.1"]["family_id"], "ac")
+
+    def test_catalog_lazy_flattening(self):
+        catalog = Catalog(Catalogs.NIST_SP_800_53_rev5)
+        self.assertEqual(len(catalog.flattened_controls.flattened), 0)
+
+        # Looking up a control flattens only that control, once.
+        flat = catalog.get_flattened_controls_all_as_dict()
+        self.assertIn("ac-2", flat)
+        self.assertNotIn("xx-2", flat)
+        self.assertEqual(len(catalog.flattened_controls.flattened), 0)
+        cl_dict = flat["ac-2"]
+        self.assertEqual(cl_dict["title"], "Account Management")
+        self.assertEqual(list(catalog.flattened_controls.flattened), ["ac-2"])
+        self.assertIs(flat["ac-2"], cl_dict)
+        self.assertIs(catalog.get_flattened_control_as_dict(catalog.get_control_by_id("ac-2")), cl_dict)
+
+        # The list flattens every control, as before.
+        cl_list = catalog.get_flattened_controls_all_as_dict_list()
+        self.assertEqual(len(cl_list), len(catalog.get_controls_all()))
+        self.assertEqual(len(catalog.flattened_controls.flattened), len(flat))
+        self.assertEqual(dict(flat), { cl["id"]: catalog._flatten_control(catalog.get_control_by_id(cl["id"])) for cl in cl_list })
+
+    def test_catalog_instance_cache(self):
+        from controls.oscal import CatalogData, catalog_cache
+        catalog = Catalog.GetInstance(Catalogs.NIST_SP_800_53_rev5)
+        self.assertIs(Catalog.GetInstance(Catalogs.NIST_SP_800_53_rev5), catalog)
+        self.assertGreater(catalog_cache.stats()["bytes"], 0)
+
+        # Catalogs with organization-defined parameters share the catalog data and
+        # the flattened controls that don't mention the parameters.
+        parameter_values = {"ac-1_prm_2": "every 12 parsecs", "ac-2.2_prm_2": "right away"}
+        catalog_p = Catalog.GetInstance(Catalogs.NIST_SP_800_53_rev5, parameter_values=parameter_values)
+        self.assertIsNot(catalog_p, catalog)
+        self.assertIs(catalog_p.oscal, catalog.oscal)
+        self.assertIs(catalog_p.get_control_by_id("ac-2"), catalog.get_control_by_id("ac-2"))
+        flat, flat_p = catalog.get_flattened_controls_all_as_dict(), catalog_p.get_flattened_controls_all_as_dict()
+        self.assertIs(flat_p["ac-3"], flat["ac-3"])
+        self.assertIn("every 12 parsecs", flat_p["ac-1"]["description"])
+        self.assertIn("right away", flat_p["ac-2.2"]["description"])
+        self.assertEqual(flat_p, Catalog(Catalogs.NIST_SP_800_53_rev5, parameter_values=parameter_values).get_flattened_controls_all_as_dict())
+        self.assertLess(catalog_p.get_approximate_size(), catalog.get_approximate_size() / 10)
+
+        # Changing the catalog data loads a new instance.
+        CatalogData.objects.get(catalog_key=Catalogs.NIST_SP_800_53_rev5).save()
+        self.assertIsNot(Catalog.GetInstance(Catalogs.NIST_SP_800_53_rev5), catalog)
+
+    def test_catalog_cache_counts_flattened_controls(self):
+        from controls.oscal import catalog_cache
+        catalog_cache.clear()
+        catalog = Catalog.GetInstance(Catalogs.NIST_SP_800_53_rev5)
+        size = catalog_cache.sizes[catalog.cache_key]
+        catalog.get_flattened_controls_all_as_dict_list()
+        self.assertGreater(catalog_cache.sizes[catalog.cache_key], size)
+
+        # A catalog whose controls are flattened after it is cached evicts
+        # older catalogs when the cache is over its byte limit.
+        other = Catalog.GetInstance(Catalogs.NIST_SP_800_171_rev1)
+        catalog_cache.maxbytes, maxbytes = catalog_cache.stats()["bytes"], catalog_cache.maxbytes
+        try:
+            other.get_flattened_controls_all_as_dict_list()
+            self.assertNotIn(catalog.cache_key, catalog_cache)
+            self.assertIn(other.cache_key, catalog_cache)
+        finally:
+            catalog_cache.maxbytes = maxbytes
+
+    def test_catalog_snapshot(self):
+        import tempfile
+        from django.core.management import call_command
+        from django.test import override_settings
+        from datetime import datetime, timezone
+        from unittest.mock import patch
+        from controls.oscal import CatalogData
+        from controls.snapshots import CatalogSnapshot
+        with tempfile.TemporaryDirectory() as snapshot_dir, override_settings(GR_CATALOG_SNAPSHOT_DIR=snapshot_dir):
+            # Loading a catalog from the database doesn't write a snapshot.
+            catalog = Catalog(Catalogs.NIST_SP_800_53_rev5)
+            self.assertIsNone(catalog.snapshot)
+            self.assertEqual(os.listdir(snapshot_dir), [])
+
+            # The management command builds snapshots of all catalogs,
+            # readable by other users.
+            call_command("buildcatalogsnapshots", stdout=open(os.devnull, "w"))
+            for catalog_data in CatalogData.objects.all():
+                self.assertTrue(os.path.exists(os.path.join(snapshot_dir, catalog_data.catalog_key + ".snapshot")))
+            catalog = Catalog(Catalogs.NIST_SP_800_53_rev5)
+            self.assertIsNotNone(catalog.snapshot)
+            self.assertEqual(len(catalog.flattened_controls.flattened), 0)
+            path = catalog.snapshot.path
+            self.assertEqual(os.stat(path).st_mode & 0o044, 0o044)
+
+            # A snapshot of another version of the catalog is closed and
+            # not used.
+            with patch.object(CatalogSnapshot, "close", autospec=True, side_effect=CatalogSnapshot.close) as close:
+                self.assertIsNone(CatalogSnapshot.open(Catalogs.NIST_SP_800_53_rev5, datetime.now(timezone.utc)))
+            close.assert_called_once()
+
+            # Later loads read the snapshot instead of the database.
+            with self.assertNumQueries(0):
+                catalog_s = Catalog(Catalogs.NIST_SP_800_53_rev5)
+            self.assertEqual(catalog_s.snapshot.version, catalog.snapshot.version)
+            self.assertEqual(catalog_s.oscal, catalog.oscal)
+            control = catalog_s.get_control_by_id("ac-2")
+            self.assertEqual(catalog_s.get_flattened_control_as_dict(control), catalog_s._flatten_control(control))
+
+            # A changed catalog is loaded from the database until its
+            # snapshot is rebuilt.
+            CatalogData.objects.get(catalog_key=Catalogs.NIST_SP_800_53_rev5).save()
+            catalog_c = Catalog(Catalogs.NIST_SP_800_53_rev5)
+            self.assertIsNone(catalog_c.snapshot)
+            self.assertEqual(catalog_c.oscal, catalog.oscal)
+            call_command("buildcatalogsnapshots", "--catalog", Catalogs.NIST_SP_800_53_rev5, stdout=open(os.devnull, "w"))
+            catalog_c = Catalog(Catalogs.NIST_SP_800_53_rev5)
+            self.assertNotEqual(catalog_c.snapshot.version, catalog.snapshot.version)
+            self.assertEqual(catalog_c.oscal, catalog.oscal)
+
 
 class CatalogsTest(TestCase):
     def test_catalogs_keys(self):
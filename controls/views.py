@@ -88,7 +88,7 @@ def index(request):
     """Index page for controls"""
 
     # Get catalog
-    catalog = Catalog()
+    catalog = Catalog.GetInstance()
     control_groups = catalog.get_groups()
     context = {
         "catalog": catalog,
@@ -115,7 +115,7 @@ def catalog(request, catalog_key, system_id=None):
         system = System.objects.get(pk=system_id)
 
     # Get catalog
-    catalog = Catalog(catalog_key)
+    catalog = Catalog.GetInstance(catalog_key)
     control_groups = catalog.get_groups()
     context = {
         "catalog": catalog,
@@ -131,7 +131,7 @@ def group(request, catalog_key, g_id):
     """Temporary index page for catalog control group"""
 
     # Get catalog
-    catalog = Catalog(catalog_key)
+    catalog = Catalog.GetInstance(catalog_key)
     control_groups = catalog.get_groups()
     group = None
     # Get group/family of controls
@@ -156,7 +156,7 @@ def control(request, catalog_key, cl_id):
     catalog_key = oscalize_catalog_key(catalog_key)
 
     # Get catalog
-    catalog = Catalog(catalog_key)
+    catalog = Catalog.GetInstance(catalog_key)
     cg_flat = catalog.get_flattened_controls_all_as_dict()
     # Prepare links
     links = []
@@ -1013,6 +1013,10 @@ class OSCALComponentSerializer(ComponentSerializer):
         return source
 
     def as_json(self):
+        oscal_string = json.dumps(self.as_dict(), sort_keys=False, indent=2)
+        return oscal_string
+
+    def as_dict(self):
         # Build OSCAL
         comp_uuid = str(self.element.uuid)
         control_implementations = []
@@ -1120,8 +1124,7 @@ class OSCALComponentSerializer(ComponentSerializer):
                 "control-implementations", None
             )
 
-        oscal_string = json.dumps(of, sort_keys=False, indent=2)
-        return oscal_string
+        return of
 
 
 class OpenControlComponentSerializer(ComponentSerializer):
@@ -1963,400 +1966,79 @@ def controls_selected_export_xacta_xslx(request, system_id):
     system = System.objects.get(id=system_id)
     # Retrieve related selected controls if user has permission on system
     if request.user.has_perm("view_system", system):
-        # Retrieve primary system Project
-        controls = system.root_element.controls.all()
-
-        # Retrieve any related Implementation Statements
-        impl_smts = system.root_element.statements_consumed.all()
-        impl_smts_by_sid = {}
-        for smt in impl_smts:
-            if smt.sid in impl_smts_by_sid:
-                impl_smts_by_sid[smt.sid].append(smt)
-            else:
-                impl_smts_by_sid[smt.sid] = [smt]
-
-        for control in controls:
-            if control.oscal_ctl_id in impl_smts_by_sid:
-                setattr(control, "impl_smts", impl_smts_by_sid[control.oscal_ctl_id])
-            else:
-                setattr(control, "impl_smts", None)
-
-        from tempfile import NamedTemporaryFile
-
-        from openpyxl import Workbook
-        from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
-
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Controls_Implementation"
-
-        # Add in field name row
-        # Paragraph/ReqID
-        c = ws.cell(row=1, column=1, value="Paragraph/ReqID")
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        c.border = Border(
-            left=Side(border_style="thin", color="444444"),
-            right=Side(border_style="thin", color="444444"),
-            bottom=Side(border_style="thin", color="444444"),
-            outline=Side(border_style="thin", color="444444"),
-        )
-
-        # Stated Requirement (Control statement/Requirement)
-        c = ws.cell(row=1, column=2, value="Title")
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        ws.column_dimensions["B"].width = 30
-        c.border = Border(
-            right=Side(border_style="thin", color="444444"),
-            bottom=Side(border_style="thin", color="444444"),
-            outline=Side(border_style="thin", color="444444"),
-        )
-
-        # Private Implementation
-        c = ws.cell(row=1, column=3, value="Private Implementation")
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        ws.column_dimensions["C"].width = 80
-        c.border = Border(
-            right=Side(border_style="thin", color="444444"),
-            bottom=Side(border_style="thin", color="444444"),
-            outline=Side(border_style="thin", color="444444"),
-        )
-
-        # Public Implementation
-        c = ws.cell(row=1, column=4, value="Public Implementation")
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        ws.column_dimensions["D"].width = 80
-        c.border = Border(
-            right=Side(border_style="thin", color="444444"),
-            bottom=Side(border_style="thin", color="444444"),
-            outline=Side(border_style="thin", color="444444"),
-        )
-
-        # Notes
-        c = ws.cell(row=1, column=5, value="Notes")
-        ws.column_dimensions["E"].width = 60
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        c.border = Border(
-            right=Side(border_style="thin", color="444444"),
-            bottom=Side(border_style="thin", color="444444"),
-            outline=Side(border_style="thin", color="444444"),
-        )
-
-        # Status ["Implemented", "Planned"]
-        c = ws.cell(row=1, column=6, value="Status")
-        ws.column_dimensions["F"].width = 15
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        c.border = Border(
-            right=Side(border_style="thin", color="444444"),
-            bottom=Side(border_style="thin", color="444444"),
-            outline=Side(border_style="thin", color="444444"),
-        )
-
-        # Expected Completion (expected implementation)
-        c = ws.cell(row=1, column=7, value="Expected Completion")
-        ws.column_dimensions["G"].width = 20
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        c.border = Border(
-            right=Side(border_style="thin", color="444444"),
-            bottom=Side(border_style="thin", color="444444"),
-            outline=Side(border_style="thin", color="444444"),
-        )
-
-        # Class ["Management", "Operational", "Technical",
-        c = ws.cell(row=1, column=8, value="Class")
-        ws.column_dimensions["H"].width = 15
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        c.border = Border(
-            right=Side(border_style="thin", color="444444"),
-            bottom=Side(border_style="thin", color="444444"),
-            outline=Side(border_style="thin", color="444444"),
-        )
-
-        # Priority ["p0", "P1", "P2", "P3"]
-        c = ws.cell(row=1, column=9, value="Priority")
-        ws.column_dimensions["I"].width = 15
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        c.border = Border(
-            right=Side(border_style="thin", color="444444"),
-            bottom=Side(border_style="thin", color="444444"),
-            outline=Side(border_style="thin", color="444444"),
-        )
-
-        # Responsible Entities
-        c = ws.cell(row=1, column=10, value="Responsible Entities")
-        ws.column_dimensions["J"].width = 20
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        c.border = Border(
-            right=Side(border_style="thin", color="444444"),
-            bottom=Side(border_style="thin", color="444444"),
-            outline=Side(border_style="thin", color="444444"),
-        )
-
-        # Control Owner(s)
-        c = ws.cell(row=1, column=11, value="Control Owner(s)")
-        ws.column_dimensions["K"].width = 15
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        c.border = Border(
-            right=Side(border_style="thin", color="444444"),
-            bottom=Side(border_style="thin", color="444444"),
-            outline=Side(border_style="thin", color="444444"),
-        )
-
-        # Type ["System-Specific", "Hybrid", "Inherited", "Common", "blank"]
-        c = ws.cell(row=1, column=12, value="Type")
-        ws.column_dimensions["L"].width = 15
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        c.border = Border(
-            right=Side(border_style="thin", color="444444"),
-            bottom=Side(border_style="thin", color="444444"),
-            outline=Side(border_style="thin", color="444444"),
-        )
-
-        # Inherited From
-        c = ws.cell(row=1, column=13, value="Inherited From")
-        ws.column_dimensions["M"].width = 20
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        c.border = Border(
-            right=Side(border_style="thin", color="444444"),
-            bottom=Side(border_style="thin", color="444444"),
-            outline=Side(border_style="thin", color="444444"),
-        )
-
-        # Provide As ["Do Not Share", "blank"]
-        c = ws.cell(row=1, column=14, value="Provide As")
-        ws.column_dimensions["N"].width = 15
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        c.border = Border(
-            right=Side(border_style="thin", color="444444"),
-            bottom=Side(border_style="thin", color="444444"),
-            outline=Side(border_style="thin", color="444444"),
-        )
-
-        # Evaluation Status ["Evaluated", "Expired", "Not Evaluated", "Unknown", "blank"]
-        c = ws.cell(row=1, column=15, value="Evaluation Status")
-        ws.column_dimensions["O"].width = 15
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        c.border = Border(
-            right=Side(border_style="thin", color="444444"),
-            bottom=Side(border_style="thin", color="444444"),
-            outline=Side(border_style="thin", color="444444"),
-        )
-
-        # Control Origination
-        c = ws.cell(row=1, column=16, value="Control Origination")
-        ws.column_dimensions["P"].width = 15
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        c.border = Border(
-            right=Side(border_style="thin", color="444444"),
-            bottom=Side(border_style="thin", color="444444"),
-            outline=Side(border_style="thin", color="444444"),
-        )
-
-        # History
-        c = ws.cell(row=1, column=17, value="History")
-        ws.column_dimensions["Q"].width = 15
-        c.fill = PatternFill("solid", fgColor="5599FE")
-        c.font = Font(color="FFFFFF", bold=True)
-        c.border = Border(
-            right=Side(border_style="thin", color="444444"),
-            bottom=Side(border_style="thin", color="444444"),
-            outline=Side(border_style="thin", color="444444"),
-        )
-
-        for row in range(2, len(controls) + 1):
-            control = controls[row - 2]
-
-            # Paragraph/ReqID
-            c = ws.cell(
-                row=row,
-                column=1,
-                value=control.get_flattened_oscal_control_as_dict()[
-                    "id_display"
-                ].upper(),
-            )
-            c.fill = PatternFill("solid", fgColor="FFFF99")
-            c.alignment = Alignment(vertical="top", wrapText=True)
-            c.border = Border(
-                left=Side(border_style="thin", color="444444"),
-                right=Side(border_style="thin", color="444444"),
-                bottom=Side(border_style="thin", color="444444"),
-                outline=Side(border_style="thin", color="444444"),
-            )
-
-            # Title
-            c = ws.cell(
-                row=row,
-                column=2,
-                value=control.get_flattened_oscal_control_as_dict()["title"],
-            )
-            c.fill = PatternFill("solid", fgColor="FFFF99")
-            c.alignment = Alignment(vertical="top", wrapText=True)
-            c.border = Border(
-                right=Side(border_style="thin", color="444444"),
-                bottom=Side(border_style="thin", color="444444"),
-                outline=Side(border_style="thin", color="444444"),
-            )
-
-            # Private Implementation
-            smt_combined = ""
-            if control.impl_smts:
-                for smt in control.impl_smts:
-                    smt_combined += smt.body
-            c = ws.cell(row=row, column=3, value=smt_combined)
-            c.alignment = Alignment(vertical="top", wrapText=True)
-            c.border = Border(
-                right=Side(border_style="thin", color="444444"),
-                bottom=Side(border_style="thin", color="444444"),
-                outline=Side(border_style="thin", color="444444"),
-            )
-
-            # Public Implementation
-            c.alignment = Alignment(vertical="top", wrapText=True)
-            c.border = Border(
-                right=Side(border_style="thin", color="444444"),
-                bottom=Side(border_style="thin", color="444444"),
-                outline=Side(border_style="thin", color="444444"),
-            )
-
-            # Notes
-            c = ws.cell(row=1, column=5, value="Notes")
-            c.border = Border(
-                right=Side(border_style="thin", color="444444"),
-                bottom=Side(border_style="thin", color="444444"),
-                outline=Side(border_style="thin", color="444444"),
-            )
-
-            # Status ["Implemented", "Planned"]
-            c = ws.cell(row=1, column=6, value="Status")
-            c.border = Border(
-                right=Side(border_style="thin", color="444444"),
-                bottom=Side(border_style="thin", color="444444"),
-                outline=Side(border_style="thin", color="444444"),
-            )
-
+        from .spreadsheets import HEADER_LEFT_STYLE, HEADER_STYLE, cell_style, xlsx_response
+
+        columns = [
+            ("Paragraph/ReqID", None, HEADER_LEFT_STYLE),
+            # Stated Requirement (Control statement/Requirement)
+            ("Title", 30, HEADER_STYLE),
+            ("Private Implementation", 80, HEADER_STYLE),
+            ("Public Implementation", 80, HEADER_STYLE),
+            ("Notes", 60, HEADER_STYLE),
+            # ["Implemented", "Planned"]
+            ("Status", 15, HEADER_STYLE),
             # Expected Completion (expected implementation)
-            c = ws.cell(row=1, column=7, value="Expected Completion")
-            c.border = Border(
-                right=Side(border_style="thin", color="444444"),
-                bottom=Side(border_style="thin", color="444444"),
-                outline=Side(border_style="thin", color="444444"),
-            )
-
-            # Class ["Management", "Operational", "Technical",
-            c = ws.cell(row=1, column=8, value="Class")
-            c.border = Border(
-                right=Side(border_style="thin", color="444444"),
-                bottom=Side(border_style="thin", color="444444"),
-                outline=Side(border_style="thin", color="444444"),
-            )
-
-            # Priority ["p0", "P1", "P2", "P3"]
-            c = ws.cell(row=1, column=9, value="Priority")
-            c.border = Border(
-                right=Side(border_style="thin", color="444444"),
-                bottom=Side(border_style="thin", color="444444"),
-                outline=Side(border_style="thin", color="444444"),
-            )
-
-            # Responsible Entities
-            c = ws.cell(row=1, column=10, value="Responsible Entities")
-            c.border = Border(
-                right=Side(border_style="thin", color="444444"),
-                bottom=Side(border_style="thin", color="444444"),
-                outline=Side(border_style="thin", color="444444"),
-            )
-
-            # Control Owner(s)
-            c = ws.cell(row=1, column=11, value="Control Owner(s)")
-            c.border = Border(
-                right=Side(border_style="thin", color="444444"),
-                bottom=Side(border_style="thin", color="444444"),
-                outline=Side(border_style="thin", color="444444"),
-            )
-
-            # Type ["System-Specific", "Hybrid", "Inherited", "Common", "blank"]
-            c = ws.cell(row=1, column=12, value="Type")
-            c.border = Border(
-                right=Side(border_style="thin", color="444444"),
-                bottom=Side(border_style="thin", color="444444"),
-                outline=Side(border_style="thin", color="444444"),
-            )
-
-            # Inherited From
-            c = ws.cell(row=1, column=13, value="Inherited From")
-            c.border = Border(
-                right=Side(border_style="thin", color="444444"),
-                bottom=Side(border_style="thin", color="444444"),
-                outline=Side(border_style="thin", color="444444"),
-            )
-
-            # Provide As ["Do Not Share", "blank"]
-            c = ws.cell(row=1, column=14, value="Provide As")
-            c.border = Border(
-                right=Side(border_style="thin", color="444444"),
-                bottom=Side(border_style="thin", color="444444"),
-                outline=Side(border_style="thin", color="444444"),
-            )
-
-            # Evaluation Status ["Evaluated", "Expired", "Not Evaluated", "Unknown", "blank"]
-            c = ws.cell(row=1, column=15, value="Evaluation Status")
-            c.border = Border(
-                right=Side(border_style="thin", color="444444"),
-                bottom=Side(border_style="thin", color="444444"),
-                outline=Side(border_style="thin", color="444444"),
-            )
-
-            # Control Origination
-            c = ws.cell(row=1, column=16, value="Control Origination")
-            c.border = Border(
-                right=Side(border_style="thin", color="444444"),
-                bottom=Side(border_style="thin", color="444444"),
-                outline=Side(border_style="thin", color="444444"),
-            )
-
-            # History
-            c = ws.cell(row=1, column=17, value="History")
-            c.border = Border(
-                right=Side(border_style="thin", color="444444"),
-                bottom=Side(border_style="thin", color="444444"),
-                outline=Side(border_style="thin", color="444444"),
-            )
-
-        with NamedTemporaryFile() as tmp:
-            wb.save(tmp.name)
-            tmp.seek(0)
-            stream = tmp.read()
-            blob = stream
+            ("Expected Completion", 20, HEADER_STYLE),
+            # ["Management", "Operational", "Technical",
+            ("Class", 15, HEADER_STYLE),
+            # ["p0", "P1", "P2", "P3"]
+            ("Priority", 15, HEADER_STYLE),
+            ("Responsible Entities", 20, HEADER_STYLE),
+            ("Control Owner(s)", 15, HEADER_STYLE),
+            # ["System-Specific", "Hybrid", "Inherited", "Common", "blank"]
+            ("Type", 15, HEADER_STYLE),
+            ("Inherited From", 20, HEADER_STYLE),
+            # ["Do Not Share", "blank"]
+            ("Provide As", 15, HEADER_STYLE),
+            # ["Evaluated", "Expired", "Not Evaluated", "Unknown", "blank"]
+            ("Evaluation Status", 15, HEADER_STYLE),
+            ("Control Origination", 15, HEADER_STYLE),
+            ("History", 15, HEADER_STYLE),
+        ]
+        req_id_style = cell_style(fill="FFFF99", left_border=True)
+        title_style = cell_style(fill="FFFF99")
+        impl_style = cell_style()
+
+        def rows():
+            for control, smt_bodies in iter_controls_with_statement_bodies(system.root_element):
+                flattened_control = control.get_flattened_oscal_control_as_dict()
+                yield [
+                    (flattened_control["id_display"].upper(), req_id_style),
+                    (flattened_control["title"], title_style),
+                    ("".join(smt_bodies), impl_style),
+                ]
 
-        mime_type = "application/octet-stream"
         filename = "{}_control_implementations-{}.xlsx".format(
             system.root_element.name.replace(" ", "_"),
             datetime.now().strftime("%Y-%m-%d-%H-%M"),
         )
-
-        resp = HttpResponse(blob, mime_type)
-        resp["Content-Disposition"] = "inline; filename=" + filename
-        return resp
+        return xlsx_response("Controls_Implementation", columns, rows(), filename)
     else:
         # User does not have permission to this system
         raise Http404
 
 
+def iter_controls_with_statement_bodies(element, chunk_size=500):
+    """Yield each of an Element's selected controls and a list of the bodies
+    of the Statements it consumes for the control, reading a chunk of
+    controls and their Statements at a time"""
+    controls = element.controls.order_by("id")
+    last_id = None
+    while True:
+        chunk = controls if last_id is None else controls.filter(id__gt=last_id)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        last_id = chunk[-1].id
+        smt_bodies_by_sid = defaultdict(list)
+        for sid, body in element.statements_consumed.filter(
+            sid__in={control.oscal_ctl_id for control in chunk}
+        ).values_list("sid", "body"):
+            smt_bodies_by_sid[sid].append(body)
+        for control in chunk:
+            yield control, smt_bodies_by_sid.get(control.oscal_ctl_id, [])
+
+
 @login_required
 def project_control_editor(request, system_id, catalog_key, cl_id, statement_id=None):
     """System Control detail view"""
@@ -2605,7 +2287,7 @@ def get_editor_data(request, system, catalog_key, cl_id):
     if request.user.has_perm("view_system", system):
         project = system.projects.first()
         parameter_values = project.get_parameter_values(catalog_key)
-        catalog = Catalog(catalog_key, parameter_values=parameter_values)
+        catalog = Catalog.GetInstance(catalog_key, parameter_values=parameter_values)
         cg_flat = catalog.get_flattened_controls_all_as_dict()
         if cl_id.lower() not in cg_flat:
             return render(
@@ -3751,22 +3433,7 @@ def poam_export(request, system_id, format="xlsx"):
     system = System.objects.get(id=system_id)
     # Retrieve related selected POA&Ms if user has permission on system
     if request.user.has_perm("view_system", system):
-
-        if format == "xlsx":
-            from tempfile import NamedTemporaryFile
-
-            from openpyxl import Workbook
-            from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
-
-            wb = Workbook()
-            ws = wb.active
-            ws.title = "POA&Ms"
-        else:
-            import csv
-            import io
-
-            csv_buffer = io.StringIO(newline="\n")
-            csv_writer = csv.writer(csv_buffer)
+        from .spreadsheets import HEADER_LEFT_STYLE, cell_style, csv_response, xlsx_response
 
         poam_fields = [
             {"var_name": "poam_id", "name": "POA&M ID", "width": 8},
@@ -3805,146 +3472,55 @@ def poam_export(request, system_id, format="xlsx"):
             },
         ]
 
-        # create header row
-        column = 0
-        ord_zeroth_column = ord("A") - 1
-        csv_row = []
-
-        for poam_field in poam_fields:
-            column += 1
-            if format == "xlsx":
-                c = ws.cell(row=1, column=column, value=poam_field["name"])
-                c.fill = PatternFill("solid", fgColor="5599FE")
-                c.font = Font(color="FFFFFF", bold=True)
-                c.border = Border(
-                    left=Side(border_style="thin", color="444444"),
-                    right=Side(border_style="thin", color="444444"),
-                    bottom=Side(border_style="thin", color="444444"),
-                    outline=Side(border_style="thin", color="444444"),
-                )
-                ws.column_dimensions[
-                    chr(ord_zeroth_column + column)
-                ].width = poam_field["width"]
-            else:
-                csv_row.append(poam_field["name"])
-        # Add column for URL
-        if format == "xlsx":
-            c = ws.cell(row=1, column=column, value="URL")
-            c.fill = PatternFill("solid", fgColor="5599FE")
-            c.font = Font(color="FFFFFF", bold=True)
-            c.border = Border(
-                left=Side(border_style="thin", color="444444"),
-                right=Side(border_style="thin", color="444444"),
-                bottom=Side(border_style="thin", color="444444"),
-                outline=Side(border_style="thin", color="444444"),
-            )
-            ws.column_dimensions[chr(ord_zeroth_column + column)].width = 60
-        else:
-            csv_row.append("URL")
-
-        if format != "xlsx":
-            csv_writer.writerow(csv_row)
-
         # Retrieve POA&Ms and create POA&M rows
-        poam_smts = system.root_element.statements_consumed.filter(
-            statement_type="POAM"
-        ).order_by("id")
-        row = 1
-        for poam_smt in poam_smts:
-            csv_row = []
-            row += 1
-
-            # Loop through fields
-            column = 0
-            for poam_field in poam_fields:
-                column += 1
-                if format == "xlsx":
+        poam_smts = (
+            system.root_element.statements_consumed.filter(statement_type="POAM")
+            .select_related("poam")
+            .order_by("id")
+        )
+
+        def rows():
+            for poam_smt in poam_smts.iterator():
+                row = []
+                for poam_field in poam_fields:
                     if poam_field["var_name"] in ["body", "status"]:
-                        c = ws.cell(
-                            row=row,
-                            column=column,
-                            value=getattr(poam_smt, poam_field["var_name"]),
+                        row.append(getattr(poam_smt, poam_field["var_name"]))
+                    elif poam_field["var_name"] == "poam_id":
+                        row.append(
+                            "V-{}".format(getattr(poam_smt.poam, poam_field["var_name"]))
                         )
                     else:
-                        if poam_field["var_name"] == "poam_id":
-                            c = ws.cell(
-                                row=row,
-                                column=column,
-                                value="V-{}".format(
-                                    getattr(poam_smt.poam, poam_field["var_name"])
-                                ),
-                            )
-                        else:
-                            c = ws.cell(
-                                row=row,
-                                column=column,
-                                value=getattr(poam_smt.poam, poam_field["var_name"]),
-                            )
-                    c.fill = PatternFill("solid", fgColor="FFFFFF")
-                    c.alignment = Alignment(
-                        vertical="top", horizontal="left", wrapText=True
-                    )
-                    c.border = Border(
-                        right=Side(border_style="thin", color="444444"),
-                        bottom=Side(border_style="thin", color="444444"),
-                        outline=Side(border_style="thin", color="444444"),
-                    )
-                else:
-                    if poam_field["var_name"] in ["body", "status"]:
-                        csv_row.append(getattr(poam_smt, poam_field["var_name"]))
-                    else:
-                        if poam_field["var_name"] == "poam_id":
-                            csv_row.append(
-                                "V-{}".format(
-                                    getattr(poam_smt.poam, poam_field["var_name"])
-                                )
-                            )
-                        else:
-                            csv_row.append(
-                                getattr(poam_smt.poam, poam_field["var_name"])
-                            )
+                        row.append(getattr(poam_smt.poam, poam_field["var_name"]))
 
-            # Add URL column
-            poam_url = settings.SITE_ROOT_URL + "/systems/{}/poams/{}/edit".format(
-                system_id, poam_smt.id
-            )
-            if format == "xlsx":
-                c = ws.cell(row=row, column=column, value=poam_url)
-                c.fill = PatternFill("solid", fgColor="FFFFFF")
-                c.alignment = Alignment(
-                    vertical="top", horizontal="left", wrapText=True
-                )
-                c.border = Border(
-                    right=Side(border_style="thin", color="444444"),
-                    bottom=Side(border_style="thin", color="444444"),
-                    outline=Side(border_style="thin", color="444444"),
+                # Add URL column
+                row.append(
+                    settings.SITE_ROOT_URL
+                    + "/systems/{}/poams/{}/edit".format(system_id, poam_smt.id)
                 )
-            else:
-                csv_row.append(poam_url)
-
-            if format != "xlsx":
-                csv_writer.writerow(csv_row)
-
-        if format == "xlsx":
-            with NamedTemporaryFile() as tmp:
-                wb.save(tmp.name)
-                tmp.seek(0)
-                stream = tmp.read()
-                blob = stream
-        else:
-            blob = csv_buffer.getvalue()
-            csv_buffer.close()
+                yield row
 
         # Determine filename based on system name
         system_name = system.root_element.name.replace(" ", "_") + "_" + system_id
         filename = "{}_poam_export-{}.{}".format(
             system_name, datetime.now().strftime("%Y-%m-%d-%H-%M"), format
         )
-        mime_type = "application/octet-stream"
 
-        resp = HttpResponse(blob, mime_type)
-        resp["Content-Disposition"] = "inline; filename=" + filename
-        return resp
+        if format == "xlsx":
+            columns = [
+                (poam_field["name"], poam_field["width"], HEADER_LEFT_STYLE)
+                for poam_field in poam_fields
+            ]
+            columns.append(("URL", 60, HEADER_LEFT_STYLE))
+            style = cell_style(fill="FFFFFF", horizontal="left")
+            return xlsx_response(
+                "POA&Ms",
+                columns,
+                ([(value, style) for value in row] for row in rows()),
+                filename,
+            )
+        else:
+            header = [poam_field["name"] for poam_field in poam_fields] + ["URL"]
+            return csv_response(header, rows(), filename)
     else:
         # User does not have permission to this system
         raise Http404
@@ -4088,7 +3664,17 @@ def project_import(request, project_id):
 def project_export(request, project_id):
     """
     Export an entire project's components and control content
+
+    The export is written to a spooled temporary file one section, and one
+    component and POA&M, at a time. With ?file_content=references, uploaded
+    files are exported as references to their URLs instead of their content.
     """
+    from tempfile import SpooledTemporaryFile
+
+    from django.http import FileResponse
+
+    from siteapp.utils.json_stream import JSONArrayStream, iter_json_object
+
     # Of the project in the current system. pick one project to export
     project = Project.objects.get(id=project_id)
     system_id = project.system.id
@@ -4097,21 +3683,30 @@ def project_export(request, project_id):
     system_root_element = system.root_element
 
     # Retrieve related selected controls and Poams if user has permission on system
-    if request.user.has_perm("view_system", system):
-        oscal_comps = []
-        for element in system.producer_elements:
+    if not request.user.has_perm("view_system", system):
+        raise Http404
+
+    def components():
+        elements = (
+            Element.objects.filter(statements_produced__consumer_element=system_root_element)
+            .distinct()
+            .order_by("name")
+        )
+        for element in elements.iterator():
             # Implementation statement OSCAL JSON
             impl_smts = element.statements_produced.filter(
                 consumer_element=system_root_element
             )
-            component = OSCALComponentSerializer(element, impl_smts).as_json()
-            oscal_comps.append(component)
-        poams = []
-        poam_smts = system_root_element.statements_consumed.filter(
-            statement_type="POAM"
-        ).order_by("id")
-        for smt in poam_smts:
-            poam = {
+            yield OSCALComponentSerializer(element, impl_smts).as_dict()
+
+    def poams():
+        poam_smts = (
+            system_root_element.statements_consumed.filter(statement_type="POAM")
+            .select_related("poam")
+            .order_by("id")
+        )
+        for smt in poam_smts.iterator():
+            yield {
                 "controls": smt.poam.controls,
                 "milestones": smt.poam.milestones,
                 "poam_id": smt.poam.poam_id,
@@ -4131,17 +3726,27 @@ def project_export(request, project_id):
                     "uuid": str(smt.uuid),
                 },
             }
-            # Add json version as an element in the poams list
-            poams.append(json.dumps(poam))
-    questionnaire_data = json.dumps(
-        project.export_json(include_metadata=True, include_file_content=True)
+
+    # The questionnaire is serialized as a whole because answers that are
+    # exported more than once are marked as references when they are reused.
+    questionnaire_data = project.export_json(
+        include_metadata=True,
+        include_file_content=request.GET.get("file_content") != "references",
     )
-    data = json.loads(questionnaire_data)
-    data["component-definitions"] = [
-        json.loads(oscal_comp) for oscal_comp in oscal_comps
+    sections = list(questionnaire_data.items()) + [
+        ("component-definitions", JSONArrayStream(components())),
+        ("poams", JSONArrayStream(poams())),
     ]
-    data["poams"] = [json.loads(poam) for poam in poams]
-    response = JsonResponse(data, json_dumps_params={"indent": 2})
+
+    # Write to a file, rather than streaming the response, so that an error
+    # is an error response rather than a truncated download. The file is
+    # kept in memory until it gets large.
+    export_file = SpooledTemporaryFile(max_size=10 * 1024 * 1024)
+    for chunk in iter_json_object(sections):
+        export_file.write(chunk.encode("utf8"))
+    export_file.seek(0)
+
+    response = FileResponse(export_file, content_type="application/json")
     filename = (
         project.title.replace(" ", "_")
         + "-"
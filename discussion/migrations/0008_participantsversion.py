@@ -0,0 +1,20 @@
+# Generated by Django 3.2.5 on 2026-10-18 13:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('discussion', '0007_auto_20201103_1330'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParticipantsVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(default=0, help_text='Incremented whenever the participants of any discussion may have changed.')),
+            ],
+        ),
+    ]
@@ -1,6 +1,12 @@
+import base64
+from datetime import datetime, timedelta
+
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.db import models
+from django.db.models import F, Max
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.urls import reverse
 from django.utils import timezone
 from jsonfield import JSONField
@@ -71,7 +77,9 @@ class Discussion(models.Model):
         # No one is a participant of a discussion attached to (a question of) a deleted Task.
         if self.attached_to_obj is not None and self.attached_to_obj.is_discussion_deleted():
             return False
-        return user in self.get_all_participants()
+        if getattr(user, "id", None) is None:
+            return False
+        return self.get_all_participants().filter(id=user.id).exists()
 
     def get_all_participants(self):
         # Because get_discussion_participants uses distinct, self.guests must too
@@ -83,6 +91,11 @@ class Discussion(models.Model):
     ##
 
     def render_context_dict(self, user, comments_since=0, parent_events_since=0):
+        # Get the cursor that render_changes_since will return changes after.
+        # It is taken before the events are read so that changes made while
+        # rendering are returned by the next poll.
+        poll_state = self.get_poll_state()
+
         # Build the event history...
         events = []
 
@@ -139,7 +152,71 @@ class Discussion(models.Model):
             "events": events,
             "autocomplete": self.get_autocompletes(user),
             "draft": draft,
+            "cursor": make_poll_cursor(*poll_state),
+        }
+
+    def get_poll_state(self):
+        # Return a tuple of the time the latest comment was posted, edited,
+        # reacted to or deleted (in microseconds since the epoch), the
+        # POSIX time of the latest event of the attached object, and the
+        # participants version. render_changes_since compares them to a
+        # cursor, which encodes them, to see what changed.
+        comments_updated = self.comments.filter(draft=False).aggregate(updated=Max("updated"))["updated"]
+        last_event_date = None
+        if self.attached_to_obj is not None:
+            last_event_date = self.attached_to_obj.get_discussion_last_event_date()
+        return (
+            (comments_updated - EPOCH) // timedelta(microseconds=1) if comments_updated else 0,
+            last_event_date.timestamp() if last_event_date else 0.0,
+            get_participants_version(),
+        )
+
+    def render_changes_since(self, user, cursor):
+        # Render the changes to the discussion since a cursor returned by
+        # render_context_dict or by an earlier call, or return None if
+        # nothing changed. The comments that were posted, edited, reacted to
+        # or deleted are returned. The events of the attached object are
+        # only read if there is a new one, and the guests, autocompletes and
+        # permissions are only returned if participants may have changed.
+        # Raises ValueError if the cursor is invalid.
+        comments_since, events_since, participants_version = parse_poll_cursor(cursor)
+        poll_state = self.get_poll_state()
+        participants_changed = poll_state[2] != participants_version
+        if poll_state[:2] == (comments_since, events_since) and not participants_changed:
+            return None
+
+        events = []
+        deleted_comments = []
+        if poll_state[0] > comments_since:
+            comments = self.comments \
+                .select_related('user') \
+                .filter(draft=False, updated__gt=EPOCH + timedelta(microseconds=comments_since))
+            for comment in comments:
+                if comment.deleted:
+                    deleted_comments.append(comment.id)
+                else:
+                    comment.discussion = self # reuse instance for caching
+                    events.append(comment.render_context_dict(user))
+        if poll_state[1] > events_since:
+            events.extend(self.attached_to_obj.get_discussion_interleaved_events(events_since))
+        events.sort(key = lambda item : item["date_posix"])
+
+        ret = {
+            "status": "ok",
+            "cursor": make_poll_cursor(*poll_state),
+            "events": events,
+            "deleted_comments": deleted_comments,
         }
+        if participants_changed:
+            ret.update({
+                "discussion": {
+                    "can_invite": self.can_invite_guests(user),
+                    "can_comment": self.can_comment(user),
+                },
+                "guests": [ user.render_context_dict() for user in self.guests.all() ],
+                "autocomplete": self.get_autocompletes(user),
+            })
+        return ret
 
     ##
 
@@ -248,7 +325,13 @@ class Discussion(models.Model):
         if self.attached_to_obj is None or not self.is_participant(user):
             self._get_autocompletes = []
         else:
-            self._get_autocompletes = self.attached_to_obj.get_discussion_autocompletes(self)
+            # They're the same for all participants, so they are also cached
+            # in the default cache until the participants version changes.
+            key = "discussion-autocompletes:{}:{}".format(self.id, get_participants_version())
+            self._get_autocompletes = cache.get(key)
+            if self._get_autocompletes is None:
+                self._get_autocompletes = self.attached_to_obj.get_discussion_autocompletes(self)
+                cache.set(key, self._get_autocompletes, AUTOCOMPLETES_CACHE_TIMEOUT)
         return self._get_autocompletes
 
     @property
@@ -322,50 +405,51 @@ class Comment(models.Model):
         # Save.
         self.save()
 
-        # Kick the attached object.
-        if hasattr(self.discussion.attached_to_obj, 'on_discussion_comment'):
-            self.discussion.attached_to_obj.on_discussion_comment(self)
-
-        # Issue a notification to anyone watching the discussion
-        # via discussion.get_notification_watchers() except to
-        # anyone @-mentioned because they'll get a different
-        # notification.
+        # Work out who to notify, once. Anyone watching the discussion via
+        # discussion.get_notification_watchers() is notified, except anyone
+        # @-mentioned, who gets a different notification if they are already
+        # a discussion participant or else an invitation.
         if self.draft: raise Exception("I'm still a draft.")
-        from siteapp.views import issue_notification
-        _, mentioned_users = match_autocompletes(self.text, self.discussion.get_autocompletes(self.user))
-        issue_notification(
-            self.user,
-            "commented on",
-            self.discussion,
-            recipients=self.discussion.get_notification_watchers() - mentioned_users,
-            description=self.text,
-            comment_id=self.id)
-
-        # Issue a notification to anyone @-mentioned in the comment
-        # that is already a discussion participant.
-        discussion_participants = set(self.discussion.get_all_participants())
-        issue_notification(
-            self.user,
-            "mentioned you in a comment on",
-            self.discussion,
-            recipients=mentioned_users & discussion_participants,
-            description=self.text,
-            comment_id=self.id)
-
-        # Send invitations to anyone @-mentioned who is not yet a participant
-        # in the discussion.
+        from notifications.models import Notification
         from siteapp.models import Invitation
-
-        for user in mentioned_users - discussion_participants:
-            inv = Invitation.objects.create(
+        from siteapp.notifications_helpers import make_notifications
+        _, mentioned_users = match_autocompletes(self.text, self.discussion.get_autocompletes(self.user))
+        watchers = self.discussion.get_notification_watchers()
+        mentioned_participants = set()
+        if mentioned_users:
+            mentioned_participants = set(self.discussion.get_all_participants()
+                .filter(id__in=[user.id for user in mentioned_users]))
+
+        # Create the notifications together.
+        Notification.objects.bulk_create(
+            make_notifications(
+                self.user,
+                "commented on",
+                self.discussion,
+                recipients=watchers - mentioned_users,
+                description=self.text,
+                comment_id=self.id)
+            + make_notifications(
+                self.user,
+                "mentioned you in a comment on",
+                self.discussion,
+                recipients=mentioned_users & mentioned_participants,
+                description=self.text,
+                comment_id=self.id))
+
+        # Invite anyone @-mentioned who is not yet a participant in the
+        # discussion. The invitations are emailed in the background by
+        # the send_notification_emails command.
+        for user in mentioned_users - mentioned_participants:
+            Invitation.objects.create(
                 from_user=self.user,
                 from_project=self.discussion.attached_to_obj.task.project, # TODO: Breaks abstraction, assumes attached_to => TaskAnswer.
                 target=self.discussion,
                 target_info={ "what": "invite-guest" },
                 to_user=user,
                 text="{} mentioned you in a discussion:\n\n{}".format(self.user, self.text),
+                queued_at=timezone.now(),
             )
-            inv.send()
 
         # Let the owner object of the discussion know that a comment was left.
         if hasattr(self.discussion.attached_to_obj, 'on_discussion_comment'):
@@ -436,6 +520,59 @@ class Attachment(models.Model):
     def get_absolute_url(self):
         return reverse("discussion-attachment", args=[self.id])
 
+class ParticipantsVersion(models.Model):
+    # A single row holding the participants version, see
+    # get_participants_version.
+    version = models.BigIntegerField(default=0, help_text="Incremented whenever the participants of any discussion may have changed.")
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def make_poll_cursor(comments_since, events_since, participants_version):
+    # Encode a tuple returned by Discussion.get_poll_state as a cursor. The
+    # cursor is opaque to clients.
+    state = "{}:{!r}:{}".format(comments_since, events_since, participants_version)
+    return base64.urlsafe_b64encode(state.encode("ascii")).decode("ascii")
+
+def parse_poll_cursor(cursor):
+    try:
+        comments_since, events_since, participants_version = \
+            base64.urlsafe_b64decode(cursor.encode("ascii")).decode("ascii").split(":")
+        return (int(comments_since), float(events_since), int(participants_version))
+    except (UnicodeError, ValueError) as e:
+        raise ValueError("Invalid cursor.") from e
+
+# The participants version is a counter in the database that changes
+# whenever the participants of any discussion, the members of a project,
+# or an organization change, so that polls can tell that the guests and
+# the autocompletes may have changed. It is kept in the database rather
+# than in the default cache so that all processes see the same version
+# whatever the cache backend is. Autocompletes are cached by version.
+# Renamed users are reflected when the cached autocompletes expire.
+AUTOCOMPLETES_CACHE_TIMEOUT = 300
+
+def get_participants_version():
+    version = ParticipantsVersion.objects.filter(id=1).values_list("version", flat=True).first()
+    if version is None:
+        version = ParticipantsVersion.objects.get_or_create(id=1)[0].version
+    return version
+
+def on_participants_changed(**kwargs):
+    if not ParticipantsVersion.objects.filter(id=1).update(version=F("version") + 1):
+        # The counter is missing.
+        ParticipantsVersion.objects.get_or_create(id=1, defaults={ "version": 1 })
+
+def on_guests_changed(action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        on_participants_changed()
+
+def connect_participants_signals():
+    from guardian.models import GroupObjectPermission, UserObjectPermission
+    from siteapp.models import Organization, ProjectMembership
+    m2m_changed.connect(on_guests_changed, sender=Discussion.guests.through, dispatch_uid="discussion-guests")
+    for model in (ProjectMembership, UserObjectPermission, GroupObjectPermission, Organization):
+        post_save.connect(on_participants_changed, sender=model, dispatch_uid="discussion-participants")
+        post_delete.connect(on_participants_changed, sender=model, dispatch_uid="discussion-participants")
+
 def reldate(date, ref=None):
     import dateutil.relativedelta
     rd = dateutil.relativedelta.relativedelta(ref or timezone.now(), date)
@@ -526,3 +663,5 @@ def match_autocompletes(text, autocompletes, replace_mentions=None):
     text = re.sub(pattern, replace_func, text)
 
     return (text, mentioned_users)
+
+connect_participants_signals()
@@ -1,15 +1,21 @@
 import os
 
+from unittest.mock import patch
+
 import requests
 from django.contrib.auth.models import Permission
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from django.urls import reverse
 from django.utils.crypto import get_random_string
 from selenium.common.exceptions import NoSuchElementException
 
+from discussion.models import Discussion
 from discussion.validators import VALID_EXTS, validate_file_extension
 from guidedmodules.management.commands.load_modules import Command as load_modules
-from guidedmodules.models import AppSource
-from siteapp.models import User, Organization, Portfolio
+from guidedmodules.models import AppSource, Task, TaskAnswer
+from guidedmodules.tests import TestCaseWithFixtureData
+from siteapp.models import User, Organization, Portfolio, Project, ProjectMembership
 from siteapp.tests import SeleniumTest, var_sleep
 from siteapp.tests import wait_for_sleep_after
 
@@ -152,3 +158,177 @@ class DiscussionTests(SeleniumTest):
                         )
             is_valid = validate_file_extension(file_model)
             self.assertIsNone(is_valid)
+
+
+@override_settings(CACHES={
+    "default": { "BACKEND": "django.core.cache.backends.locmem.LocMemCache" },
+})
+class DiscussionPollingTests(TestCaseWithFixtureData):
+    # Tests that polls return only what changed since their cursor.
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.project.portfolio = Portfolio.objects.create(title="Polling Portfolio")
+        self.project.save()
+        ProjectMembership.objects.create(project=self.project, user=self.user, is_admin=True)
+        task = Task.objects.create(module=self.getModule("question_types_text"), project=self.project, editor=self.user)
+        self.taskans = TaskAnswer.objects.create(task=task, question=task.module.questions.get(key="q_text"))
+        self.discussion = Discussion.get_for(self.organization, self.taskans, create=True)
+        self.client.force_login(self.user)
+        self.cursor = self.discussion.render_context_dict(self.user)["cursor"]
+
+    def poll(self, expected_status=200):
+        resp = self.client.get(reverse("discussion_poll_for_changes"), { "id": self.discussion.id, "cursor": self.cursor })
+        self.assertEqual(resp.status_code, expected_status)
+        if expected_status != 200:
+            return None
+        changes = resp.json()
+        self.cursor = changes["cursor"]
+        return changes
+
+    def test_poll_for_changes(self):
+        # Nothing changed.
+        self.poll(304)
+
+        # A new comment.
+        comment = Discussion.objects.get(id=self.discussion.id).post_comment(self.user, "Hello.", "web")
+        changes = self.poll()
+        self.assertEqual([(e["type"], e["id"], e["text"]) for e in changes["events"]], [("comment", comment.id, "Hello.")])
+        self.assertNotIn("guests", changes)
+        self.poll(304)
+
+        # An edited comment, a deleted comment, and a new event of the
+        # attached object.
+        comment.text = "Hello again."
+        comment.save()
+        self.taskans.save_answer("answer", [], None, self.user, "web")
+        changes = self.poll()
+        self.assertEqual(changes["events"][0]["text"], "Hello again.")
+        self.assertIn("answered the question", changes["events"][1]["html"])
+        comment.deleted = True
+        comment.save()
+        changes = self.poll()
+        self.assertEqual((changes["events"], changes["deleted_comments"]), ([], [comment.id]))
+        self.poll(304)
+
+        # A new guest.
+        guest = User.objects.create(username="guest")
+        self.discussion.guests.add(guest)
+        changes = self.poll()
+        self.assertEqual([g["id"] for g in changes["guests"]], [guest.id])
+        self.assertIn(guest.id, [item["user_id"] for item in changes["autocomplete"]["@"]])
+        self.poll(304)
+
+        # An invalid cursor.
+        self.cursor = "invalid"
+        self.poll(400)
+
+    def test_poll_without_cache(self):
+        # The participants version is in the database, so polls see
+        # participants changes made by any process whatever the cache is.
+        with override_settings(CACHES={ "default": { "BACKEND": "django.core.cache.backends.dummy.DummyCache" } }):
+            self.poll(304)
+            guest = User.objects.create(username="guest")
+            self.discussion.guests.add(guest)
+            changes = self.poll()
+            self.assertEqual([g["id"] for g in changes["guests"]], [guest.id])
+            self.assertIn(guest.id, [item["user_id"] for item in changes["autocomplete"]["@"]])
+            self.poll(304)
+
+    def test_autocompletes_cached(self):
+        autocompletes = Discussion.objects.get(id=self.discussion.id).get_autocompletes(self.user)
+        with patch.object(TaskAnswer, "get_discussion_autocompletes") as get_discussion_autocompletes:
+            self.assertEqual(Discussion.objects.get(id=self.discussion.id).get_autocompletes(self.user), autocompletes)
+            get_discussion_autocompletes.assert_not_called()
+
+        # Membership changes invalidate them.
+        member = User.objects.create(username="member")
+        ProjectMembership.objects.create(project=self.project, user=member)
+        autocompletes = Discussion.objects.get(id=self.discussion.id).get_autocompletes(self.user)
+        self.assertIn(member.id, [item["user_id"] for item in autocompletes["@"]])
+
+
+class CommentNotificationTests(TestCaseWithFixtureData):
+    # Tests that publishing a comment notifies watchers with a fixed number
+    # of queries and queues invitations for the background sender.
+
+    def setUp(self):
+        self.project.portfolio = Portfolio.objects.create(title="Notification Portfolio")
+        self.project.save()
+        ProjectMembership.objects.create(project=self.project, user=self.user, is_admin=True)
+        task = Task.objects.create(module=self.getModule("question_types_text"), project=self.project, editor=self.user)
+        self.discussion = Discussion.get_for(self.organization, TaskAnswer.objects.create(task=task, question=task.module.questions.get(key="q_text")), create=True)
+
+    def post_comment(self, text):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        discussion = Discussion.objects.get(id=self.discussion.id)
+        with CaptureQueriesContext(connection) as queries:
+            discussion.post_comment(self.user, text, "web")
+        return len(queries.captured_queries)
+
+    def test_notifications(self):
+        from django.core.management import call_command
+        from notifications.models import Notification
+        from siteapp.models import Invitation
+
+        # An outsider in the organization can be @-mentioned.
+        outsider = User.objects.create(username="outsider", email="outsider@example.org")
+        ProjectMembership.objects.create(project=Project.objects.create(organization=self.organization), user=outsider)
+
+        def add_watchers(count):
+            for i in range(count):
+                ProjectMembership.objects.create(project=self.project, user=User.objects.create(username="watcher{}".format(Notification.objects.count() + i)))
+
+        # The first comment warms up the content type cache.
+        add_watchers(2)
+        self.post_comment("Hi.")
+        queries = self.post_comment("Hello.")
+        self.assertEqual(Notification.objects.filter(verb="commented on").count(), 2 + 2)
+        add_watchers(5)
+        self.assertEqual(self.post_comment("Hello again."), queries)
+        self.assertEqual(Notification.objects.filter(verb="commented on").count(), 2 + 2 + 7)
+
+        # As with notifications.signals.notify, extra data is only stored if
+        # django-notifications is configured to.
+        self.assertIsNone(Notification.objects.filter(verb="commented on").latest("id").data)
+        with self.settings(DJANGO_NOTIFICATIONS_CONFIG={ "USE_JSONFIELD": True }):
+            self.post_comment("Hello with data.")
+        self.assertIn("comment_id", Notification.objects.filter(verb="commented on").latest("id").data)
+
+        # Mentioning the outsider queues an invitation, which the background
+        # sender sends. (Only the invitation is emailed here.)
+        User.objects.update(notifemails_enabled=1)
+        self.post_comment("Hello @outsider.")
+        inv = Invitation.objects.get(to_user=outsider)
+        self.assertIsNone(inv.sent_at)
+        self.assertIsNotNone(inv.queued_at)
+        with patch("siteapp.models.Invitation.send", autospec=True) as send:
+            call_command("send_notification_emails")
+        send.assert_called_once_with(inv)
+
+    def test_invitation_send_failure(self):
+        # An invitation that fails to send doesn't stop the others from
+        # being sent and is tried again later.
+        from django.utils import timezone
+        from siteapp.management.commands.send_notification_emails import Command
+        from siteapp.models import Invitation
+        invitations = [
+            Invitation.objects.create(from_user=self.user, from_project=self.project, target=self.discussion,
+                target_info={ "what": "invite-guest" }, to_email="guest{}@example.org".format(i), queued_at=timezone.now())
+            for i in range(2)
+        ]
+        def send(inv):
+            if inv.id == invitations[0].id:
+                raise OSError("mail server unavailable")
+            Invitation.objects.filter(id=inv.id).update(sent_at=timezone.now())
+        with patch("siteapp.models.Invitation.send", autospec=True, side_effect=send) as mock_send:
+            Command().send_new_emails()
+            self.assertEqual([call.args[0].id for call in mock_send.call_args_list], [inv.id for inv in invitations])
+            invitations[0].refresh_from_db()
+            self.assertGreater(invitations[0].queued_at, timezone.now())
+
+            # It isn't retried right away.
+            Command().send_new_emails()
+            self.assertEqual(mock_send.call_count, 2)
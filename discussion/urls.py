@@ -12,6 +12,7 @@ urlpatterns = [
     url(r'^_discussion_comment_delete', views.delete_discussion_comment, name="discussion-comment-delete"),
     url(r'^_discussion_comment_react', views.save_reaction, name="discussion-comment-react"),
     url(r'^_discussion_comment_attachments', views.create_attachments, name="discussion-comment-create-attachments"),
+    url(r'^_discussion_poll_changes', views.poll_for_changes, name="discussion_poll_for_changes"),
     url(r'^_discussion_poll', views.poll_for_events, name="discussion_poll_for_events"),
     url(r'^attachment/(\d+)', views.download_attachment, name="discussion-attachment"),
 ]
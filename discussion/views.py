@@ -4,8 +4,9 @@ from structlog import get_logger
 
 from django.db import transaction
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import Http404, HttpResponse, HttpResponseRedirect, HttpResponseForbidden, JsonResponse, HttpResponseNotAllowed
+from django.http import Http404, HttpResponse, HttpResponseRedirect, HttpResponseForbidden, JsonResponse, HttpResponseNotAllowed, HttpResponseBadRequest, HttpResponseNotModified
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.cache import never_cache
 from django.conf import settings
 from django.utils import timezone
 import sys
@@ -183,6 +184,23 @@ def poll_for_events(request):
         request.POST.get("event_since", "0")
     ))
 
+@login_required
+@never_cache
+def poll_for_changes(request):
+    # Return what changed since the cursor returned by the last poll or by
+    # the initial rendering of the discussion, or 304 Not Modified if
+    # nothing changed.
+    discussion = get_object_or_404(Discussion, id=request.GET.get('id'))
+    if not discussion.is_participant(request.user):
+        raise Http404()
+    try:
+        changes = discussion.render_changes_since(request.user, request.GET.get("cursor", ""))
+    except ValueError:
+        return HttpResponseBadRequest("Invalid cursor.")
+    if changes is None:
+        return HttpResponseNotModified()
+    return JsonResponse(changes)
+
 @login_required
 @transaction.atomic
 def create_attachments(request):
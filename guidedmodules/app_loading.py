@@ -107,6 +107,13 @@ def load_app_into_database(app, update_mode=AppImportUpdateMode.CreateInstance,
     except Exception:
         pass
 
+    # Render the app's catalog entry now that its modules and assets are
+    # loaded. If it can't be rendered, it's tried again when it's shown.
+    try:
+        appinst.catalog_entry = appinst.render_catalog_entry()
+    except Exception:
+        appinst.catalog_entry = None
+
     # Update appinst. It may have been modified by extract_catalog_metadata
     # and by the loading of a README.md file.
     appinst.save()
@@ -259,6 +266,14 @@ def update_module(m, spec, log_status):
             except ProtectedError:
                 raise IncompatibleUpdate("Module {} cannot be updated because question {}, which has been removed, has already been answered.".format(m.module_name, q.key))
 
+    # Store the dependency graph of its questions so that it doesn't
+    # have to be recomputed by each process that uses the Module. Saving
+    # again also bumps the updated timestamp past any question changes,
+    # which invalidates cached copies of the old graph.
+    from .module_logic import compute_question_dependency_graph
+    m.question_dependencies = compute_question_dependency_graph(m)
+    m.save()
+
     # If we're updating a Module in-place, clear out any cached state on its Tasks.
     for t in Task.objects.filter(module=m):
         t.on_answer_changed()
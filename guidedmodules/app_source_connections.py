@@ -34,7 +34,10 @@
 # closed.
 ###########################################################
 
+import copy
 import re
+import threading
+from collections import OrderedDict
 
 import fs, fs.errors
 from fs.base import FS as fsFS
@@ -248,6 +251,35 @@ class PyFsAppSourceConnection(AppSourceConnection):
             name,
             self.root.opendir(name))
 
+# Parsed module YAML files, keyed by the git blob hash of the file for
+# filesystems that provide one (the git and GitHub filesystems do), so that
+# modules that haven't changed aren't read and parsed again each time their
+# app is loaded. The least recently used specs are dropped when there are
+# more than MODULE_SPEC_CACHE_SIZE.
+MODULE_SPEC_CACHE_SIZE = 2000
+_module_spec_cache = OrderedDict()
+_module_spec_cache_lock = threading.Lock()
+
+def get_cached_module_spec(blob_hash):
+    if not blob_hash:
+        return None
+    with _module_spec_cache_lock:
+        spec = _module_spec_cache.get(blob_hash)
+        if spec is None:
+            return None
+        _module_spec_cache.move_to_end(blob_hash)
+    # Callers may modify the spec.
+    return copy.deepcopy(spec)
+
+def cache_module_spec(blob_hash, spec):
+    if not blob_hash:
+        return
+    spec = copy.deepcopy(spec)
+    with _module_spec_cache_lock:
+        _module_spec_cache[blob_hash] = spec
+        while len(_module_spec_cache) > MODULE_SPEC_CACHE_SIZE:
+            _module_spec_cache.popitem(last=False)
+
 class PyFsApp(App):
     """An App whose modules and assets are stored in a directory
        layout rooted at a PyFilesystem2 file system."""
@@ -311,9 +343,13 @@ class PyFsApp(App):
                     # The module ID combines its local path and the filename.
                     module_id = "/".join(path + [fn_name])
 
-                    # Read the YAML file.
-                    with self.fs.open(entry.name) as f:
-                        module_spec = read_yaml_file(f)
+                    # Read the YAML file, unless a file with the same content
+                    # was read before.
+                    module_spec = get_cached_module_spec(entry.get("hash", "sha1"))
+                    if module_spec is None:
+                        with self.fs.open(entry.name) as f:
+                            module_spec = read_yaml_file(f)
+                        cache_module_spec(entry.get("hash", "sha1"), module_spec)
 
                     yield (module_id, module_spec)
 
@@ -459,16 +495,34 @@ class GithubApiAppSourceConnection(PyFsAppSourceConnection):
 
 
 class GitRepositoryFilesystem(SimplifiedReadonlyFilesystem):
-    def __init__(self, url, branch, path, ssh_key=None):
+    # The repository is fetched into a bare repository in mirror_dir that
+    # is kept between connections, so that each fetch only transfers the
+    # objects that have changed since the last one. The directory listing
+    # of the fetched tree is kept in an index file named by the tree's hash,
+    # so an unchanged tree is listed without reading its git objects again.
+    # Without a mirror_dir, the repository is fetched into a temporary
+    # directory that is removed when the filesystem is closed.
+
+    MIRROR_REF = "refs/heads/mirror"
+
+    def __init__(self, url, branch, path, ssh_key=None, mirror_dir=None):
         self.url = url
         self.branch = branch or None
         self.path = (path or "") + "/"
         self.ssh_key = ssh_key
+        self.repo = None
 
-        # Create a local git working directory.
-        import tempfile
+        # Create a temporary directory for the SSH key, and for the
+        # repository if there is no mirror directory.
+        import hashlib, os.path, tempfile
         self.tempdir_obj = tempfile.TemporaryDirectory()
         self.tempdir = self.tempdir_obj.__enter__()
+        if mirror_dir:
+            # Each url and branch gets its own mirror.
+            key = hashlib.sha256("{}\0{}".format(self.url, self.branch or "").encode("utf8")).hexdigest()
+            self.mirror_dir = os.path.join(mirror_dir, key)
+        else:
+            self.mirror_dir = os.path.join(self.tempdir, "repo")
 
         self.description = self.url + "/" + self.path.strip("/")
         if self.branch:
@@ -481,109 +535,149 @@ class GitRepositoryFilesystem(SimplifiedReadonlyFilesystem):
         return "<gitfs '%s'>" % self.description
 
     def close(self):
-        # Release the temporary directory.
+        # Stop the git processes that read objects and release the
+        # temporary directory.
+        if self.repo is not None:
+            self.repo.close()
         self.tempdir_obj.__exit__(None, None, None)
+        super().close()
 
-    def get_repo_root(self):
-        # Return cached tree.
-        if hasattr(self, "repo_root_tree"):
-            return self.repo_root_tree
+    def get_index(self):
+        # Return cached index.
+        if hasattr(self, "index"):
+            return self.index
 
-        import os, os.path
-        import git
+        import fcntl, os
+        import git, git.exc
 
-        # Create an empty git repo in the temporary directory.
-        self.repo = git.Repo.init(self.tempdir)
+        # Only one process at a time fetches into a mirror.
+        os.makedirs(self.mirror_dir, exist_ok=True)
+        with open(self.mirror_dir + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
 
-        # Make SSH non-interactive.
-        ssh_options = "ssh -o StrictHostKeyChecking=no -o BatchMode=yes"
+            # Open the mirror, creating it the first time.
+            if os.path.exists(os.path.join(self.mirror_dir, "HEAD")):
+                self.repo = git.Repo(self.mirror_dir)
+            else:
+                self.repo = git.Repo.init(self.mirror_dir, bare=True)
 
-        # If an SSH key is provided, store it in the temporary directory and
-        # then use it.
-        if self.ssh_key:
-            ssh_key_file = os.path.join(self.tempdir, "ssh.key")
-            old_umask = os.umask(0o077) # ssh requires group/world permissions to be zero
-            try:
-                with open(ssh_key_file, "wb") as f:
-                    f.write(self.ssh_key.encode("ascii"))
-            finally:
-                os.umask(old_umask)
-            ssh_options += " -i " + ssh_key_file
+            # Make SSH non-interactive.
+            ssh_options = "ssh -o StrictHostKeyChecking=no -o BatchMode=yes"
 
-        self.repo.git.environment()["GIT_SSH_COMMAND"] = ssh_options
+            # If an SSH key is provided, store it in the temporary directory and
+            # then use it.
+            if self.ssh_key:
+                ssh_key_file = os.path.join(self.tempdir, "ssh.key")
+                old_umask = os.umask(0o077) # ssh requires group/world permissions to be zero
+                try:
+                    with open(ssh_key_file, "wb") as f:
+                        f.write(self.ssh_key.encode("ascii"))
+                finally:
+                    os.umask(old_umask)
+                ssh_options += " -i " + ssh_key_file
 
-        # For debugging, log a command that we could try on the command line.
-        #print("SSH_COMMAND=\"{ssh_options}\" git fetch --depth 1 {url} {branch}".format(
-        #    ssh_options=ssh_options, url=self.url, branch=self.branch), file=sys.stderr)
+            self.repo.git.environment()["GIT_SSH_COMMAND"] = ssh_options
 
-        # Fetch.
-        import git.exc
+            # Fetch the branch, or the remote's default branch, into the mirror's
+            # ref. Only its latest commit is fetched, and only the objects that
+            # the mirror doesn't already have are transferred.
+            try:
+                self.repo.git.execute(
+                    [
+                        self.repo.git.git_exec_name,
+                        "fetch",
+                        "--depth", "1", # avoid getting whole repo history
+                        self.url, # repo URL
+                        "+{}:{}".format(self.branch or "HEAD", self.MIRROR_REF), # branch to fetch
+                    ], kill_after_timeout=20)
+            except git.exc.GitCommandError as e:
+                # This is where errors occur, which is hopefully about auth.
+                raise fs.errors.CreateFailed("The repository URL is either not valid, not public, or ssh_key was not specified or not valid (%s)." % e.stderr)
+
+            # Get the hash of the tree at the path in the fetched commit.
+            path = self.path.strip("/")
+            try:
+                tree_sha = self.repo.git.rev_parse("--verify",
+                    "{}:{}".format(self.MIRROR_REF, path) if path else self.MIRROR_REF + "^{tree}")
+                if self.repo.git.cat_file("-t", tree_sha) != "tree":
+                    raise fs.errors.ResourceNotFound(self.path)
+            except git.exc.GitCommandError:
+                raise fs.errors.ResourceNotFound(self.path)
+
+        # Load the tree's index, or build it if this tree hasn't been seen before.
+        import json
+        index_file = os.path.join(self.mirror_dir, "gr-index", tree_sha + ".json")
         try:
-            self.repo.git.execute(
-                [
-                    self.repo.git.git_exec_name,
-                    "fetch",
-                    "--depth", "1", # avoid getting whole repo history
-                    self.url, # repo URL
-                    self.branch or "", # branch to fetch
-                ], kill_after_timeout=20)
-        except git.exc.GitCommandError as e:
-            # This is where errors occur, which is hopefully about auth.
-            raise fs.errors.CreateFailed("The repository URL is either not valid, not public, or ssh_key was not specified or not valid (%s)." % e.stderr)
-
-        # Get the tree for the remote branch's HEAD.
-        tree = self.repo.tree("FETCH_HEAD")
-
-        # The Pythonic way would be to add a remote for the remote repository, run
-        # fetch, and then access its ref.
-        #self.remote = self.repo.create_remote("origin", self.spec["url"])
-        #self.remote.fetch(self.spec.get("branch"))
-        #tree = self.repo.tree(self.remote.refs[0])
-
-        # If a path was given, move to that subdirectory.
-        # TODO: Check that paths with subdirectories that have no other content
-        # but an inner subdirectory work, because git does something funny about
-        # flattening empty directories.
-        for pathitem in self.path.split("/"):
-            if pathitem != "":
-                tree = tree[pathitem]
+            with open(index_file) as f:
+                index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            index = self.build_index(tree_sha)
+            self.write_index(index_file, index)
 
         # Cache and return it.
-        self.repo_root_tree = tree
-        return tree
+        self.index = index
+        return index
+
+    def build_index(self, tree_sha):
+        # Return a dict from each directory path in the tree, with "" for the
+        # tree itself, to a list of [name, is_dir, hash] for its entries,
+        # using a single git command to list the whole tree.
+        index = { "": [] }
+        for record in self.repo.git.ls_tree("-r", "-t", "-z", tree_sha).split("\0"):
+            if not record: continue
+            meta, name = record.split("\t", 1)
+            mode, item_type, sha = meta.split(" ")
+            if item_type not in ("tree", "blob"): continue
+            parent, _, basename = name.rpartition("/")
+            index.setdefault(parent, []).append([basename, item_type == "tree", sha])
+            if item_type == "tree":
+                index.setdefault(name, [])
+        return index
+
+    @staticmethod
+    def write_index(index_file, index):
+        # Write to a temporary file and then move it into place, so that other
+        # processes never see a partially written index.
+        import json, os, tempfile
+        os.makedirs(os.path.dirname(index_file), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(index_file), prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(index, f)
+            os.replace(temp_path, index_file)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
 
     def getdir(self, path):
-        tree = self.get_repo_root()
-        for item in path.split("/"):
-            if item != "":
-                try:
-                    tree = tree[item] # TODO: As above.
-                except KeyError:
-                    raise fs.errors.ResourceNotFound(path)
-        return tree
+        index = self.get_index()
+        path = "/".join(item for item in path.split("/") if item != "")
+        if path not in index:
+            raise fs.errors.ResourceNotFound(path)
+        return index[path]
 
     def scandir(self, path, namespaces=None, page=None):
-        # Get the root tree and then move to the desired subdirectory.
         from fs.info import Info
-        tree = self.getdir(path)
-        for item in tree:
-            if item.type not in ("tree", "blob"): continue
+        for name, is_dir, sha in self.getdir(path):
             yield Info({
                 "basic": {
-                    "name": item.name,
-                    "is_dir": item.type == "tree",
+                    "name": name,
+                    "is_dir": is_dir,
                 },
                 "hash": {
-                    "sha1": item.hexsha,
+                    "sha1": sha,
                 }
             })
 
     def openbin(self, path, mode="r", **options):
-        # Get the root tree and then move to the desired item.
+        # Find the blob in its directory's listing and read it from the mirror.
         if mode not in ("r", "rb"): raise ValueError("Invalid open mode. Must be 'r' or 'rb'.")
         import io
-        tree = self.getdir(path)
-        return io.BytesIO(tree.data_stream.read())
+        parent, _, name = path.strip("/").rpartition("/")
+        for entry_name, is_dir, sha in self.getdir(parent):
+            if entry_name == name and not is_dir:
+                return io.BytesIO(self.repo.odb.stream(bytes.fromhex(sha)).read())
+        raise fs.errors.ResourceNotFound(path)
 
 
 # This class implements AppSourceConnection for a git repository,
@@ -603,9 +697,11 @@ class GitRepositoryAppSourceConnection(PyFsAppSourceConnection):
         if not isinstance(options.get("url"), str): raise ValueError("The AppSource is misconfigured: missing or invalid 'url'.")
         if not isinstance(options.get("branch"), (str, type(None))): raise ValueError("The AppSource is misconfigured: missing or invalid 'url'.")
         if not isinstance(options.get("path"), (str, type(None))): raise ValueError("The AppSource is misconfigured: missing or invalid 'path'.")
+        from django.conf import settings
+        mirror_dir = getattr(settings, "GR_GIT_MIRROR_DIR", None) or None
         super().__init__(source, lambda : GitRepositoryFilesystem(
             options["url"], options.get("branch"), options.get("path"),
-            options.get("ssh_key")))
+            options.get("ssh_key"), mirror_dir))
 
 
 def read_yaml_file(f):
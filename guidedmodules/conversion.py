@@ -0,0 +1,433 @@
+"""
+Background conversion of output documents to PDF, DOCX and the other
+formats produced by wkhtmltopdf and pandoc.
+
+Conversions run in a bounded pool of long-lived worker processes
+(GR_DOCUMENT_CONVERSION_WORKERS) rather than in the request thread. A
+conversion job is identified by a hash of its output format, its HTML,
+and its reference document, so the same document is converted only once.
+Each job's result is written to GR_DOCUMENT_CONVERSION_DIR, which is shared
+by all of the processes on a host. Any process can then report the job's
+status and serve its result. The least recently used results are removed
+when there are more than GR_DOCUMENT_CONVERSION_MAX_RESULTS. The downloads
+that a job's result may be served as (its "owners", e.g. a task, document
+and format) are recorded with it, so that a job id alone doesn't give
+access to its result.
+
+The converter is a function named by GR_DOCUMENT_CONVERTER that takes the
+output format ("pdf" or a pandoc output format name), the HTML as a string,
+and the reference document as bytes or None, and returns the converted
+document as bytes. Tests replace it with a stub.
+"""
+
+import hashlib
+import importlib
+import json
+import multiprocessing.util
+import os
+import signal
+import subprocess  # nosec
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from structlog import get_logger
+
+logger = get_logger()
+
+# Bump this to ignore the results of earlier versions of the converters.
+CONVERSION_VERSION = 1
+
+
+class ConversionError(Exception):
+    pass
+
+
+class ConversionTimeout(ConversionError):
+    # The job is still pending.
+    pass
+
+
+def get_conversion_dir():
+    return settings.GR_DOCUMENT_CONVERSION_DIR
+
+
+def get_job_id(output_format, html, reference_doc=None):
+    """Return the id of the job that converts this HTML to this format"""
+    h = hashlib.sha256()
+    h.update("{}\0{}\0{}\0".format(CONVERSION_VERSION, settings.GR_DOCUMENT_CONVERTER, output_format).encode("utf8"))
+    h.update(hashlib.sha256(html.encode("utf8")).digest())
+    h.update(hashlib.sha256(reference_doc or b"").digest())
+    return h.hexdigest()
+
+
+def is_job_id(job_id):
+    return isinstance(job_id, str) and len(job_id) == 64 and all(c in "0123456789abcdef" for c in job_id)
+
+
+def _get_path(job_id, suffix):
+    if not is_job_id(job_id):
+        raise ValueError("Invalid conversion job id.")
+    return os.path.join(get_conversion_dir(), job_id + suffix)
+
+
+def _write_file(path, data):
+    # Write to a temporary file and then move it into place, so that other
+    # processes never see a partially written file.
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+#####################################################################
+# Job status.
+
+def get_status(job_id):
+    """Return "done", "failed", or "pending", or None if there is no such job
+    or it was abandoned"""
+    if os.path.exists(_get_path(job_id, ".result")):
+        return "done"
+    if os.path.exists(_get_path(job_id, ".error")):
+        return "failed"
+    try:
+        started = os.path.getmtime(_get_path(job_id, ".pending"))
+    except FileNotFoundError:
+        return None
+    # A job is abandoned if the process that started it was stopped before
+    # the job finished. Conversions time out well before then.
+    if time.time() - started > settings.GR_DOCUMENT_CONVERSION_TIMEOUT * 2:
+        return None
+    return "pending"
+
+
+def get_result(job_id):
+    """Return the converted document of a finished job, or None"""
+    path = _get_path(job_id, ".result")
+    try:
+        with open(path, "rb") as f:
+            blob = f.read()
+    except FileNotFoundError:
+        return None
+    # Mark the result as recently used.
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+    return blob
+
+
+def get_error(job_id):
+    """Return the error message of a failed job, or None"""
+    try:
+        with open(_get_path(job_id, ".error"), "rb") as f:
+            return f.read().decode("utf8", "replace")
+    except FileNotFoundError:
+        return None
+
+
+def add_owner(job_id, owner):
+    """Record that a job's result may be downloaded as owner, a dict that
+    identifies the download"""
+    if get_owner(job_id, owner) is not None:
+        return
+    # Appends of a single short line are atomic, so no lock is needed.
+    with open(_get_path(job_id, ".owners"), "a") as f:
+        f.write(json.dumps(owner, sort_keys=True) + "\n")
+
+
+def get_owner(job_id, match):
+    """Return the first recorded owner of a job that has all of the items
+    in match, or None"""
+    try:
+        with open(_get_path(job_id, ".owners")) as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return None
+    for line in lines:
+        try:
+            owner = json.loads(line)
+        except ValueError:
+            continue
+        if all(owner.get(key) == value for key, value in match.items()):
+            return owner
+    return None
+
+
+def prune_results(max_results=None):
+    """Remove the least recently used results when there are too many"""
+    if max_results is None:
+        max_results = settings.GR_DOCUMENT_CONVERSION_MAX_RESULTS
+    results = []
+    with os.scandir(get_conversion_dir()) as entries:
+        for entry in entries:
+            if entry.name.endswith((".result", ".error")):
+                try:
+                    results.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    pass
+    results.sort(reverse=True)
+    for mtime, path in results[max_results:]:
+        _unlink(path)
+        _unlink(os.path.splitext(path)[0] + ".owners")
+
+
+#####################################################################
+# The worker pool.
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _forget_pool():
+    # A forked child process doesn't own its parent's pool.
+    global _pool
+    _pool = None
+
+
+os.register_at_fork(after_in_child=_forget_pool)
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=settings.GR_DOCUMENT_CONVERSION_WORKERS)
+        return _pool
+
+
+def _reset_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def submit(output_format, html, reference_doc=None):
+    """Start converting HTML to a format in the background unless it's
+    already converted or being converted, and return the job id"""
+    job_id = get_job_id(output_format, html, reference_doc)
+    if get_status(job_id) in ("done", "pending"):
+        return job_id
+
+    # Start the job, replacing the error of a previous try, if any.
+    os.makedirs(get_conversion_dir(), exist_ok=True)
+    _unlink(_get_path(job_id, ".error"))
+    _write_file(_get_path(job_id, ".pending"), b"")
+    args = (settings.GR_DOCUMENT_CONVERTER, output_format, html, reference_doc,
+            get_conversion_dir(), job_id, settings.GR_DOCUMENT_CONVERSION_TIMEOUT)
+    pool = _get_pool()
+    try:
+        future = pool.submit(run_job, *args)
+    except BrokenProcessPool:
+        # A worker process died, e.g. because it ran out of memory. Start
+        # a new pool.
+        _reset_pool(pool)
+        future = _get_pool().submit(run_job, *args)
+    future.add_done_callback(lambda future: _on_job_done(job_id, future))
+    logger.info(
+        event="document_conversion_submit",
+        object={"object": "document_conversion", "id": job_id},
+        output_format=output_format,
+    )
+    prune_results()
+    return job_id
+
+
+def _on_job_done(job_id, future):
+    # run_job records its own errors. This catches a worker process that
+    # died before it could.
+    error = future.exception()
+    if error is not None and get_status(job_id) == "pending":
+        _write_file(_get_path(job_id, ".error"), str(error).encode("utf8"))
+        _unlink(_get_path(job_id, ".pending"))
+
+
+def wait(job_id, timeout=None):
+    """Wait for a job to finish and return the converted document, or raise
+    ConversionError if the job failed or ConversionTimeout if it took too long"""
+    if timeout is None:
+        timeout = settings.GR_DOCUMENT_CONVERSION_TIMEOUT
+    deadline = time.time() + timeout
+    delay = .05
+    while True:
+        status = get_status(job_id)
+        if status == "done":
+            blob = get_result(job_id)
+            if blob is not None:
+                return blob
+        elif status == "failed":
+            raise ConversionError(get_error(job_id))
+        elif status is None:
+            raise ConversionError("The document conversion was abandoned.")
+        if time.time() > deadline:
+            raise ConversionTimeout("The document conversion took too long.")
+        time.sleep(delay)
+        delay = min(delay * 2, 1)
+
+
+def convert(output_format, html, reference_doc=None):
+    """Convert HTML to a format in the worker pool and wait for the result"""
+    return wait(submit(output_format, html, reference_doc))
+
+
+def run_job(converter, output_format, html, reference_doc, conversion_dir, job_id, timeout):
+    """Run a conversion job. This runs in a worker process."""
+    module_name, function_name = converter.rsplit(".", 1)
+    converter = getattr(importlib.import_module(module_name), function_name)
+    start = time.perf_counter()
+    try:
+        blob = converter(output_format, html, reference_doc, timeout=timeout)
+    except Exception as e:
+        _write_file(os.path.join(conversion_dir, job_id + ".error"), (str(e) or repr(e)).encode("utf8"))
+        logger.error(
+            event="document_conversion_error",
+            object={"object": "document_conversion", "id": job_id},
+            output_format=output_format,
+            error=str(e) or repr(e),
+        )
+    else:
+        _write_file(os.path.join(conversion_dir, job_id + ".result"), blob)
+        logger.info(
+            event="document_conversion_done",
+            object={"object": "document_conversion", "id": job_id},
+            output_format=output_format,
+            size=len(blob),
+            ms=round((time.perf_counter() - start) * 1000),
+        )
+    finally:
+        _unlink(os.path.join(conversion_dir, job_id + ".pending"))
+
+
+#####################################################################
+# The converters.
+
+# Each worker process starts its own X virtual framebuffer for wkhtmltopdf
+# the first time it's needed and keeps it running, rather than starting
+# one for each conversion with xvfb-run. It is stopped when the worker
+# process exits, including when the pool is shut down or reset, and it is
+# killed if the worker process dies without stopping it.
+_xvfb = None
+
+
+def _stop_xvfb():
+    global _xvfb
+    if _xvfb is not None:
+        proc = _xvfb[0]
+        _xvfb = None
+        proc.terminate()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def _communicate(proc, input, timeout):
+    # Popen.__exit__ waits for the process to exit, so a converter that
+    # takes too long is killed before the timeout is raised.
+    try:
+        return proc.communicate(input, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.communicate()
+        raise
+
+
+def _die_with_parent():
+    # Runs in the Xvfb child process before it starts. On Linux, ask for
+    # SIGTERM when the worker process that started it dies.
+    if sys.platform.startswith("linux"):
+        import ctypes
+        PR_SET_PDEATHSIG = 1
+        ctypes.CDLL(None).prctl(PR_SET_PDEATHSIG, signal.SIGTERM)
+
+
+def _get_xvfb_display():
+    global _xvfb
+    if _xvfb is not None and _xvfb[0].poll() is None:
+        return _xvfb[1]
+    _xvfb = None
+    if not os.path.exists("/usr/bin/Xvfb"):
+        return None
+    read_fd, write_fd = os.pipe()
+    proc = subprocess.Popen(  # nosec
+        ["/usr/bin/Xvfb", "-displayfd", str(write_fd), "-nolisten", "tcp", "-screen", "0", "640x480x24"],
+        pass_fds=(write_fd,), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        preexec_fn=_die_with_parent)
+    os.close(write_fd)
+    _xvfb = (proc, None)
+    # Xvfb writes the display number it chose when it's ready.
+    with os.fdopen(read_fd) as f:
+        display = f.readline().strip()
+    if proc.poll() is not None or not display:
+        _stop_xvfb()
+        return None
+    _xvfb = (proc, ":" + display)
+    # Worker processes exit without running atexit handlers, but they do
+    # run multiprocessing's finalizers.
+    multiprocessing.util.Finalize(None, _stop_xvfb, exitpriority=10)
+    return _xvfb[1]
+
+
+def convert_document(output_format, html, reference_doc, timeout=30):
+    """Convert HTML to PDF using wkhtmltopdf or to another format using pandoc"""
+    if output_format == "pdf":
+        # Mark the encoding explicitly, to match the html.encode() argument below.
+        html = '<meta charset="UTF-8" />' + html
+        cmd = ["/usr/bin/wkhtmltopdf",
+               "-q",  # else errors go to stdout
+               "--disable-javascript",
+               "--encoding", "UTF-8",
+               "-s", "Letter",  # page size
+               "-", "-"]
+        env = dict(os.environ)
+        display = _get_xvfb_display()
+        if display:
+            env["DISPLAY"] = display
+        else:
+            cmd = ["/usr/bin/xvfb-run", "--"] + cmd
+        with subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env) as proc:  # nosec
+            stdout, stderr = _communicate(proc, html.encode("utf8"), timeout)
+            if proc.returncode != 0: raise subprocess.CalledProcessError(proc.returncode, ' '.join(cmd))
+        return stdout
+
+    # odt and some other formats cannot pipe to stdout, so we always
+    # generate a temporary file.
+    with tempfile.TemporaryDirectory() as tempdir:
+        outfn = os.path.join(tempdir, "output")
+        cmd = ["pandoc", "-f", "html", "-s", "--metadata-file=assets/ssp-cover.yaml", "--toc",
+               "--toc-depth=2", "-t", output_format, "-o", outfn]
+        if reference_doc is not None:
+            template_path = os.path.join(tempdir, "reference.docx")
+            with open(template_path, "wb") as f:
+                f.write(reference_doc)
+            cmd[-4:-4] = ["--reference-doc", template_path]
+
+        # Append '# nosec' to line below to tell Bandit to ignore the low risk problem
+        # with not specifying the entire path to pandoc.
+
+        # NOTE: we need to make the pandoc cmd flexible, so non-ssp don't use the ssp yaml file.
+        # Right now, all generated docx files will include the ssp yaml.
+        with subprocess.Popen(cmd, stdin=subprocess.PIPE) as proc:  # nosec
+            _communicate(proc, html.encode("utf8"), timeout)
+            if proc.returncode != 0: raise subprocess.CalledProcessError(proc.returncode, ' '.join(cmd))
+
+        # return the content of the temporary file
+        with open(outfn, "rb") as f:
+            return f.read()
@@ -0,0 +1,55 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from guidedmodules.models import TaskAnswerHistory, DERIVED_ASSET_CACHE_STATS, cached_image_to_dataurl, get_derived_asset_cache
+
+class Command(BaseCommand):
+    help = 'Generates the cached thumbnails of the image file answers of every Task so that downloads don\'t have to generate them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', type=int, nargs="+", help="Only the answers in these projects (by ID)")
+        parser.add_argument('--all-history', action="store_true", help="Also the answers that have been replaced by later answers")
+
+    def handle(self, *args, **options):
+        if get_derived_asset_cache() is None:
+            print("The derived-assets cache is not configured.")
+            return
+
+        answers = TaskAnswerHistory.objects\
+            .exclude(answered_by_file="")\
+            .exclude(answered_by_file=None)\
+            .select_related("taskanswer__question")\
+            .order_by("id")
+        if options["project"]:
+            answers = answers.filter(taskanswer__task__project__in=options["project"])
+        if not options["all_history"]:
+            # Only the current answer to each question.
+            answers = answers.filter(id__in=TaskAnswerHistory.objects
+                .values("taskanswer")
+                .annotate(current_id=Max("id"))
+                .values("current_id"))
+
+        start = perf_counter()
+        hits = DERIVED_ASSET_CACHE_STATS["hits"]
+        count = 0
+        errors = 0
+        for answer in answers.iterator():
+            q = answer.taskanswer.question
+            if q.spec.get("type") != "file":
+                continue
+            # These are the data URLs that TaskAnswerHistory.get_value generates.
+            files = [answer.thumbnail] if answer.thumbnail else []
+            if q.spec.get("file-type") == "image":
+                files.append(answer.answered_by_file)
+            for f in files:
+                try:
+                    cached_image_to_dataurl(f, 640)
+                    count += 1
+                except Exception as e:
+                    print("Answer {} ({}): {}".format(answer.id, f.name, e))
+                    errors += 1
+
+        print("Cached {} images ({} were already cached) with {} errors in {:.1f} s.".format(
+            count, DERIVED_ASSET_CACHE_STATS["hits"] - hits, errors, perf_counter() - start))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from guidedmodules.models import TaskAncestor, TaskParent
+
+class Command(BaseCommand):
+    help = 'Rebuilds the TaskParent and TaskAncestor records, which Task.get_access_level reads, from the current answers of every Task.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action="store_true", help="Only report the records that are missing or wrong, and fail if there are any")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            edges, ancestors = TaskAncestor.get_all_current()
+            differences = 0
+            for model, field, expected in ((TaskParent, "parent_id", edges), (TaskAncestor, "ancestor_id", ancestors)):
+                existing = set(model.objects.values_list("task_id", field))
+                missing = expected - existing
+                extra = existing - expected
+                differences += len(missing) + len(extra)
+                print("{}: {} records, {} missing, {} not current.".format(
+                    model.__name__, len(expected), len(missing), len(extra)))
+                if options["verify"]:
+                    continue
+
+                for task_id, other_id in extra:
+                    model.objects.filter(task_id=task_id, **{ field: other_id }).delete()
+                model.objects.bulk_create([
+                    model(task_id=task_id, **{ field: other_id })
+                    for task_id, other_id in missing
+                ], batch_size=1000)
+
+        if options["verify"] and differences:
+            raise CommandError("The task ancestors are not up to date.")
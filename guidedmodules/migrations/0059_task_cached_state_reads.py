@@ -0,0 +1,25 @@
+# Generated by Django 3.2.5 on 2026-10-18 11:46
+
+from django.db import migrations, models
+
+def forwards_func(apps, schema_editor):
+    # Existing cached_state was computed without recording which other
+    # Tasks it read, so it would no longer be cleared when those Tasks
+    # change. Clear it so that it is recomputed on demand.
+    task_model = apps.get_model("guidedmodules", "Task")
+    task_model.objects.update(cached_state=None)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guidedmodules', '0058_appinput_input_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='cached_state_reads',
+            field=models.ManyToManyField(blank=True, help_text="The other Tasks whose answers or cached state were read to compute this Task's cached_state. When they change, this Task's cached_state is cleared.", related_name='cached_state_readers', to='guidedmodules.Task'),
+        ),
+        migrations.RunPython(forwards_func, migrations.RunPython.noop),
+    ]
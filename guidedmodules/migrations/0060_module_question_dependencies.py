@@ -0,0 +1,19 @@
+# Generated by Django 3.2.5 on 2026-10-18 11:51
+
+from django.db import migrations
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guidedmodules', '0059_task_cached_state_reads'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='module',
+            name='question_dependencies',
+            field=jsonfield.fields.JSONField(blank=True, help_text="The dependency graph of the Module's questions, precomputed when the Module is loaded. See module_logic.compute_question_dependency_graph.", null=True),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 3.2.5 on 2026-10-18 12:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+def forwards_func(apps, schema_editor):
+    # Log the existing answers so that changes since a time before the
+    # migration are found.
+    TaskAnswerHistory = apps.get_model("guidedmodules", "TaskAnswerHistory")
+    ProjectAnswerChange = apps.get_model("guidedmodules", "ProjectAnswerChange")
+    answers = TaskAnswerHistory.objects \
+        .order_by("id") \
+        .values_list("id", "created", "taskanswer__task_id", "taskanswer__task__project_id")
+    batch = []
+    for answer_id, created, task_id, project_id in answers.iterator():
+        batch.append(ProjectAnswerChange(project_id=project_id, task_id=task_id, answer_id=answer_id, created=created))
+        if len(batch) == 1000:
+            ProjectAnswerChange.objects.bulk_create(batch)
+            batch = []
+    ProjectAnswerChange.objects.bulk_create(batch)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('siteapp', '0052_alter_user_name'),
+        ('guidedmodules', '0060_module_question_dependencies'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectAnswerChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(help_text="The time the answer was saved, the same as its TaskAnswerHistory's created time.")),
+                ('answer', models.ForeignKey(help_text='The new TaskAnswerHistory record.', on_delete=django.db.models.deletion.CASCADE, related_name='+', to='guidedmodules.taskanswerhistory')),
+                ('project', models.ForeignKey(help_text='The Project that the Task of the answer is in.', on_delete=django.db.models.deletion.CASCADE, related_name='answer_changes', to='siteapp.project')),
+                ('task', models.ForeignKey(help_text='The Task that was answered.', on_delete=django.db.models.deletion.CASCADE, related_name='+', to='guidedmodules.task')),
+            ],
+            options={
+                'index_together': {('project', 'created')},
+            },
+        ),
+        migrations.RunPython(forwards_func, migrations.RunPython.noop),
+    ]
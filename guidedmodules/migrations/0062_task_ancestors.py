@@ -0,0 +1,79 @@
+# Generated by Django 3.2.5 on 2026-10-18 13:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+def forwards_func(apps, schema_editor):
+    # Record the Tasks that are current answers of other Tasks, the same as
+    # TaskParent.get_current and TaskAncestor.get_all_current.
+    TaskAnswerHistory = apps.get_model("guidedmodules", "TaskAnswerHistory")
+    TaskParent = apps.get_model("guidedmodules", "TaskParent")
+    TaskAncestor = apps.get_model("guidedmodules", "TaskAncestor")
+    current_answers = TaskAnswerHistory.objects \
+        .values("taskanswer") \
+        .annotate(current_id=models.Max("id")) \
+        .values("current_id")
+    parents = { }
+    for task_id, parent_id in TaskAnswerHistory.answered_by_task.through.objects \
+            .filter(taskanswerhistory__in=current_answers) \
+            .values_list("task_id", "taskanswerhistory__taskanswer__task_id"):
+        if task_id != parent_id:
+            parents.setdefault(task_id, set()).add(parent_id)
+    TaskParent.objects.bulk_create([
+        TaskParent(task_id=task_id, parent_id=parent_id)
+        for task_id, parent_ids in parents.items()
+        for parent_id in parent_ids
+    ], batch_size=1000)
+
+    # Grow the sets of ancestors until they stop changing, since answers
+    # can form cycles.
+    ancestors = { task_id: set() for task_id in parents }
+    changed = True
+    while changed:
+        changed = False
+        for task_id, parent_ids in parents.items():
+            new_ancestors = set(parent_ids)
+            for parent_id in parent_ids:
+                new_ancestors |= ancestors.get(parent_id, set())
+            new_ancestors.discard(task_id)
+            if new_ancestors != ancestors[task_id]:
+                ancestors[task_id] = new_ancestors
+                changed = True
+    TaskAncestor.objects.bulk_create([
+        TaskAncestor(task_id=task_id, ancestor_id=ancestor_id)
+        for task_id, ancestor_ids in ancestors.items()
+        for ancestor_id in ancestor_ids
+    ], batch_size=1000)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guidedmodules', '0061_project_answer_change'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskParent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('parent', models.ForeignKey(help_text='The Task that has a question that the Task is a current answer to.', on_delete=django.db.models.deletion.CASCADE, related_name='+', to='guidedmodules.task')),
+                ('task', models.ForeignKey(help_text='The Task that is a current answer.', on_delete=django.db.models.deletion.CASCADE, related_name='+', to='guidedmodules.task')),
+            ],
+            options={
+                'unique_together': {('task', 'parent')},
+            },
+        ),
+        migrations.CreateModel(
+            name='TaskAncestor',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ancestor', models.ForeignKey(help_text='The Task that the Task is a current answer of.', on_delete=django.db.models.deletion.CASCADE, related_name='+', to='guidedmodules.task')),
+                ('task', models.ForeignKey(help_text='The Task that is a current answer, directly or indirectly.', on_delete=django.db.models.deletion.CASCADE, related_name='+', to='guidedmodules.task')),
+            ],
+            options={
+                'unique_together': {('task', 'ancestor')},
+                'index_together': {('ancestor', 'task')},
+            },
+        ),
+        migrations.RunPython(forwards_func, migrations.RunPython.noop),
+    ]
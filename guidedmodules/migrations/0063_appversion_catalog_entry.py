@@ -0,0 +1,19 @@
+# Generated by Django 3.2.5 on 2026-10-18 13:12
+
+from django.db import migrations
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('guidedmodules', '0062_task_ancestors'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appversion',
+            name='catalog_entry',
+            field=jsonfield.fields.JSONField(blank=True, help_text="The app's entry in the compliance app catalog, rendered from its catalog metadata when the app is loaded.", null=True),
+        ),
+    ]
@@ -1,5 +1,6 @@
 import logging
 import structlog
+import threading
 from django.utils.functional import cached_property
 from structlog import get_logger
 
@@ -10,13 +11,15 @@ from django.conf import settings
 from jsonfield import JSONField
 from copy import deepcopy
 from collections import OrderedDict
+from collections.abc import ValuesView
 import uuid
 
 from siteapp.enums.assets import AssetTypeEnum
 from guidedmodules.enums.inputs import InputTypeEnum
-from .module_logic import ModuleAnswers, render_content
+from .module_logic import ModuleAnswers, render_content, TaskStateReadRecorder, record_task_state_read
 from .answer_validation import validator
-from siteapp.models import User, Organization, Project, ProjectMembership
+from . import conversion as document_conversion
+from siteapp.models import User, Organization, Project, ProjectMembership, ProjectSummary
 from guardian.shortcuts import (assign_perm, get_objects_for_user,
                                 get_perms_for_model, get_user_perms,
                                 get_users_with_perms, remove_perm)
@@ -130,6 +133,7 @@ class AppVersion(models.Model):
                                      help_text="Set to True for AppVersions that are the current version of a system app that provides system-expected Modules. A constraint ensures that only one (source, name) pair can be true.")
 
     catalog_metadata = JSONField(blank=True, help_text="The catalog metadata that was stored in the 'app' module.")
+    catalog_entry = JSONField(blank=True, null=True, help_text="The app's entry in the compliance app catalog, rendered from its catalog metadata when the app is loaded.")
     version_number = models.CharField(blank=True, null=True, max_length=128,
                                       help_text="The version number of the compliance app.")
     version_name = models.CharField(blank=True, null=True, max_length=128,
@@ -188,6 +192,81 @@ class AppVersion(models.Model):
         import rtyaml
         return rtyaml.dump(self.catalog_metadata)
 
+    # Bump this to re-render the catalog entries rendered by earlier
+    # versions of render_catalog_entry.
+    CATALOG_ENTRY_VERSION = 2
+
+    def render_catalog_entry(self):
+        # Render the app's entry in the compliance app catalog, which is the
+        # same for every organization and user. The views add the app's key
+        # and AppSource, which can be renamed after the entry is stored, and
+        # the AppVersions and organizations that the app can be started with.
+        catalog = self.catalog_metadata
+        if not isinstance(catalog, dict): catalog = {}
+
+        app_module = self.modules.filter(module_name="app").first()
+
+        return {
+            "entry_version": AppVersion.CATALOG_ENTRY_VERSION,
+
+            # main display fields
+            "title": catalog.get('title') or self.appname,
+            "description": {  # rendered as markdown
+                "short": render_content(
+                    {
+                        "template": catalog.get("description", {}).get("short") or "",
+                        "format": "markdown",
+                    },
+                    None,
+                    "html",
+                    "%s %s" % (self.appname, "short description")
+                ),
+                "long": render_content(
+                    {
+                        "template": catalog.get("description", {}).get("long")
+                                    or catalog.get("description", {}).get("short")
+                                    or "",
+                        "format": "markdown",
+                    },
+                    None,
+                    "html",
+                    "%s %s" % (self.appname, "long description")
+                )
+            },
+
+            # catalog page metadata
+            "categories": catalog.get("categories", [catalog.get("category")]),
+            "search_haystak": "".join([  # free text search uses this
+                self.appname,
+                catalog.get('title', ""),
+                catalog.get("vendor", ""),
+                catalog.get("description", {}).get("short", ""),
+                catalog.get("description", {}).get("long", ""),
+            ]),
+            "icon": None if "icon" not in catalog
+            else cached_image_to_dataurl(self.get_asset(catalog["icon"]), 128,
+                                         content_hash=self.asset_paths[catalog["icon"]]),
+            "protocol": app_module.spec.get("protocol", []) if app_module else [],
+
+            # catalog detail page metadata
+            "vendor": catalog.get("vendor"),
+            "vendor_url": catalog.get("vendor_url"),
+            "source_url": catalog.get("source_url"),
+            "status": catalog.get("status"),
+            "version": self.version_number,
+            "recommended_for": catalog.get("recommended_for", []),
+        }
+
+    def get_catalog_entry(self):
+        # Return the catalog entry that was rendered when the app was loaded,
+        # rendering and storing it if it wasn't or it is out of date.
+        entry = self.catalog_entry
+        if not isinstance(entry, dict) or entry.get("entry_version") != AppVersion.CATALOG_ENTRY_VERSION:
+            entry = self.render_catalog_entry()
+            AppVersion.objects.filter(id=self.id).update(catalog_entry=entry)
+            self.catalog_entry = entry
+        return entry
+
     def is_authoring_tool_enabled(self, user):
         return (user.has_perm('guidedmodules.change_module'))
 
@@ -210,6 +289,56 @@ class AppVersion(models.Model):
             return True
         return False
 
+    @staticmethod
+    def get_catalog(organization, role):
+        # Return the apps that can be started in the organization by users who
+        # have the guidedmodules.view_appsource permission (role True) or who
+        # don't (role False), the same as get_startable_apps except for which
+        # individuals they are available to. Each app (a source and app name)
+        # is a dict with its startable AppVersions, the most recent first, and
+        # the ids of the users it is available to, or None if it's available to
+        # all individuals. The apps are cached until an app is loaded or changed
+        # or an AppSource's availability changes.
+        from django.core.cache import cache
+        key = "apps-catalog:{}:{}:{}".format(organization.id, int(role), get_apps_catalog_version())
+        catalog = cache.get(key)
+        if catalog is None:
+            catalog = AppVersion.build_catalog(organization, role)
+            cache.set(key, catalog, APPS_CATALOG_CACHE_TIMEOUT)
+        return catalog
+
+    @staticmethod
+    def build_catalog(organization, role):
+        from collections import defaultdict
+        from django.db.models import Q
+        appvers = AppVersion.objects \
+            .select_related('source') \
+            .filter(show_in_catalog=True) \
+            .filter(source__is_system_source=False) \
+            .filter(source__available_to_role=role) \
+            .filter(Q(source__available_to_all=True) | Q(source__available_to_orgs=organization))
+
+        # Group the AppVersions into apps. An app is a unique source+appname pair.
+        # Sort each app's AppVersions by reverse database row created date (since
+        # we don't necessarily have sortable version numbers).
+        apps = defaultdict(list)
+        for av in appvers:
+            apps[(av.source_id, av.appname)].append(av)
+        individuals = defaultdict(set)
+        for source_id, user_id in AppSource.available_to_individual.through.objects \
+                .filter(appsource__in={source_id for source_id, appname in apps}) \
+                .values_list("appsource_id", "user_id"):
+            individuals[source_id].add(user_id)
+
+        catalog = []
+        for (source_id, appname), versions in apps.items():
+            versions.sort(key=lambda av: av.created, reverse=True)
+            catalog.append({
+                "versions": versions,
+                "individuals": None if versions[0].source.available_to_all_individuals else individuals[source_id],
+            })
+        return catalog
+
     @staticmethod
     def get_startable_apps(organization, userid):
         # Load all of the startable AppVersions. An AppVersion is startable
@@ -233,6 +362,46 @@ class AppVersion(models.Model):
             .filter(Q(source__available_to_all=True) | Q(source__available_to_orgs=organization))
 
 
+# The compliance app catalog (see AppVersion.get_catalog) is cached in the
+# default cache until the version changes.
+APPS_CATALOG_VERSION_KEY = "apps-catalog-version"
+APPS_CATALOG_CACHE_TIMEOUT = 300
+
+def get_apps_catalog_version():
+    from django.core.cache import cache
+    version = cache.get(APPS_CATALOG_VERSION_KEY)
+    if version is None:
+        # Start from the current time if the counter is missing or was
+        # evicted, so that it doesn't go back to a version that was used.
+        import time
+        version = int(time.time() * 1000)
+        if not cache.add(APPS_CATALOG_VERSION_KEY, version, None):
+            version = cache.get(APPS_CATALOG_VERSION_KEY, version)
+    return version
+
+def on_apps_catalog_changed(**kwargs):
+    from django.core.cache import cache
+    try:
+        cache.incr(APPS_CATALOG_VERSION_KEY)
+    except ValueError:
+        # The counter is missing, so there are no cached catalogs to drop.
+        pass
+
+def on_apps_catalog_m2m_changed(action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        on_apps_catalog_changed()
+
+def connect_apps_catalog_signals():
+    from django.db.models.signals import m2m_changed, post_delete, post_save
+    for model in (AppSource, AppVersion):
+        post_save.connect(on_apps_catalog_changed, sender=model, dispatch_uid="apps-catalog")
+        post_delete.connect(on_apps_catalog_changed, sender=model, dispatch_uid="apps-catalog")
+    for through in (AppSource.available_to_orgs.through, AppSource.available_to_individual.through):
+        m2m_changed.connect(on_apps_catalog_m2m_changed, sender=through, dispatch_uid="apps-catalog")
+
+connect_apps_catalog_signals()
+
+
 def extract_catalog_metadata(app_module, migration=None):
     # Note that this function is used in migration 0044 and so
     # must be compatible to run in the migration and must be
@@ -337,6 +506,8 @@ class Module(models.Model):
 
     spec = JSONField(help_text="Module definition data.", load_kwargs={'object_pairs_hook': OrderedDict})
 
+    question_dependencies = JSONField(blank=True, null=True, help_text="The dependency graph of the Module's questions, precomputed when the Module is loaded. See module_logic.compute_question_dependency_graph.")
+
     created = models.DateTimeField(auto_now_add=True, db_index=True)
     updated = models.DateTimeField(auto_now=True, db_index=True)
 
@@ -686,6 +857,8 @@ class Task(models.Model):
                                       help_text="If 'deleted' by a user, the date & time the Task was deleted.")
     cached_state = JSONField(blank=True, default=None,
                              help_text="Cached value storing whether the Task is finished, its computed title, and other state that depends on question answers.")
+    cached_state_reads = models.ManyToManyField('self', symmetrical=False, blank=True, related_name="cached_state_readers",
+                                                help_text="The other Tasks whose answers or cached state were read to compute this Task's cached_state. When they change, this Task's cached_state is cleared.")
     extra = JSONField(blank=True, help_text="Additional information stored with this object.")
     invitation_history = models.ManyToManyField('siteapp.Invitation', blank=True,
                                                 help_text="The history of accepted invitations that had this Task as a target.")
@@ -763,7 +936,7 @@ class Task(models.Model):
             return "/error/image/asset_path[" + asset_path + "]/path-is-not-an-asset."
         with self.module.app.get_asset(asset_path) as f:
             try:
-                return image_to_dataurl(f, max_image_size)
+                return cached_image_to_dataurl(f, max_image_size, content_hash=self.module.app.asset_paths[asset_path])
             except:
                 # image processing error
                 print("ERROR: '" + "{}".format(
@@ -777,51 +950,55 @@ class Task(models.Model):
         # Efficiently get the current answer to every question of each of the tasks.
         #
         # Since we track the history of answers to each question, we need to get the most
-        # recent answer for each question. It's fastest if we pre-load the complete history
-        # of every question rather than making a separate database call for each question
-        # to find its most recent answer. See TaskAnswer.get_current_answer().
+        # recent answer for each question. Rather than making a separate database call for
+        # each question (see TaskAnswer.get_current_answer()) or loading the complete history
+        # of every question, we fetch only the TaskAnswerHistory record with the highest id
+        # for each TaskAnswer, using a subquery, so that the time it takes doesn't grow with
+        # the length of the history.
         #
         # Return a generator that yields tuples of (Task, ModuleQuestion, TaskAnswerHistory).
         # Among tuples for a particular Task, the tuples are in order of ModuleQuestion.definition_order.
 
-        # Batch load all of the current answers of the tasks.
-        current_answers = {}
+        # Batch load all of the current answers of the tasks. If the answer is marked
+        # as cleared, then treat as if it had not been there at all.
+        from django.db.models import Max
+        latest_ids = TaskAnswer.objects \
+            .filter(task__in=tasks) \
+            .values('id') \
+            .annotate(latest_id=Max('answer_history__id')) \
+            .values('latest_id')
         history = TaskAnswerHistory.objects \
             .select_related('taskanswer', 'taskanswer__question') \
-            .filter(taskanswer__task__in=tasks) \
-            .order_by('-id')
-
-        tasks_ = {task.id: task for task in
-                 Task.objects.select_related('module', 'project').filter(id__in=history.values_list("taskanswer__task_id", flat=True))}
-        questions = {question.id: question for question in
-                     ModuleQuestion.objects.select_related('module').filter(id__in=history.values_list('taskanswer__question_id', flat=True))}
+            .filter(id__in=latest_ids, cleared=False)
+        current_answers = {
+            (ansh.taskanswer.task_id, ansh.taskanswer.question_id): ansh
+            for ansh in history
+        }
 
-        for ansh in history:
-            current_answers.setdefault((tasks_.get(ansh.taskanswer.task_id), questions.get(ansh.taskanswer.question_id)), ansh)
+        # Batch load all of the ModuleQuestions, grouped by Module.
+        questions = { }
+        for question in ModuleQuestion.objects.prefetch_related('answer_type_module__questions').select_related('module') \
+                .filter(module__in={task.module_id for task in tasks}) \
+                .order_by("definition_order"):
+            questions.setdefault(question.module_id, []).append(question)
 
-        # Batch load all of the ModuleQuestions.
-        questions = ModuleQuestion.objects.prefetch_related('answer_type_module__questions').select_related('module') \
-            .filter(module__in={task.module for task in tasks}) \
-            .order_by("definition_order")
         # Iterate over the tasks and their questions in order...
         for task in tasks:
-            for question in questions:
-                # Skip if this question is not for this task.
-                if question.module != task.module: continue
-
-                # Get the latest TaskAnswerHistory instance, if there is any.
-
-                answer = current_answers.get((task, question), None)
-
-                # If the answer is marked as cleared, then treat as if it had
-                # not been there at all.
-                if answer and answer.cleared:
-                    answer = None
-
-                # Yield.
+            for question in questions.get(task.module_id, []):
+                # Get the latest TaskAnswerHistory instance, if there is any, and yield.
+                answer = current_answers.get((task.id, question.id), None)
+                if answer is not None:
+                    # Save a query when the answer's Task is needed, e.g. for
+                    # the URL of a file answer.
+                    answer.taskanswer.task = task
                 yield (task, question, answer)
 
     def get_current_answer_records(self):
+        # Use the answers pre-loaded by Task.load_cached_state, if any.
+        batch = CachedStateBatch.current()
+        if batch is not None and self.id in batch.answer_records:
+            yield from batch.answer_records[self.id]
+            return
         for task, question, answer in \
                 Task.get_all_current_answer_records([self]):
             yield (question, answer)
@@ -830,11 +1007,14 @@ class Task(models.Model):
         # Return a ModuleAnswers instance that wraps this Task and its Pythonic answer values.
         # The dict of answers is ordered to preserve the question definition order.
         answertuples = OrderedDict()
+        # The metadata of file answers is loaded for all of them at once
+        # when it is first read.
+        file_metadata = FileAnswerMetadata()
         for q, a in self.get_current_answer_records():
             # Get the value of that answer.
             if a is not None:
                 is_answered = True
-                value = a.get_value()
+                value = a.get_value(file_metadata=file_metadata)
             else:
                 is_answered = False
                 value = None
@@ -865,20 +1045,42 @@ class Task(models.Model):
         return not self.project.is_account_project
 
     def _get_cached_state(self, key, refresh_func):
+        # Within Task.load_cached_state, all instances of a Task share
+        # one cached_state dict.
+        batch = CachedStateBatch.current()
+        if batch is not None:
+            self.cached_state = batch.get_cached_state(self)
+
         # Initialize the cached_state field if it is null.
         if not isinstance(self.cached_state, dict):
             self.cached_state = {}
 
         # Handle a cache miss --- call refresh_func() and
-        # then save it to cached_state (and save to the db).
+        # then save it to cached_state (and save to the db,
+        # or leave it to the batch to save).
 
         if key not in self.cached_state:
-            self.cached_state[key] = refresh_func()
-            self.save(update_fields=["cached_state"])
+            with TaskStateReadRecorder() as reads:
+                self.cached_state[key] = refresh_func()
+            if batch is not None:
+                batch.on_cached_state_changed(self, reads)
+            else:
+                self.save(update_fields=["cached_state"])
+                self._save_cached_state_reads(reads)
+
+        # Any cached state being computed now depends on this Task's state.
+        record_task_state_read(self)
 
         # Return cached value.
         return self.cached_state[key]
 
+    def _save_cached_state_reads(self, reads):
+        # Remember which other Tasks were read while computing cached
+        # state so that changes to them clear this Task's cached_state.
+        task_ids = reads.task_ids - {self.id}
+        if task_ids:
+            self.cached_state_reads.add(*task_ids)
+
     def is_started(self):
         return self.answers.exists()
 
@@ -947,22 +1149,71 @@ class Task(models.Model):
 
         return self._get_cached_state("progress_percent_tuple", compute_progress_percent)
 
+    @staticmethod
+    def load_cached_state(tasks):
+        # Compute is_finished and the progress percent of each of the Tasks
+        # and of all of their sub-tasks in bulk, for pages that list many
+        # Tasks. The sub-task tree is loaded a level at a time with a fixed
+        # number of queries per level, each Task's state is computed once
+        # from the bottom up, and all of the cached_state changes are written
+        # with a single bulk_update. Afterwards, calling is_finished() and
+        # get_progress_percent_tuple() on the given Task instances doesn't
+        # touch the database.
+        from django.db.models import prefetch_related_objects
+        with CachedStateBatch() as batch:
+            # Load the sub-task tree, a level at a time, and pre-load the
+            # current answers of every Task in it.
+            levels = []
+            level = list({ task.id: task for task in tasks }.values())
+            while level:
+                levels.append(level)
+                for task in level:
+                    batch.get_cached_state(task)
+                    batch.answer_records[task.id] = []
+                module_answers = []
+                for task, question, answer in Task.get_all_current_answer_records(level):
+                    batch.answer_records[task.id].append((question, answer))
+                    if answer is not None and question.spec["type"] in ("module", "module-set"):
+                        module_answers.append(answer)
+                prefetch_related_objects(module_answers, "answered_by_task__module")
+                subtasks = { }
+                for answer in module_answers:
+                    for task in answer.answered_by_task.all():
+                        if task.id not in batch.answer_records:
+                            subtasks[task.id] = task
+                level = list(subtasks.values())
+
+            # Compute the state of the Tasks from the bottom up, so that
+            # each Task finds the state of its sub-tasks already computed.
+            for level in reversed(levels):
+                for task in level:
+                    task.is_finished()
+                    task.get_progress_percent_tuple()
+
     # This method is called any time an answer to any of this Task's questions
     # is changed, or for questions that are answered by sub-tasks, and if any
     # of their answers changed too, recursively.
     def on_answer_changed(self):
         Task.clear_state({self})
+        if self.module.module_name == "system_basic_info":
+            # The project's acronym may have changed.
+            ProjectSummary.mark_stale([self.project_id])
+
+    # For each project, the number of clear_state calls that affected it and
+    # the number of its Tasks whose cached_state they cleared, since this
+    # process started. get_clear_state_stats works out from them how many
+    # Tasks clearing every Task in the affected projects would also have
+    # cleared.
+    CLEAR_STATE_STATS = {}
 
     # Do the work of clearing the cached_state of a set of Tasks.
     # * Clear the Tasks' cached_state field and bump their 'updated' time so
     #   anyone waiting for changes to the tasks knows a change ocurred.
     # * Do the same for any Tasks that these Tasks are a current answer of a question to.
-    # * Since templates can peek up to the project and see anything within it,
-    #   then any Task in the same project must also have their cache cleared.
-    #   TODO: It would be nice to know whether or not the cached_state is actually
-    #   based on project-level information because most Tasks might not peek
-    #   up and Tasks that don't do not need to have their cached_state cleared
-    #   in this case.
+    # * Templates can peek up to the project and organization and see anything
+    #   within them, so do the same for any Tasks whose cached_state was computed
+    #   by reading these Tasks (see Task.cached_state_reads). Most Tasks never
+    #   peek outside of themselves and their sub-tasks and so are not affected.
     @staticmethod
     def clear_state(tasks):
         tasks = set(tasks)
@@ -982,20 +1233,54 @@ class Task(models.Model):
                           .values_list('current_answer_id', flat=True))
 
             # And filter so we only have current answers remaining.
-            ans = ans.filter(id__in=curans)
+            for a in ans.filter(id__in=curans):
+                new_tasks.add(a.taskanswer.task)
 
-            # Add Tasks in the same Project as any of the Tasks seen so far.
-            for task in Task.objects.filter(project__in={t.project_id for t in target_tasks}):
+            # Add Tasks whose cached_state was computed from any of these Tasks.
+            for task in Task.objects.filter(cached_state_reads__in=target_tasks).distinct():
                 new_tasks.add(task)
 
             new_tasks -= tasks
             tasks |= new_tasks
             target_tasks = new_tasks
 
-        # Clear cached_state
-        tasks_qs = Task.objects.filter(id__in={t.id for t in tasks})
+        # Clear cached_state and the record of what it was computed from.
+        task_ids = {t.id for t in tasks}
+        Task.cached_state_reads.through.objects.filter(from_task__in=task_ids).delete()
+        tasks_qs = Task.objects.filter(id__in=task_ids)
         tasks_qs.update(cached_state=None, updated=timezone.now())
 
+        # The output documents that the projects' lifecycle stages are
+        # rendered from may have changed.
+        project_ids = {t.project_id for t in tasks}
+        ProjectSummary.mark_stale(project_ids, lifecycle_stage=True)
+        logger.debug(event="clear_state", invalidated=len(task_ids))
+
+        # Count the cleared Tasks without querying the projects' other Tasks.
+        for project_id in project_ids:
+            stats = Task.CLEAR_STATE_STATS.setdefault(project_id, [0, 0])
+            stats[0] += 1
+        for t in tasks:
+            Task.CLEAR_STATE_STATS[t.project_id][1] += 1
+
+    @staticmethod
+    def get_clear_state_stats():
+        # Return the number of Tasks clear_state cleared and the number of
+        # other Tasks in the same projects that it didn't have to clear,
+        # counting the projects' Tasks now with one query.
+        clear_state_stats = dict(Task.CLEAR_STATE_STATS)
+        project_task_counts = Task.objects.filter(project__in=list(clear_state_stats)) \
+            .values_list("project") \
+            .annotate(count=models.Count("id"))
+        avoided = 0
+        for project_id, count in project_task_counts:
+            clears, invalidated = clear_state_stats[project_id]
+            avoided += max(clears * count - invalidated, 0)
+        return {
+            "invalidated": sum(invalidated for clears, invalidated in clear_state_stats.values()),
+            "invalidations_avoided": avoided,
+        }
+
     def get_status_display(self):
         # Is this task done?
         if not self.is_finished():
@@ -1014,23 +1299,13 @@ class Task(models.Model):
         ).distinct()
 
         if recursive:
-            # Add in all tasks that these tasks refer to via answers to questions.
-            # (Including tasks in the same project because those may reference
-            # other tasks in other projects with different access levels.)
-            seen_task_ids = set(t.id for t in tasks)
-            tasks1 = tasks
-            while len(tasks1) > 0:
-                # Collect all of the tasks referenced by the last batch as answers,
-                # except ones we've already seen.
-                tasks2 = set()
-                for t in tasks1:
-                    for q, a in t.get_current_answer_records():
-                        if a:
-                            tasks2 |= set(a.answered_by_task.all())
-                tasks2_ids = set(tt.id for tt in tasks2)
-                seen_task_ids |= tasks2_ids
-                tasks |= Task.objects.filter(id__in=tasks2_ids).distinct()
-                tasks1 = tasks2
+            # Add in all tasks that these tasks refer to via answers to questions,
+            # directly or through other tasks. (Including tasks in the same project
+            # because those may reference other tasks in other projects with different
+            # access levels.)
+            tasks = Task.objects.filter(
+                models.Q(id__in=tasks.values("id"))
+                | models.Q(id__in=TaskAncestor.objects.filter(ancestor__in=tasks.values("id")).values("task")))
 
         return tasks
 
@@ -1047,28 +1322,14 @@ class Task(models.Model):
 
         if recursive:
             # Access also comes from access to any Task that refers to this Task as a
-            # *current* answer to the question. First fetch all tasks that refer to this
-            # task, and then filter to see if the answer is current. Include Tasks in
-            # the same project because they may in turn be answers to tasks in other
-            # projects. Expand this out recursively.
-            parent_tasks = set()
-            search_tasks = [self]
-            while len(search_tasks) > 0:
-                ptasks = set(
-                    tah.taskanswer.task
-                    for tah in TaskAnswerHistory.objects
-                        .filter(answered_by_task__in=search_tasks)
-                        .exclude(taskanswer__task__id__in=[t.id for t in parent_tasks])
-                        .select_related("taskanswer__task")
-                    if tah.is_latest())
-                parent_tasks |= ptasks
-                search_tasks = ptasks
-
-            access_levels = set(t.get_access_level(user, recursive=False) for t in parent_tasks)
-            if "WRITE" in access_levels:
+            # *current* answer to the question, directly or through other Tasks (which
+            # may be in the same project and in turn be answers to tasks in other
+            # projects). Those are its TaskAncestors.
+            if Task.objects.filter(
+                    models.Q(editor=user) | models.Q(project__members__user=user),
+                    id__in=TaskAncestor.objects.filter(task=self).values("ancestor"),
+                    deleted_at=None).exists():
                 return "WRITE"
-            if "READ" in access_levels:
-                return "READ"
 
         return None
 
@@ -1190,14 +1451,19 @@ class Task(models.Model):
 
             Task.IS_COMPUTING_TITLE = True
             try:
-                title = self.render_simple_string(
-                    "instance-name", self.module.spec["title"],
-                    is_computing_title=True).strip()
+                with TaskStateReadRecorder() as reads:
+                    title = self.render_simple_string(
+                        "instance-name", self.module.spec["title"],
+                        is_computing_title=True).strip()
             finally:
                 Task.IS_COMPUTING_TITLE = False
 
             self.cached_state["title"] = title
             self.save(update_fields=["cached_state"])
+            self._save_cached_state_reads(reads)
+
+        # Any cached state being computed now depends on this Task's title.
+        record_task_state_read(self)
 
         return self.cached_state["title"]
 
@@ -1239,33 +1505,43 @@ class Task(models.Model):
             answers = self.get_answers()
         return answers.render_output(use_data_urls=use_data_urls)
 
+    # Map output format to:
+    # 1) pandoc format name
+    # 2) typical file extension
+    # 3) MIME type
+    output_document_download_formats = {
+        # these two don't use pandoc
+        "html": (None, "html", "text/html"),
+        "pdf": (None, "pdf", "application/pdf"),
+        "json": (None, "json", "application/x-json"),
+        "yaml": (None, "yaml", "application/x-yaml"),
+        "xml": (None, "xml", "application/x-xml"),
+
+        # the rest use pandoc
+        "plain": ("plain", "txt", "text/plain"),
+        "markdown": ("markdown_github", "md", "text/plain"),
+        "oscal_json": ("markdown_github", "md", "text/plain"),
+        "oscal_yaml": ("markdown_github", "md", "text/plain"),
+        "oscal_xml": ("markdown_github", "md", "text/plain"),
+        "docx": ("docx", "docx", "application/octet-stream"),
+        # "odt": ("odt", "odt", "application/octet-stream"),
+    }
+
     def download_output_document(self, document_id, download_format, answers=None):
-        # Map output format to:
-        # 1) pandoc format name
-        # 2) typical file extension
-        # 3) MIME type
-        format_opts = {
-            # these two don't use pandoc
-            "html": (None, "html", "text/html"),
-            "pdf": (None, "pdf", "application/pdf"),
-            "json": (None, "json", "application/x-json"),
-            "yaml": (None, "yaml", "application/x-yaml"),
-            "xml": (None, "xml", "application/x-xml"),
-
-            # the rest use pandoc
-            "plain": ("plain", "txt", "text/plain"),
-            "markdown": ("markdown_github", "md", "text/plain"),
-            "oscal_json": ("markdown_github", "md", "text/plain"),
-            "oscal_yaml": ("markdown_github", "md", "text/plain"),
-            "oscal_xml": ("markdown_github", "md", "text/plain"),
-            "docx": ("docx", "docx", "application/octet-stream"),
-            # "odt": ("odt", "odt", "application/octet-stream"),
-        }
+        blob, filename, mime_type, conversion = self.prepare_output_document_download(document_id, download_format, answers=answers)
+        if conversion is not None:
+            blob = document_conversion.convert(*conversion)
+        return blob, filename, mime_type
 
-        if download_format not in format_opts:
+    def prepare_output_document_download(self, document_id, download_format, answers=None):
+        # Returns (blob, filename, mime_type, conversion). When the document
+        # must be converted by wkhtmltopdf or pandoc, blob is None and
+        # conversion is the (output_format, html, reference_doc) arguments
+        # for guidedmodules.conversion.submit.
+        if download_format not in self.output_document_download_formats:
             raise ValueError("Invalid download format.")
 
-        pandoc_format, file_extension, mime_type = format_opts[download_format]
+        pandoc_format, file_extension, mime_type = self.output_document_download_formats[download_format]
 
         # Lazy-render the output documents. Use data: URLs so all
         # assets are embedded.
@@ -1296,6 +1572,9 @@ class Task(models.Model):
             raise Exception()  # can't occur
         filename = document_id + "." + file_extension
 
+        blob = None
+        conversion = None
+
         if download_format == "markdown" and doc["format"] == "markdown":
             # When Markdown output is requested for a template that is
             # authored in markdown, we can render directly to markdown.
@@ -1327,24 +1606,7 @@ class Task(models.Model):
             # Render PDF as per PDF Generator settings
             if settings.GR_PDF_GENERATOR == 'wkhtmltopdf':
                 # Render to HTML and convert to PDF using wkhtmltopdf.
-                # Mark the encoding explicitly, to match the html.encode() argument below.
-                html = doc["html"]
-                html = '<meta charset="UTF-8" />' + html
-
-                import subprocess  # nosec
-                cmd = ["/usr/bin/xvfb-run", "--", "/usr/bin/wkhtmltopdf",
-                       "-q",  # else errors go to stdout
-                       "--disable-javascript",
-                       "--encoding", "UTF-8",
-                       "-s", "Letter",  # page size
-                       "-", "-"]
-                with subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE) as proc:
-                    stdout, stderr = proc.communicate(
-                        html.encode("utf8"),
-                        timeout=30)
-                    if proc.returncode != 0: raise subprocess.CalledProcessError(proc.returncode, ' '.join(cmd))
-
-                blob = stdout
+                conversion = ("pdf", doc["html"], None)
             else:
                 # GR_PDF_GENERATOR is set to None or other issue
                 # Generate text or markdown instead with error message
@@ -1360,37 +1622,13 @@ class Task(models.Model):
             # reference file in a Compliance App.
             template = self.project.assets.get_default(asset_type=AssetTypeEnum.SSP_EXPORT,
                                                        default_if_not_exist="assets/default-ssp-template.docx")
-            # odt and some other formats cannot pipe to stdout, so we always
-            # generate a temporary file.
-            import tempfile, os.path, subprocess  # nosec
-            with tempfile.TemporaryDirectory() as tempdir:
-                # convert from HTML to something else, writing to a temporary file
-                outfn = os.path.join(tempdir, filename)
-                if not isinstance(template, str):
-                    template_path = os.path.join(tempdir, template.name.split('/')[-1])
-                    with open(template_path, 'wb+') as f:
-                        f.write(template.file.read())
-                    template = template_path
-                # Append '# nosec' to line below to tell Bandit to ignore the low risk problem
-                # with not specifying the entire path to pandoc.
-
-                # NOTE: we need to make the pandoc cmd flexible, so non-ssp don't use the ssp yaml file.
-                # Right now, all generated docx files will include the ssp yaml.
-
-                with subprocess.Popen(  # nosec
-                        ["pandoc", "-f", "html", "-s", "--metadata-file=assets/ssp-cover.yaml", "--toc",
-                         "--toc-depth=2", "--reference-doc", template, "-t", pandoc_format, "-o", outfn],
-                        stdin=subprocess.PIPE
-                ) as proc:
-                    proc.communicate(
-                        doc["html"].encode("utf8"),
-                        timeout=30)
-                    if proc.returncode != 0: raise subprocess.CalledProcessError(0, '')
-
-                # return the content of the temporary file
-                with open(outfn, "rb") as f:
-                    blob = f.read()
-        return blob, filename, mime_type
+            if isinstance(template, str):
+                with open(template, 'rb') as f:
+                    reference_doc = f.read()
+            else:
+                reference_doc = template.file.read()
+            conversion = (pandoc_format, doc["html"], reference_doc)
+        return blob, filename, mime_type, conversion
 
     def render_snippet(self):
         snippet = self.module.spec.get("snippet")
@@ -1505,6 +1743,8 @@ class Task(models.Model):
 
             # Add the new task.
             ansh.answered_by_task.add(task)
+            ProjectAnswerChange.log(ansh)
+            TaskAncestor.update_for(self)
 
             # Mark that the Task has had an answer changed.
             self.on_answer_changed()
@@ -1752,6 +1992,59 @@ class Task(models.Model):
         return did_update_any_questions
 
 
+class CachedStateBatch:
+    # While Task.load_cached_state runs, Task._get_cached_state reads and
+    # writes the cached_state of each Task through the active batch, so that
+    # all instances of the same Task see the same state, and the changes are
+    # written to the database once, at the end, instead of Task by Task.
+    # Task.get_current_answer_records uses the answers pre-loaded here.
+    local = threading.local()
+
+    def __init__(self):
+        self.cached_states = { }
+        self.answer_records = { }
+        self.changed_tasks = { }
+        self.reads = { }
+
+    @staticmethod
+    def current():
+        return getattr(CachedStateBatch.local, "batch", None)
+
+    def __enter__(self):
+        if CachedStateBatch.current() is not None:
+            raise RuntimeError("Task.load_cached_state cannot be nested.")
+        CachedStateBatch.local.batch = self
+        return self
+
+    def __exit__(self, *exc_info):
+        CachedStateBatch.local.batch = None
+        if exc_info[0] is None:
+            self.save()
+
+    def get_cached_state(self, task):
+        if task.id not in self.cached_states:
+            if not isinstance(task.cached_state, dict):
+                task.cached_state = {}
+            self.cached_states[task.id] = task.cached_state
+        return self.cached_states[task.id]
+
+    def on_cached_state_changed(self, task, reads):
+        self.changed_tasks[task.id] = task
+        self.reads.setdefault(task.id, set()).update(reads.task_ids - {task.id})
+
+    def save(self):
+        tasks = list(self.changed_tasks.values())
+        for task in tasks:
+            task.cached_state = self.cached_states[task.id]
+        Task.objects.bulk_update(tasks, ["cached_state"])
+        CachedStateReads = Task.cached_state_reads.through
+        CachedStateReads.objects.bulk_create([
+            CachedStateReads(from_task_id=task_id, to_task_id=read_task_id)
+            for task_id, read_task_ids in self.reads.items()
+            for read_task_id in read_task_ids
+        ], ignore_conflicts=True)
+
+
 class TaskAnswer(models.Model):
     task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name="answers",
                              help_text="The Task that this TaskAnswer is a part of.")
@@ -1872,12 +2165,14 @@ class TaskAnswer(models.Model):
             return False
 
         # Store a new TaskAnswerHistory record with the cleared flag set.
-        TaskAnswerHistory.objects.create(
+        answer = TaskAnswerHistory.objects.create(
             taskanswer=self,
             answered_by=user,
             stored_value=None,
             answered_by_file=None,
             cleared=True)
+        ProjectAnswerChange.log(answer)
+        self.on_answered_by_tasks_changed()
 
         # Kick the TaskAnswer's updated fields and the Task to mark that the
         # answer has changed.
@@ -1885,6 +2180,11 @@ class TaskAnswer(models.Model):
         self.task.on_answer_changed()
         return True
 
+    def on_answered_by_tasks_changed(self):
+        # Only answers to module questions are Tasks.
+        if self.question.spec["type"] in ("module", "module-set"):
+            TaskAncestor.update_for(self.task)
+
     def save_answer(self,
                     value, answered_by_tasks, answered_by_file,
                     user, method,
@@ -1935,6 +2235,8 @@ class TaskAnswer(models.Model):
             unsure=unsure)
         for t in answered_by_tasks:
             answer.answered_by_task.add(t)
+        ProjectAnswerChange.log(answer)
+        self.on_answered_by_tasks_changed()
 
         # Kick the Task and TaskAnswer's updated field and let the Task know that
         # its answers have changed.
@@ -1979,6 +2281,18 @@ class TaskAnswer(models.Model):
             if event["date_posix"] > float(events_since)
         ]
 
+    # required to attach a Discussion to it
+    def get_discussion_last_event_date(self):
+        # The date of the latest event in get_history, so that polls for
+        # new events don't need to build the history.
+        from django.db.models import Max
+        dates = [self.answer_history.aggregate(created=Max("created"))["created"]]
+        if (self.extra or {}).get("invited-help-squad"):
+            from django.utils.dateparse import parse_datetime
+            dates.append(parse_datetime(self.extra["invited-help-squad"]))
+        dates = [d for d in dates if d is not None]
+        return max(dates) if dates else None
+
     # required to attach a Discussion to it
     def get_user_role(self, user):
         if user == self.task.editor:
@@ -1999,7 +2313,7 @@ class TaskAnswer(models.Model):
 
     # required to attach a Discussion to it
     def get_notification_watchers(self):
-        return list(mbr.user for mbr in ProjectMembership.objects.filter(project=self.task.project))
+        return list(mbr.user for mbr in ProjectMembership.objects.filter(project=self.task.project).select_related("user"))
 
     # required to attach a Discussion to it
     def get_discussion_autocompletes(self, discussion):
@@ -2040,17 +2354,20 @@ class TaskAnswer(models.Model):
         self.extra = self.extra or {}  # ensure initialized
         if not self.extra.get("invited-help-squad"):
             anyone_invited = False
+            watchers = set(self.get_notification_watchers())
             for user in self.task.project.organization.help_squad.all():
-                if user in self.get_notification_watchers(): continue  # no need to invite
-                inv = Invitation.objects.create(
+                if user in watchers: continue  # no need to invite
+                # The invitation is emailed in the background by the
+                # send_notification_emails command.
+                Invitation.objects.create(
                     from_user=comment.user,
                     from_project=self.task.project,
                     target=comment.discussion,
                     target_info={"what": "invite-guest"},
                     to_user=user,
                     text="The organization's help squad is being automatically invited to help with the following comment:\n\n" + comment.text,
+                    queued_at=timezone.now(),
                 )
-                inv.send()
                 anyone_invited = True
             if anyone_invited:
                 self.extra["invited-help-squad"] = timezone.now()
@@ -2115,7 +2432,9 @@ class TaskAnswerHistory(models.Model):
         if self.taskanswer.question.spec['type'] == "interstitial": return False
         return (self.get_value() is None)
 
-    def get_value(self):
+    def get_value(self, file_metadata=None):
+        # file_metadata is an optional FileAnswerMetadata that loads the
+        # metadata of file answers together with other file answers.
         if self.cleared:
             raise RuntimeError("get_value cannot be called on a cleared answer")
 
@@ -2153,106 +2472,13 @@ class TaskAnswerHistory(models.Model):
         # The "file" question type is answered by a blob that is uploaded
         # by the user. The stored_value field is not used. Instead the
         # answered_by_file field points to the blob. The returned data is
-        # a dict about the blob.
+        # a dict about the blob, a FileAnswerValue that loads its items
+        # when they are first read.
         elif q.spec["type"] == "file":
-            # Get the Django File object instance.
-            blob = self.answered_by_file
-            if not blob.name:
+            if not self.answered_by_file.name:
                 # Question was skipped.
                 return None
-
-            # Get the dbstorage.models.StoredFile instance which holds
-            # an auto-detected mime type.
-            from dbstorage.models import StoredFile
-            sf = StoredFile.objects.only("mime_type").get(path=blob.name)
-
-            # Create a display string explaining the file type.
-            if sf.mime_type == "text/plain":
-                file_type = "plain text"
-            elif sf.mime_type.startswith("image/"):
-                file_type = "image"
-            elif sf.mime_type == "text/html":
-                file_type = "HTML"
-            else:
-                import mimetypes
-                file_type = mimetypes.guess_extension(sf.mime_type, strict=False)[1:]
-
-            # Get the URL that can retreive the resource. It's behind
-            # auth so we don't use blob.url, which won't work because
-            # we haven't exposed that url route.
-            import urllib
-            url = self.taskanswer.task.get_absolute_url() \
-                  + "/question/" + urllib.parse.quote(self.taskanswer.question.key) \
-                  + "/history/" + str(self.id) \
-                  + "/media"
-
-            # Make it an absolute URL so that when we expose it through
-            # the API it makes sense.
-            from urllib.parse import urljoin
-            url = urljoin(settings.SITE_ROOT_URL, url)
-
-            # Convert it to a data URL so that it can be rendered in exported documents.
-            content_dataurl = None
-            if q.spec.get("file-type") == "image":
-                content_dataurl = image_to_dataurl(self.answered_by_file, 640)
-
-            # Construct a thumbnail and a URL to it.
-            thumbnail_url = None
-            thumbnail_dataurl = None
-            if not self.thumbnail:
-                # Try to construct a thumbnail.
-                if settings.GR_IMG_GENERATOR == 'wkhtmltopdf':
-                    if sf.mime_type == "text/html":
-                        # Use wkhtmltoimage.
-                        import subprocess  # nosec
-                        try:
-                            # Pipe to subprocess.
-                            # xvfb is required to run wkhtmltopdf in headless mode on Debian, see https://github.com/wkhtmltopdf/wkhtmltopdf/issues/2037#issuecomment-62019521.
-                            cmd = ["/usr/bin/xvfb-run", "--", "/usr/bin/wkhtmltoimage",
-                                   "-q",  # else errors go to stdout
-                                   "--disable-javascript",
-                                   "-f", "png",
-                                   # "--disable-smart-width", - generates a warning on stdout that qt is unpatched, which happens in headless mode
-                                   "--zoom", ".7",
-                                   "--width", "700",
-                                   "--height", str(int(700 * 9 / 16)),
-                                   "-", "-"]
-                            with subprocess.Popen(cmd,
-                                                  stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                                                  stderr=subprocess.DEVNULL,
-                                                  ) as proc:
-                                stdout, stderr = proc.communicate(
-                                    self.answered_by_file.read(),
-                                    timeout=10)
-                                if proc.returncode != 0: raise subprocess.CalledProcessError(proc.returncode,
-                                                                                             ' '.join(cmd))
-
-                            # Store PNG.
-                            from django.core.files.base import ContentFile
-                            value = ContentFile(stdout)
-                            value.name = "thumbnail.png"  # needs a name for the storage backend?
-                            self.thumbnail = value
-                            self.save(update_fields=["thumbnail"])
-                        except subprocess.CalledProcessError as e:
-                            print(e)
-                else:
-                    # No image generator set, cannot create thumbnail
-                    pass
-
-            if self.thumbnail:
-                # If we have a thumbnail, indicate so by returning a URL to it.
-                thumbnail_url = url + "?thumbnail=1"
-                thumbnail_dataurl = image_to_dataurl(self.thumbnail, 640)
-
-            return {
-                "url": url,
-                "content_dataurl": content_dataurl,
-                "size": blob.size,
-                "type": sf.mime_type,
-                "type_display": file_type,
-                "thumbnail_url": thumbnail_url,
-                "thumbnail_dataurl": thumbnail_dataurl,
-            }
+            return FileAnswerValue(self, file_metadata)
 
         # For all other question types, the value is stored in the stored_value
         # field.
@@ -2275,6 +2501,49 @@ class TaskAnswerHistory(models.Model):
             else:
                 raise Exception("Invalid value in stored_encoding field.")
 
+    def make_file_thumbnail(self, mime_type):
+        # Try to construct a thumbnail of a file answer, if it doesn't have
+        # one yet, and store it in the thumbnail field.
+        if self.thumbnail:
+            return
+        if settings.GR_IMG_GENERATOR == 'wkhtmltopdf':
+            if mime_type == "text/html":
+                # Use wkhtmltoimage.
+                import subprocess  # nosec
+                try:
+                    # Pipe to subprocess.
+                    # xvfb is required to run wkhtmltopdf in headless mode on Debian, see https://github.com/wkhtmltopdf/wkhtmltopdf/issues/2037#issuecomment-62019521.
+                    cmd = ["/usr/bin/xvfb-run", "--", "/usr/bin/wkhtmltoimage",
+                           "-q",  # else errors go to stdout
+                           "--disable-javascript",
+                           "-f", "png",
+                           # "--disable-smart-width", - generates a warning on stdout that qt is unpatched, which happens in headless mode
+                           "--zoom", ".7",
+                           "--width", "700",
+                           "--height", str(int(700 * 9 / 16)),
+                           "-", "-"]
+                    with subprocess.Popen(cmd,
+                                          stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                          stderr=subprocess.DEVNULL,
+                                          ) as proc:
+                        stdout, stderr = proc.communicate(
+                            self.answered_by_file.read(),
+                            timeout=10)
+                        if proc.returncode != 0: raise subprocess.CalledProcessError(proc.returncode,
+                                                                                     ' '.join(cmd))
+
+                    # Store PNG.
+                    from django.core.files.base import ContentFile
+                    value = ContentFile(stdout)
+                    value.name = "thumbnail.png"  # needs a name for the storage backend?
+                    self.thumbnail = value
+                    self.save(update_fields=["thumbnail"])
+                except subprocess.CalledProcessError as e:
+                    print(e)
+        else:
+            # No image generator set, cannot create thumbnail
+            pass
+
     def get_answer_display(self):
         if self.cleared:
             return "[marked unanswered]"
@@ -2476,6 +2745,340 @@ class TaskAnswerHistory(models.Model):
         return value, answered_by_tasks, answered_by_file, subtasks_updated
 
 
+class FileAnswerMetadata:
+    # Loads the metadata of the blobs of a group of file answers, such as all
+    # of the file answers of a Task, from their dbstorage.models.StoredFile
+    # instances in one query, when the metadata of any of them is first read.
+
+    def __init__(self):
+        self.pending_paths = set()
+        self.metadata = { }
+
+    def add(self, path):
+        if path not in self.metadata:
+            self.pending_paths.add(path)
+
+    def get(self, path):
+        # Return the auto-detected MIME type and the size of a blob.
+        self.add(path)
+        if self.pending_paths:
+            from dbstorage.models import StoredFile
+            for p, mime_type, size in StoredFile.objects \
+                    .filter(path__in=self.pending_paths) \
+                    .values_list("path", "mime_type", "size"):
+                self.metadata[p] = (mime_type, size)
+            self.pending_paths = set()
+        if path not in self.metadata:
+            from dbstorage.models import StoredFile
+            raise StoredFile.DoesNotExist(path)
+        return self.metadata[path]
+
+
+class FileAnswerValue(dict):
+    # The value of an answer to a "file" question: a dict of the "url",
+    # "size", "type" (the MIME type), and "type_display" of the blob,
+    # its "content_dataurl" if the question is for an image, and the
+    # "thumbnail_url" and "thumbnail_dataurl" of its thumbnail, if any.
+    #
+    # Nothing is loaded until an item is read. The metadata items are
+    # loaded together through a FileAnswerMetadata that is shared by the
+    # file answers of a Task, and the data URLs and the thumbnail are
+    # only generated when their items are read. All of the items are
+    # loaded when the dict is iterated over, e.g. to serialize it to JSON.
+    # Two values are compared by the answer and file they are of, and their
+    # repr and copies don't load anything.
+
+    _METADATA_KEYS = ("url", "size", "type", "type_display")
+    _CONTENT_KEYS = ("content_dataurl",)
+    _THUMBNAIL_KEYS = ("thumbnail_url", "thumbnail_dataurl")
+    _NOT_LOADED = object()
+
+    def __init__(self, answer, file_metadata=None):
+        super().__init__((key, self._NOT_LOADED)
+            for key in self._METADATA_KEYS + self._CONTENT_KEYS + self._THUMBNAIL_KEYS)
+        self._answer = answer
+        self._file_metadata = file_metadata or FileAnswerMetadata()
+        self._file_metadata.add(answer.answered_by_file.name)
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if value is self._NOT_LOADED:
+            self._load(key)
+            value = super().__getitem__(key)
+        return value
+
+    def _load(self, key):
+        answer = self._answer
+        if key in self._METADATA_KEYS:
+            mime_type, size = self._file_metadata.get(answer.answered_by_file.name)
+
+            # Create a display string explaining the file type.
+            if mime_type == "text/plain":
+                file_type = "plain text"
+            elif mime_type.startswith("image/"):
+                file_type = "image"
+            elif mime_type == "text/html":
+                file_type = "HTML"
+            else:
+                import mimetypes
+                file_type = mimetypes.guess_extension(mime_type, strict=False)[1:]
+
+            # Get the URL that can retreive the resource. It's behind
+            # auth so we don't use blob.url, which won't work because
+            # we haven't exposed that url route.
+            import urllib
+            url = answer.taskanswer.task.get_absolute_url() \
+                  + "/question/" + urllib.parse.quote(answer.taskanswer.question.key) \
+                  + "/history/" + str(answer.id) \
+                  + "/media"
+
+            # Make it an absolute URL so that when we expose it through
+            # the API it makes sense.
+            from urllib.parse import urljoin
+            url = urljoin(settings.SITE_ROOT_URL, url)
+
+            super().update({
+                "url": url,
+                "size": size,
+                "type": mime_type,
+                "type_display": file_type,
+            })
+
+        elif key in self._CONTENT_KEYS:
+            # Convert it to a data URL so that it can be rendered in exported documents.
+            content_dataurl = None
+            if answer.taskanswer.question.spec.get("file-type") == "image":
+                content_dataurl = cached_image_to_dataurl(answer.answered_by_file, 640)
+            super().__setitem__("content_dataurl", content_dataurl)
+
+        elif key in self._THUMBNAIL_KEYS:
+            # Construct a thumbnail, if possible, and a URL to it.
+            answer.make_file_thumbnail(self["type"])
+            thumbnail_url = None
+            thumbnail_dataurl = None
+            if answer.thumbnail:
+                # If we have a thumbnail, indicate so by returning a URL to it.
+                thumbnail_url = self["url"] + "?thumbnail=1"
+                thumbnail_dataurl = cached_image_to_dataurl(answer.thumbnail, 640)
+            super().update({
+                "thumbnail_url": thumbnail_url,
+                "thumbnail_dataurl": thumbnail_dataurl,
+            })
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def keys(self):
+        # Overriding keys and __iter__ makes dict(value) and {**value} read
+        # the items through __getitem__ rather than copying them directly.
+        return super().keys()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def values(self):
+        # A view that loads each item as it is read.
+        return ValuesView(self)
+
+    def copy(self):
+        # Copies share the items loaded so far.
+        value = FileAnswerValue(self._answer, self._file_metadata)
+        super(FileAnswerValue, value).update(super().items())
+        return value
+
+    def _identity(self):
+        # The items are derived from the answer and its stored file.
+        return (self._answer.id, self._answer.answered_by_file.name)
+
+    def __eq__(self, other):
+        if isinstance(other, FileAnswerValue):
+            return self._identity() == other._identity()
+        return dict(self.items()) == other
+
+    def __ne__(self, other):
+        return not (self == other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "<FileAnswerValue answer={} file={!r}>".format(*self._identity())
+
+    def __reduce__(self):
+        # Copies and pickles are plain dicts.
+        return (dict, (dict(self.items()),))
+
+
+class ProjectAnswerChange(models.Model):
+    # A log of the new answers (and cleared answers) in each Project, written
+    # by TaskAnswer.save_answer and TaskAnswer.clear_answer, so that what
+    # changed in a Project since a time is one range query on the index.
+    project = models.ForeignKey(Project, related_name="answer_changes", on_delete=models.CASCADE,
+                                help_text="The Project that the Task of the answer is in.")
+    task = models.ForeignKey(Task, related_name="+", on_delete=models.CASCADE,
+                             help_text="The Task that was answered.")
+    answer = models.ForeignKey(TaskAnswerHistory, related_name="+", on_delete=models.CASCADE,
+                               help_text="The new TaskAnswerHistory record.")
+    created = models.DateTimeField(help_text="The time the answer was saved, the same as its TaskAnswerHistory's created time.")
+
+    class Meta:
+        index_together = [
+            ('project', 'created'),
+        ]
+
+    @staticmethod
+    def log(answer):
+        task = answer.taskanswer.task
+        ProjectAnswerChange.objects.create(
+            project_id=task.project_id,
+            task=task,
+            answer=answer,
+            created=answer.created)
+
+    @staticmethod
+    def get_current_answers_since(project, since):
+        # Return the TaskAnswerHistory records of the current answers in
+        # the Project that were saved after since, a POSIX time, ordered by
+        # when they were saved. Answers that were since changed again are
+        # only returned once, and cleared answers are not returned.
+        from datetime import datetime, timedelta
+        since_date = datetime.fromtimestamp(since, timezone.utc) - timedelta(microseconds=1)
+        changes = ProjectAnswerChange.objects \
+            .filter(project=project, created__gt=since_date) \
+            .select_related('task', 'answer__answered_by', 'answer__taskanswer__question') \
+            .order_by('created', 'id')
+        current_answers = { }
+        for change in changes:
+            # Compare the times the same way they were compared before the log.
+            if change.created.timestamp() <= since: continue
+            change.answer.taskanswer.task = change.task
+            current_answers.pop(change.answer.taskanswer_id, None)
+            current_answers[change.answer.taskanswer_id] = change.answer
+        return [answer for answer in current_answers.values() if not answer.cleared]
+
+
+class TaskParent(models.Model):
+    # Each Task that is a current answer to a module or module-set question
+    # of another Task. TaskAnswer.save_answer and TaskAnswer.clear_answer
+    # keep this up to date through TaskAncestor.update_for.
+    task = models.ForeignKey(Task, related_name="+", on_delete=models.CASCADE,
+                             help_text="The Task that is a current answer.")
+    parent = models.ForeignKey(Task, related_name="+", on_delete=models.CASCADE,
+                               help_text="The Task that has a question that the Task is a current answer to.")
+
+    class Meta:
+        unique_together = [('task', 'parent')]
+
+    @staticmethod
+    def get_current(parent_tasks=None):
+        # Return (task id, parent task id) pairs read from the current answers
+        # of the given Tasks (or all Tasks) with one query.
+        from django.db.models import Max
+        current_answers = TaskAnswerHistory.objects
+        if parent_tasks is not None:
+            current_answers = current_answers.filter(taskanswer__task__in=parent_tasks)
+        current_answers = current_answers \
+            .values("taskanswer") \
+            .annotate(current_id=Max("id")) \
+            .values("current_id")
+        return set(
+            (task_id, parent_id)
+            for task_id, parent_id in TaskAnswerHistory.answered_by_task.through.objects
+                .filter(taskanswerhistory__in=current_answers)
+                .values_list("task_id", "taskanswerhistory__taskanswer__task_id")
+            if task_id != parent_id)
+
+
+class TaskAncestor(models.Model):
+    # The transitive closure of TaskParent: each Task and every Task that it
+    # is a current answer of, directly or through other Tasks. Access to a
+    # Task comes from access to its ancestors (see Task.get_access_level).
+    task = models.ForeignKey(Task, related_name="+", on_delete=models.CASCADE,
+                             help_text="The Task that is a current answer, directly or indirectly.")
+    ancestor = models.ForeignKey(Task, related_name="+", on_delete=models.CASCADE,
+                                 help_text="The Task that the Task is a current answer of.")
+
+    class Meta:
+        unique_together = [('task', 'ancestor')]
+        index_together = [('ancestor', 'task')]
+
+    @staticmethod
+    def compute(task_ids, parents, known_ancestors):
+        # Return a dict mapping each task id to the set of its ancestors'
+        # ids. parents maps each of the task ids to the ids of its parents,
+        # and known_ancestors maps each of their parents that is not one of
+        # the task ids to the ids of its ancestors. Answers can form cycles,
+        # so the sets are grown until they stop changing.
+        ancestors = { task_id: set() for task_id in task_ids }
+        changed = True
+        while changed:
+            changed = False
+            for task_id in task_ids:
+                new_ancestors = set()
+                for parent_id in parents.get(task_id, ()):
+                    new_ancestors.add(parent_id)
+                    new_ancestors |= ancestors[parent_id] if parent_id in ancestors \
+                        else known_ancestors.get(parent_id, set())
+                new_ancestors.discard(task_id)
+                if new_ancestors != ancestors[task_id]:
+                    ancestors[task_id] = new_ancestors
+                    changed = True
+        return ancestors
+
+    @staticmethod
+    def update_for(task):
+        # Update the TaskParent records of the Task's current answers and
+        # the TaskAncestor records of the Tasks under any that changed.
+        with transaction.atomic():
+            new_children = set(task_id for task_id, parent_id in TaskParent.get_current([task]))
+            old_children = set(TaskParent.objects.filter(parent=task).values_list("task_id", flat=True))
+            if new_children == old_children:
+                return
+            TaskParent.objects.filter(parent=task, task__in=old_children - new_children).delete()
+            TaskParent.objects.bulk_create([
+                TaskParent(task_id=task_id, parent=task)
+                for task_id in new_children - old_children
+            ])
+
+            # The ancestors of the Tasks that were added or removed and of
+            # the Tasks under them change. The ancestors of their other
+            # parents don't, so those are read as they are.
+            changed = old_children ^ new_children
+            task_ids = changed | set(TaskAncestor.objects.filter(ancestor__in=changed).values_list("task_id", flat=True))
+            parents = { }
+            for task_id, parent_id in TaskParent.objects.filter(task__in=task_ids).values_list("task_id", "parent_id"):
+                parents.setdefault(task_id, set()).add(parent_id)
+            known_ancestors = { }
+            for task_id, ancestor_id in TaskAncestor.objects \
+                    .filter(task__in=set().union(*parents.values()) - task_ids) \
+                    .values_list("task_id", "ancestor_id"):
+                known_ancestors.setdefault(task_id, set()).add(ancestor_id)
+            ancestors = TaskAncestor.compute(task_ids, parents, known_ancestors)
+
+            TaskAncestor.objects.filter(task__in=task_ids).delete()
+            TaskAncestor.objects.bulk_create([
+                TaskAncestor(task_id=task_id, ancestor_id=ancestor_id)
+                for task_id, ancestor_ids in ancestors.items()
+                for ancestor_id in ancestor_ids
+            ], batch_size=1000)
+
+    @staticmethod
+    def get_all_current():
+        # Return the TaskParent and TaskAncestor (task id, parent or ancestor
+        # id) pairs computed from scratch from the current answers.
+        edges = TaskParent.get_current()
+        parents = { }
+        for task_id, parent_id in edges:
+            parents.setdefault(task_id, set()).add(parent_id)
+        ancestors = TaskAncestor.compute(set(parents), parents, { })
+        return edges, set(
+            (task_id, ancestor_id)
+            for task_id, ancestor_ids in ancestors.items()
+            for ancestor_id in ancestor_ids)
+
+
 class InstrumentationEvent(models.Model):
     user = models.ForeignKey(User, blank=True, null=True, on_delete=models.SET_NULL)
 
@@ -2516,3 +3119,54 @@ def image_to_dataurl(f, size):
     buf = BytesIO()
     im.save(buf, "png")
     return "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+# Data URLs of thumbnails of image assets and file answers are kept in the
+# "derived-assets" Django cache, which by default is a directory shared by
+# all of the processes on the host, so that they survive restarts and
+# aren't regenerated by every worker for every download. Entries are keyed
+# by the image's content hash and the thumbnail size, so they never need to
+# be invalidated. The cache culls entries when it is full.
+
+DERIVED_ASSET_CACHE_VERSION = 1
+DERIVED_ASSET_CACHE_STATS = { "hits": 0, "misses": 0 }
+
+def get_derived_asset_cache():
+    from django.core.cache import caches
+    from django.core.cache.backends.base import InvalidCacheBackendError
+    try:
+        return caches["derived-assets"]
+    except InvalidCacheBackendError:
+        return None
+
+def get_image_content_hash(f):
+    # Hash the content of a Django File or a bytes string.
+    import hashlib
+    if isinstance(f, bytes):
+        return hashlib.sha256(f).hexdigest()
+    h = hashlib.sha256()
+    f.open("rb")
+    try:
+        for chunk in f.chunks():
+            h.update(chunk)
+    finally:
+        f.seek(0)
+    return h.hexdigest()
+
+def cached_image_to_dataurl(f, size, content_hash=None):
+    # Like image_to_dataurl, but the data URL is cached by the content hash
+    # of the image, which is computed from f if it isn't given.
+    cache = get_derived_asset_cache()
+    if cache is None:
+        return image_to_dataurl(f, size)
+    if content_hash is None:
+        content_hash = get_image_content_hash(f)
+    key = "image-dataurl:{}:{}:{}".format(DERIVED_ASSET_CACHE_VERSION, content_hash, size)
+    dataurl = cache.get(key)
+    if dataurl is not None:
+        DERIVED_ASSET_CACHE_STATS["hits"] += 1
+        return dataurl
+    DERIVED_ASSET_CACHE_STATS["misses"] += 1
+    dataurl = image_to_dataurl(f, size)
+    cache.set(key, dataurl, None)
+    return dataurl
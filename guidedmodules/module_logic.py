@@ -10,6 +10,86 @@ from controls.oscal import Catalogs, Catalog
 from siteapp.settings import GOVREADY_URL
 
 
+# While a Task's cached state is being computed, we record which other Tasks'
+# answers and cached state the computation reads, so that Task.clear_state
+# only has to invalidate the cached state of Tasks that actually depend on a
+# Task whose answers changed. Recorders are per-thread (per-greenlet under
+# gevent) and nest: a read is recorded by every computation in progress.
+import threading
+task_state_read_recorders = threading.local()
+
+class TaskStateReadRecorder:
+    def __init__(self):
+        # The IDs of all of the Tasks that were read.
+        self.task_ids = set()
+        # The IDs of the Tasks whose cached state or attributes were read,
+        # which may depend on any of their answers.
+        self.state_task_ids = set()
+        # (Task ID, ModuleQuestion ID) pairs of the answers that were read
+        # from Tasks that are not in state_task_ids, including the questions
+        # the read answers depend on.
+        self.answer_reads = set()
+        # (kind, ID) pairs of the data other than Task answers and cached
+        # state that was read, like the System's control implementations.
+        # See get_render_cache_other_data_version.
+        self.other_reads = set()
+    def __enter__(self):
+        if not hasattr(task_state_read_recorders, "stack"):
+            task_state_read_recorders.stack = []
+        task_state_read_recorders.stack.append(self)
+        return self
+    def __exit__(self, *exc_info):
+        task_state_read_recorders.stack.remove(self)
+
+def record_task_state_read(task):
+    # Record that the answers or cached state of task were read by
+    # the cached state computations that are in progress.
+    if task is None or task.id is None:
+        return
+    for recorder in getattr(task_state_read_recorders, "stack", []):
+        recorder.task_ids.add(task.id)
+        recorder.state_task_ids.add(task.id)
+
+def record_task_state_reads(task_ids):
+    # Record reads of the Tasks with the given IDs.
+    for recorder in getattr(task_state_read_recorders, "stack", []):
+        recorder.task_ids.update(task_ids)
+        recorder.state_task_ids.update(task_ids)
+
+def record_task_answer_read(task, question):
+    # Record that the answer to one question of task was read. Its value
+    # also depends on the answers to the questions it depends on, unless
+    # they have impute conditions that can see more than this Task's
+    # answers, in which case the whole Task is read.
+    if task is None or task.id is None:
+        return
+    stack = getattr(task_state_read_recorders, "stack", [])
+    if not stack:
+        return
+    question_ids = get_question_read_closure(task.module, question)
+    if question_ids is None:
+        record_task_state_read(task)
+        return
+    record_task_answer_reads((task.id, question_id) for question_id in question_ids)
+
+def record_task_answer_reads(answer_reads):
+    # Record reads of the answers with the given (Task ID, ModuleQuestion ID) pairs.
+    answer_reads = set(answer_reads)
+    for recorder in getattr(task_state_read_recorders, "stack", []):
+        recorder.task_ids.update(task_id for task_id, _ in answer_reads)
+        recorder.answer_reads |= answer_reads
+
+def record_other_data_read(kind, object_id):
+    # Record that the computations in progress read data that isn't
+    # stored in Task answers.
+    for recorder in getattr(task_state_read_recorders, "stack", []):
+        recorder.other_reads.add((kind, object_id))
+
+def record_other_data_reads(other_reads):
+    for recorder in getattr(task_state_read_recorders, "stack", []):
+        recorder.other_reads.update(other_reads)
+
+
 def get_jinja2_template_vars(template):
     from jinja2 import meta, TemplateSyntaxError
     env = SandboxedEnvironment()
@@ -100,7 +180,81 @@ def walk_module_questions(module, callback):
         walk_question(q, [])
 
 
-def evaluate_module_state(current_answers, parent_context=None):
+# The outcome of the impute conditions of each question, from the last time
+# evaluate_module_state ran on a Task, keyed by Task id. When a Task is
+# evaluated again, only questions downstream of an answer that changed since
+# then (or whose impute conditions look outside of the module) have their
+# impute conditions re-run. Bounded so that a long-running worker process
+# doesn't accumulate the state of every Task it has ever seen.
+from siteapp.utils.caches import LRUCache
+MODULE_STATE_CACHE_MAX_TASKS = 2500
+module_state_cache = LRUCache("module_state", MODULE_STATE_CACHE_MAX_TASKS)
+
+def clear_module_state_cache():
+    module_state_cache.clear()
+
+def get_module_state_signature(current_answers):
+    # Returns a dict from question keys to the id of the TaskAnswerHistory
+    # record holding the question's current answer (or None if the question
+    # is not answered), which identifies the answer values that the impute
+    # conditions saw. save_answer and clear_answer always create a new record,
+    # so any change to an answer changes the signature. Returns None if the
+    # answers can't be identified this way, e.g. answers that aren't in the
+    # database, in which case the module state is evaluated from scratch.
+    if current_answers.task is None or current_answers.task.id is None:
+        return None
+    current_answers.as_dict() # trigger lazy-loading
+    signature = { }
+    for q, is_answered, answerobj, value in current_answers.answertuples.values():
+        if answerobj is None:
+            if is_answered:
+                return None
+            signature[q.key] = None
+        elif answerobj.id is None:
+            return None
+        else:
+            signature[q.key] = answerobj.id
+    return signature
+
+def get_reusable_impute_results(current_answers, signature):
+    # Get the impute condition results from the last evaluation of this
+    # Task that are still valid: those of questions that are not in the
+    # downstream closure of a question whose answer changed or of a
+    # question whose impute conditions depend on state outside of the
+    # module's own answers.
+    if signature is None:
+        return { }
+    module = current_answers.module
+    cached = module_state_cache.get(current_answers.task.id)
+    if cached is None or cached["module"] != (module.id, module.updated):
+        return { }
+    changed = { key for key in set(signature) | set(cached["signature"])
+                if signature.get(key) != cached["signature"].get(key) }
+    dependents, volatile = get_question_dependents(module)
+    stale = set()
+    queue = list(changed | volatile)
+    while queue:
+        key = queue.pop()
+        if key in stale: continue
+        stale.add(key)
+        queue.extend(dependents.get(key, []))
+    return {
+        key: result
+        for key, result in cached["impute_results"].items()
+        if key not in stale
+    }
+
+def save_impute_results(current_answers, signature, impute_results):
+    if signature is None:
+        return
+    module = current_answers.module
+    module_state_cache.set(current_answers.task.id, {
+        "module": (module.id, module.updated),
+        "signature": signature,
+        "impute_results": impute_results,
+    })
+
+def evaluate_module_state(current_answers, parent_context=None, incremental=True):
     # Compute the next question to ask the user, given the user's
     # answers to questions so far, and all imputed answers up to
     # that point.
@@ -108,6 +262,10 @@ def evaluate_module_state(current_answers, parent_context=None):
     # To figure this out, we walk the dependency tree of questions
     # until we arrive at questions that have no unanswered dependencies.
     # Such questions can be put forth to the user.
+    #
+    # If incremental is True, the results of impute conditions from the
+    # last evaluation of the same Task are re-used for questions that
+    # are not downstream of an answer that has since changed.
 
     # Build a list of ModuleQuestion that the are not unanswerable
     # because they are imputed or unavailable to the user. These
@@ -131,6 +289,13 @@ def evaluate_module_state(current_answers, parent_context=None):
     # Build a list of questions whose answers were imputed.
     was_imputed = set()
 
+    # Get the impute condition results that can be re-used from the last
+    # time this Task was evaluated, and collect the results of this
+    # evaluation for next time.
+    signature = get_module_state_signature(current_answers) if incremental else None
+    reusable_impute_results = get_reusable_impute_results(current_answers, signature)
+    impute_results = { }
+
     # Create some reusable context for evaluating impute conditions --- really only
     # so that we can pass down project and organization values. Everything else is
     # cleared from the context's cache for each question because each question sees
@@ -166,11 +331,15 @@ def evaluate_module_state(current_answers, parent_context=None):
         # yet know. Therefore, we construct a TemplateContext that only includes
         # the answers to questions that we've computed so far.
 
-        impute_context = TemplateContext(
-            ModuleAnswers(current_answers.module, current_answers.task, state),
-            impute_context_parent.escapefunc, parent_context=impute_context_parent, root=True)
+        if q.key in reusable_impute_results:
+            v = reusable_impute_results[q.key]
+        else:
+            impute_context = TemplateContext(
+                ModuleAnswers(current_answers.module, current_answers.task, state),
+                impute_context_parent.escapefunc, parent_context=impute_context_parent, root=True)
+            v = run_impute_conditions(q.spec.get("impute", []), impute_context)
+        impute_results[q.key] = v
 
-        v = run_impute_conditions(q.spec.get("impute", []), impute_context)
         if v:
             # An impute condition matched. Unwrap to get the value.
             answerobj = None
@@ -233,9 +402,56 @@ def evaluate_module_state(current_answers, parent_context=None):
     ret.unanswered = unanswered
     ret.can_answer = can_answer
     ret.answerable = answerable
+
+    save_impute_results(current_answers, signature, impute_results)
+
+    # In differential test mode, check that an incremental evaluation
+    # gives exactly what a full evaluation gives.
+    if reusable_impute_results and settings.GR_MODULE_STATE_DIFFERENTIAL_CHECK:
+        expected = evaluate_module_state(current_answers, parent_context=parent_context, incremental=False)
+        differences = compare_module_states(ret, expected)
+        if differences:
+            raise AssertionError("Incremental module state evaluation of %s differs from a full evaluation: %s"
+                                 % (current_answers.task, "; ".join(differences)))
+
     return ret
 
 
+def compare_module_states(a, b):
+    # Compare two ModuleAnswers returned by evaluate_module_state and
+    # return a list of differences between them, for the differential
+    # test mode of incremental evaluation.
+    def comparable_value(value):
+        # ModuleAnswers instances are created fresh each time answers
+        # are loaded, so compare them by the Task they wrap.
+        if isinstance(value, ModuleAnswers):
+            return ("ModuleAnswers", value.module.id, value.task.id if value.task else None)
+        if isinstance(value, list):
+            return [comparable_value(v) for v in value]
+        return value
+    def comparable_tuple(t):
+        q, is_answered, answerobj, value = t
+        return (q.key, is_answered, answerobj.id if answerobj else None, comparable_value(value))
+    def keys(questions):
+        return [q.key for q in questions]
+
+    differences = []
+    if list(a.answertuples) != list(b.answertuples):
+        differences.append("question order %s != %s" % (list(a.answertuples), list(b.answertuples)))
+    for key in a.answertuples:
+        if key in b.answertuples and comparable_tuple(a.answertuples[key]) != comparable_tuple(b.answertuples[key]):
+            differences.append("%s: %r != %r" % (key, comparable_tuple(a.answertuples[key]), comparable_tuple(b.answertuples[key])))
+    if a.was_imputed != b.was_imputed:
+        differences.append("was_imputed %s != %s" % (sorted(a.was_imputed), sorted(b.was_imputed)))
+    if keys(a.unanswered) != keys(b.unanswered):
+        differences.append("unanswered %s != %s" % (keys(a.unanswered), keys(b.unanswered)))
+    if keys(a.can_answer) != keys(b.can_answer):
+        differences.append("can_answer %s != %s" % (keys(a.can_answer), keys(b.can_answer)))
+    if {q.key for q in a.answerable} != {q.key for q in b.answerable}:
+        differences.append("answerable %s != %s" % (sorted(keys(a.answerable)), sorted(keys(b.answerable))))
+    return differences
+
+
 def get_question_context(answers, question):
     # What is the context of questions around the given question so show
     # the user their progress through the questions?
@@ -423,6 +639,129 @@ def oscal_context(answers):
     }
 
 
+# Templates are prepared for execution once: Markdown templates are converted
+# to HTML, and templates are compiled by one shared Jinja2 environment. Both
+# steps depend only on the template text, so like compiled expressions the
+# results are keyed by the text and never go stale. Only template execution
+# happens on every render.
+MARKDOWN_TEMPLATE_CACHE_MAX_TEMPLATES = 2000
+JINJA2_TEMPLATE_CACHE_MAX_TEMPLATES = 2000
+markdown_template_cache = LRUCache("markdown_templates", MARKDOWN_TEMPLATE_CACHE_MAX_TEMPLATES)
+jinja2_template_compile_cache = LRUCache("jinja2_templates", JINJA2_TEMPLATE_CACHE_MAX_TEMPLATES)
+
+# Ensure autoescaping is turned on. Even though we handle it ourselves, we do
+# so using the __html__ method on RenderedAnswer, which relies on autoescaping
+# logic. This also lets the template writer disable autoescaping with "|safe".
+import jinja2
+jinja2_template_environment = Jinja2Environment(
+    autoescape=True,
+    undefined=jinja2.StrictUndefined) # see render_content - we define any undefined variables
+
+def convert_markdown_template_to_html(template_body, demote_headings=True):
+    return markdown_template_cache.get_or_set(
+        (template_body, demote_headings),
+        lambda : _convert_markdown_template_to_html(template_body, demote_headings))
+
+def _convert_markdown_template_to_html(template_body, demote_headings):
+    # We don't want CommonMark to mess up template tags, however. If
+    # there are symbols which have meaning both to Jinaj2 and CommonMark,
+    # then they may get ruined by CommonMark because they may be escaped.
+    # For instance:
+    #
+    #    {% hello "*my friend*" %}
+    #
+    # would become
+    #
+    #    {% hello "<em>my friend</em>" %}
+    #
+    # and
+    #
+    #    [my link]({{variable_holding_url}})
+    #
+    # would become a link whose target is
+    #
+    #    %7B%7Bvariable_holding_url%7D%7D
+    #
+    # And that's not good!
+    #
+    # Do a simple lexical pass over the template and replace template
+    # tags with special codes that CommonMark will ignore. Then we'll
+    # put back the strings after the CommonMark has been rendered into
+    # HTML, so that the template tags end up in their appropriate place.
+    #
+    # Since CommonMark will clean up Unicode in URLs, e.g. in link and
+    # image URLs, by %-encoding non-URL-safe characters, we have to
+    # also override CommonMark's URL escaping function at
+    # https://github.com/rtfd/CommonMark-py/blob/master/CommonMark/common.py#L71
+    # to not %-encode our special codes. Unfortunately urllib.parse.quote's
+    # "safe" argument does not handle non-ASCII characters.
+    from commonmark import inlines
+    def urlencode_special(uri):
+        import urllib.parse
+        return "".join(
+            urllib.parse.quote(c, safe="/@:+?=&()%#*,") # this is what CommonMark does
+            if c not in "\uE000\uE001" else c # but keep our special codes
+            for c in uri)
+    inlines.normalize_uri = urlencode_special
+
+    substitutions = []
+    import re
+    def replace(m):
+        # Record the substitution.
+        index = len(substitutions)
+        substitutions.append(m.group(0))
+        return "\uE000%d\uE001" % index # use Unicode private use area code points
+    template_body = re.sub(r"{%[\w\W]*?%}|{{.*?}}", replace, template_body)
+
+    # Use our CommonMark Tables parser & renderer.
+    from commonmark_extensions.tables import \
+        ParserWithTables as CommonMarkParser, \
+        RendererWithTables as CommonMarkHtmlRenderer
+
+    # Subclass the renderer to control the output a bit.
+    class q_renderer(CommonMarkHtmlRenderer):
+        def __init__(self):
+            # Our module templates are currently trusted, so we can keep
+            # safe mode off, and we're making use of that. Safe mode is
+            # off by default, but I'm making it explicit. If we ever
+            # have untrusted template content, we will need to turn
+            # safe mode on.
+            super().__init__(options={ "safe": False })
+
+        def heading(self, node, entering):
+            # Generate <h#> tags with one level down from
+            # what would be normal since they should not
+            # conflict with the page <h1>.
+            if entering and demote_headings:
+                node.level += 1
+            super().heading(node, entering)
+
+        def code_block(self, node, entering):
+            # Suppress info strings because with variable substitution
+            # untrusted content could land in the <code> class attribute
+            # without a language- prefix.
+            node.info = None
+            super().code_block(node, entering)
+
+        def make_table_node(self, node):
+            return "<table class='table'>"
+
+    template_body = q_renderer().render(CommonMarkParser().parse(template_body))
+    # Put the Jinja2 template tags back that we removed prior to running
+    # the CommonMark renderer.
+    def replace(m):
+        return substitutions[int(m.group(1))]
+    template_body = re.sub("\uE000(\d+)\uE001", replace, template_body)
+    return template_body
+
+def compile_jinja2_template(template_body):
+    # Return the compiled template and the names of the variables it uses
+    # from the cache, or compile it and save it to the cache.
+    def compile():
+        template = jinja2_template_environment.from_string(template_body)
+        return (template, get_jinja2_template_vars(template_body))
+    return jinja2_template_compile_cache.get_or_set(template_body, compile)
+
 def render_content(content, answers, output_format, source,
                    additional_context={}, demote_headings=True,
                    show_answer_metadata=False, use_data_urls=False,
@@ -456,99 +795,12 @@ def render_content(content, answers, output_format, source,
     if template_format == "markdown":
         if output_format == "html" or output_format == "PARSE_ONLY":
             # Convert the template first to HTML using CommonMark.
+            # See convert_markdown_template_to_html.
 
             if not isinstance(template_body, str): raise ValueError("Template %s has incorrect type: %s" % (source, type(template_body)))
 
-            # We don't want CommonMark to mess up template tags, however. If
-            # there are symbols which have meaning both to Jinaj2 and CommonMark,
-            # then they may get ruined by CommonMark because they may be escaped.
-            # For instance:
-            #
-            #    {% hello "*my friend*" %}
-            #
-            # would become
-            #
-            #    {% hello "<em>my friend</em>" %}
-            #
-            # and
-            #
-            #    [my link]({{variable_holding_url}})
-            #
-            # would become a link whose target is
-            #
-            #    %7B%7Bvariable_holding_url%7D%7D
-            #
-            # And that's not good!
-            #
-            # Do a simple lexical pass over the template and replace template
-            # tags with special codes that CommonMark will ignore. Then we'll
-            # put back the strings after the CommonMark has been rendered into
-            # HTML, so that the template tags end up in their appropriate place.
-            #
-            # Since CommonMark will clean up Unicode in URLs, e.g. in link and
-            # image URLs, by %-encoding non-URL-safe characters, we have to
-            # also override CommonMark's URL escaping function at
-            # https://github.com/rtfd/CommonMark-py/blob/master/CommonMark/common.py#L71
-            # to not %-encode our special codes. Unfortunately urllib.parse.quote's
-            # "safe" argument does not handle non-ASCII characters.
-            from commonmark import inlines
-            def urlencode_special(uri):
-                import urllib.parse
-                return "".join(
-                    urllib.parse.quote(c, safe="/@:+?=&()%#*,") # this is what CommonMark does
-                    if c not in "\uE000\uE001" else c # but keep our special codes
-                    for c in uri)
-            inlines.normalize_uri = urlencode_special
-
-            substitutions = []
-            import re
-            def replace(m):
-                # Record the substitution.
-                index = len(substitutions)
-                substitutions.append(m.group(0))
-                return "\uE000%d\uE001" % index # use Unicode private use area code points
-            template_body = re.sub(r"{%[\w\W]*?%}|{{.*?}}", replace, template_body)
-
-            # Use our CommonMark Tables parser & renderer.
-            from commonmark_extensions.tables import \
-                ParserWithTables as CommonMarkParser, \
-                RendererWithTables as CommonMarkHtmlRenderer
-
-            # Subclass the renderer to control the output a bit.
-            class q_renderer(CommonMarkHtmlRenderer):
-                def __init__(self):
-                    # Our module templates are currently trusted, so we can keep
-                    # safe mode off, and we're making use of that. Safe mode is
-                    # off by default, but I'm making it explicit. If we ever
-                    # have untrusted template content, we will need to turn
-                    # safe mode on.
-                    super().__init__(options={ "safe": False })
-
-                def heading(self, node, entering):
-                    # Generate <h#> tags with one level down from
-                    # what would be normal since they should not
-                    # conflict with the page <h1>.
-                    if entering and demote_headings:
-                        node.level += 1
-                    super().heading(node, entering)
-
-                def code_block(self, node, entering):
-                    # Suppress info strings because with variable substitution
-                    # untrusted content could land in the <code> class attribute
-                    # without a language- prefix.
-                    node.info = None
-                    super().code_block(node, entering)
-
-                def make_table_node(self, node):
-                    return "<table class='table'>"
-
             template_format = "html"
-            template_body = q_renderer().render(CommonMarkParser().parse(template_body))
-            # Put the Jinja2 template tags back that we removed prior to running
-            # the CommonMark renderer.
-            def replace(m):
-                return substitutions[int(m.group(1))]
-            template_body = re.sub("\uE000(\d+)\uE001", replace, template_body)
+            template_body = convert_markdown_template_to_html(template_body, demote_headings)
 
         elif output_format in ("text", "markdown"):
             # Pass through the markdown markup unchanged.
@@ -825,15 +1077,9 @@ def render_content(content, answers, output_format, source,
 
         # Execute the template.
 
-        # Evaluate the template. Ensure autoescaping is turned on. Even though
-        # we handle it ourselves, we do so using the __html__ method on
-        # RenderedAnswer, which relies on autoescaping logic. This also lets
-        # the template writer disable autoescaping with "|safe".
-        env = Jinja2Environment(
-            autoescape=True,
-            undefined=jinja2.StrictUndefined) # see below - we defined any undefined variables
+        # Get the compiled template. See jinja2_template_environment.
         try:
-            template = env.from_string(template_body)
+            template, template_vars = compile_jinja2_template(template_body)
         except jinja2.TemplateSyntaxError as e:
             raise ValueError("There was an error loading the Jinja2 template %s: %s, line %d" % (source, str(e), e.lineno))
 
@@ -851,8 +1097,11 @@ def render_content(content, answers, output_format, source,
 
         # Render.
         try:
-            # context.update will immediately load all top-level values, which
-            # unfortuntately might throw an error if something goes wrong
+            # Loading the top-level values will immediately load them, which
+            # unfortuntately might throw an error if something goes wrong.
+            # Only load the values the template uses, since some (like
+            # control_catalog and system) are expensive, and each value that
+            # is read is recorded as something the output depends on.
             if answers:
                 tc = TemplateContext(answers, escapefunc,
                     root=True,
@@ -860,7 +1109,10 @@ def render_content(content, answers, output_format, source,
                     source=source,
                     show_answer_metadata=show_answer_metadata,
                     is_computing_title=is_computing_title)
-                context.update(tc)
+                tc_keys = set(tc)
+                for varname in template_vars:
+                    if varname in tc_keys:
+                        context[varname] = tc[varname]
 
             # Define undefined variables. Jinja2 will normally raise an exception
             # when an undefined variable is accessed. It can also be set to not
@@ -870,7 +1122,7 @@ def render_content(content, answers, output_format, source,
             # template, and rendering the variable might mean no one will notice
             # the template is incorrect. But it's probably better UX than having
             # a big error message for the output as a whole or silently ignoring it.
-            for varname in get_jinja2_template_vars(template_body):
+            for varname in template_vars:
                 context.setdefault(varname, UndefinedReference(varname, errorfunc, [source]))
             # Now really render.
 
@@ -1139,27 +1391,78 @@ class HtmlAnswerRenderer:
         )
 
 
-def clear_module_question_cache():
-    if hasattr(get_all_question_dependencies, 'cache'):
-        del get_all_question_dependencies.cache
-
-
-def get_all_question_dependencies(module):
-    # Initialize cache, query cache.
-    if not hasattr(get_all_question_dependencies, 'cache'):
-        get_all_question_dependencies.cache = { }
-    if module.id in get_all_question_dependencies.cache:
-        return get_all_question_dependencies.cache[module.id]
-
-    # Pre-load all of the questions by their key so that the dependency
-    # evaluation is fast.
+# Bounded in-process caches of the question dependency graph of Modules,
+# keyed by the Module's id and updated timestamp. The timestamp changes
+# whenever a Module is (re)loaded from its app or its questions are edited
+# in the authoring tool, so entries for old versions of a Module are never
+# used and simply age out of the cache.
+MODULE_QUESTION_CACHE_MAX_MODULES = 500
+question_dependencies_cache = LRUCache("question_dependencies", MODULE_QUESTION_CACHE_MAX_MODULES)
+question_dependents_cache = LRUCache("question_dependents", MODULE_QUESTION_CACHE_MAX_MODULES)
+
+def get_module_cache_key(module):
+    return (module.id, module.updated)
+
+def clear_module_question_cache(module=None):
+    # If module is given, its ModuleQuestions were changed in place,
+    # so also discard its stored dependency graph and bump its updated
+    # timestamp so that other processes stop using their cached copies.
+    if module is not None:
+        from django.utils import timezone
+        from .models import Module
+        module.question_dependencies = None
+        module.updated = timezone.now()
+        Module.objects.filter(id=module.id).update(
+            question_dependencies=module.question_dependencies,
+            updated=module.updated)
+    question_dependencies_cache.clear()
+    question_dependents_cache.clear()
+    clear_module_state_cache()
+
+def compute_question_dependency_graph(module, all_questions=None):
+    # Returns the data stored in Module.question_dependencies: a dict
+    # mapping each question key to the keys of the questions it directly
+    # depends on and to the variable names its impute rules mention.
+    # Computing it requires parsing every question's prompt and impute
+    # templates, which is why it is stored when the Module is loaded.
+    from collections import OrderedDict
+    if all_questions is None:
+        all_questions = { q.key: q for q in module.questions.all() }
+    return OrderedDict(
+        (q.key, {
+            "dependencies": sorted(qq.key for qq in get_question_dependencies(q, get_from_question_id=all_questions)),
+            "impute-vars": sorted(get_question_impute_vars(q)),
+        })
+        for q in sorted(all_questions.values(), key=lambda q: q.definition_order)
+    )
+
+def get_question_dependency_data(module):
+    # Loads the dependency graph of a Module's questions from the in-process
+    # cache, else from the graph stored with the Module, else by computing
+    # (and storing) it.
+    key = get_module_cache_key(module)
+    data = question_dependencies_cache.get(key)
+    if data is not None:
+        return data
+
+    # Pre-load all of the questions by their key.
     all_questions = { }
     for q in module.questions.all():
         all_questions[q.key] = q
 
-    # Compute all of the dependencies of all of the questions.
+    # Use the stored graph if it matches the questions. Modules loaded
+    # before the graph was stored don't have one yet.
+    graph = module.question_dependencies
+    if not graph or set(graph) != set(all_questions):
+        graph = compute_question_dependency_graph(module, all_questions)
+        if module.id is not None:
+            from .models import Module
+            Module.objects.filter(id=module.id, updated=module.updated)\
+                .update(question_dependencies=graph)
+        module.question_dependencies = graph
+
     dependencies = {
-        q: get_question_dependencies(q, get_from_question_id=all_questions)
+        q: { all_questions[key] for key in graph[q.key]["dependencies"] if key in all_questions }
         for q in all_questions.values()
     }
 
@@ -1169,12 +1472,83 @@ def get_all_question_dependencies(module):
         is_dependency_of_something |= deps
     root_questions = { q for q in dependencies if q not in is_dependency_of_something }
 
-    ret = (dependencies, root_questions)
+    data = {
+        "dependencies": dependencies,
+        "root_questions": root_questions,
+        "impute_vars": { key: set(node["impute-vars"]) for key, node in graph.items() },
+    }
+    question_dependencies_cache.set(key, data)
+    return data
+
+def get_all_question_dependencies(module):
+    data = get_question_dependency_data(module)
+    return (data["dependencies"], data["root_questions"])
+
+def get_question_dependents(module):
+    # Returns a tuple of:
+    # 1) A dict mapping each question key to the keys of the questions that
+    #    directly depend on it, i.e. the reverse of the dependency graph.
+    # 2) A set of the keys of the questions whose impute conditions can
+    #    see more than the answers to the questions they depend on ---
+    #    because they mention variables that are not questions of this
+    #    module (e.g. project or organization) or because they mention
+    #    module-type questions, whose sub-task answers can change without
+    #    the answer to the question itself changing. The impute results of
+    #    these questions (and those downstream of them) cannot be re-used.
+    key = get_module_cache_key(module)
+    ret = question_dependents_cache.get(key)
+    if ret is not None:
+        return ret
+
+    data = get_question_dependency_data(module)
+    dependencies = data["dependencies"]
+    question_types = { q.key: q.spec.get("type") for q in dependencies }
+
+    dependents = { }
+    for q, deps in dependencies.items():
+        for qq in deps:
+            dependents.setdefault(qq.key, set()).add(q.key)
+
+    volatile = set()
+    for q in dependencies:
+        for varname in data["impute_vars"].get(q.key, ()):
+            if question_types.get(varname) in (None, "module", "module-set"):
+                volatile.add(q.key)
+
+    ret = (dependents, volatile)
+    question_dependents_cache.set(key, ret)
+    return ret
 
-    # Save to in-memory (in-process) cache. Never in debugging.
-    if not settings.DEBUG:
-        get_all_question_dependencies.cache[module.id] = ret
+def get_question_read_closure(module, question):
+    # Returns the IDs of a question and of the questions it depends on,
+    # directly or indirectly, whose answers together determine its value,
+    # or None if an impute condition of one of them can see more than
+    # the answers to those questions.
+    dependencies, _ = get_all_question_dependencies(module)
+    _, volatile = get_question_dependents(module)
+    ret = set()
+    stack = [question]
+    while stack:
+        q = stack.pop()
+        if q.id in ret:
+            continue
+        if q.key in volatile:
+            return None
+        ret.add(q.id)
+        stack.extend(dependencies.get(q, ()))
+    return ret
 
+def get_question_impute_vars(question):
+    # Returns the set of variable names mentioned in the impute
+    # conditions and values of a question.
+    ret = set()
+    for rule in question.spec.get("impute", []):
+        if "condition" in rule:
+            ret |= get_jinja2_template_vars(r"{% if (" + rule["condition"] + r") %}...{% endif %}")
+        if rule.get("value-mode") == "expression":
+            ret |= get_jinja2_template_vars(r"{% if (" + rule["value"] + r") %}...{% endif %}")
+        if rule.get("value-mode") == "template":
+            ret |= get_jinja2_template_vars(rule["value"])
     return ret
 
 def get_question_dependencies(question, get_from_question_id=None):
@@ -1227,23 +1601,19 @@ def get_question_dependencies_with_type(question, get_from_question_id=None):
          if qid in get_from_question_id
        ]
 
-jinja2_expression_compile_cache = { }
+# Compiled expressions are keyed by the expression text itself, so they
+# never go stale. Bounded because authoring-tool edits and app upgrades
+# keep adding new expressions over the life of a process.
+JINJA2_EXPRESSION_CACHE_MAX_EXPRESSIONS = 5000
+jinja2_expression_compile_cache = LRUCache("jinja2_expressions", JINJA2_EXPRESSION_CACHE_MAX_EXPRESSIONS)
 
 def compile_jinja2_expression(expr):
-    # If the expression has already been compiled and is in the cache,
-    # return the compiled expression.
-    if expr in jinja2_expression_compile_cache:
-        return jinja2_expression_compile_cache[expr]
-
-    # The expression is not in the cache. Compile it.
-    env = Jinja2Environment()
-    compiled = env.compile_expression(expr)
-
-    # Save it to the cache.
-    jinja2_expression_compile_cache[expr] = compiled
-
-    # Return it.
-    return compiled
+    # Return the compiled expression from the cache, or compile it
+    # and save it to the cache.
+    def compile():
+        env = Jinja2Environment()
+        return env.compile_expression(expr)
+    return jinja2_expression_compile_cache.get_or_set(expr, compile)
 
 def run_impute_conditions(conditions, context):
     # Check if any of the impute conditions are met based on
@@ -1427,7 +1797,9 @@ class ModuleAnswers(object):
                         )
                         def do_render():
                             try:
-                                return render_content(self.document, self.module_answers, entry, doc_name, show_answer_metadata=True, use_data_urls=self.use_data_urls)
+                                return get_or_render_document(self.document, self.module_answers, entry,
+                                    lambda : render_content(self.document, self.module_answers, entry, doc_name, show_answer_metadata=True, use_data_urls=self.use_data_urls),
+                                    use_data_urls=self.use_data_urls)
                             except Exception as e:
                                 # Put errors into the output. Errors should not occur if the
                                 # template is designed correctly.
@@ -1454,6 +1826,148 @@ class ModuleAnswers(object):
         return [ LazyRenderedDocument(self, d, i, use_data_urls) for i, d in enumerate(self.module.spec.get("output", [])) ]
 
 
+# Rendered output documents are also kept in a content-addressed render cache
+# (the "renders" Django cache) so that they survive Task.clear_state. Entries
+# are keyed by a hash of the document template and the Module version, plus
+# a fingerprint of what the render read: the current answers to the questions
+# it read (and the questions they depend on), all of the current answers of
+# the Tasks whose cached state or attributes it read, and a version stamp of
+# the other data it read, like the System's controls. What the last render of
+# a document read is kept with it so that the fingerprint can be computed
+# before rendering.
+
+RENDER_CACHE_VERSION = 2
+RENDER_CACHE_STATS = { "hits": 0, "misses": 0 }
+
+def get_render_cache():
+    from django.core.cache import caches
+    from django.core.cache.backends.base import InvalidCacheBackendError
+    try:
+        return caches["renders"]
+    except InvalidCacheBackendError:
+        return None
+
+def get_render_cache_document_key(document, module_answers, output_format, use_data_urls):
+    import hashlib, json
+    module = module_answers.module
+    return hashlib.sha256(json.dumps([
+        RENDER_CACHE_VERSION,
+        module.id,
+        module.updated,
+        document,
+        output_format,
+        use_data_urls,
+    ], sort_keys=True, default=str).encode("utf8")).hexdigest()
+
+def get_render_cache_fingerprint(reads):
+    # Hash the current answer records of the answers that were read and
+    # of every question of the Tasks whose state was read, the Task fields
+    # that templates can see, and the versions of the other data read.
+    import hashlib, json
+    from django.db.models import Max, Q
+    from .models import Task, TaskAnswer
+    answer_reads = set(reads["answers"])
+    answer_task_ids = { task_id for task_id, _ in answer_reads }
+    tasks = sorted(Task.objects.filter(id__in=set(reads["tasks"]) | answer_task_ids)
+        .values_list("id", "module_id", "title_override", "deleted_at"))
+    answers = sorted(answer
+        for answer in TaskAnswer.objects
+            .filter(Q(task__in=reads["tasks"])
+                | Q(task__in=answer_task_ids, question__in={ question_id for _, question_id in answer_reads }))
+            .values("task_id", "question_id")
+            .annotate(latest_id=Max("answer_history__id"))
+            .values_list("task_id", "question_id", "latest_id")
+        if answer[0] in reads["tasks"] or answer[:2] in answer_reads)
+    other = [
+        (kind, object_id, get_render_cache_other_data_version(kind, object_id))
+        for kind, object_id in sorted(reads["other"])
+    ]
+    return hashlib.sha256(json.dumps([tasks, answers, other], default=str).encode("utf8")).hexdigest()
+
+def get_render_cache_other_data_version(kind, object_id):
+    # Return a cheap version stamp of data other than Task answers that
+    # templates can read, which changes when the data changes.
+    from django.db.models import Count, Max
+    if kind == "organization":
+        # The organization's name.
+        from siteapp.models import Organization
+        return list(Organization.objects.filter(id=object_id).values_list("name", flat=True))
+    if kind == "project-system":
+        # The project's system, its control implementation statements and
+        # controls, the control catalogs, and its organization's control
+        # parameter values.
+        from siteapp.models import OrganizationalSetting, Project
+        from controls.models import Element, ElementControl, Statement
+        from controls.oscal import CatalogData
+        project = Project.objects.filter(id=object_id).values("system_id", "system__root_element_id", "organization_id").first()
+        if project is None or project["system_id"] is None:
+            return None
+        root_element_id = project["system__root_element_id"]
+        return [
+            project["system_id"],
+            list(Element.objects.filter(id=root_element_id).values_list("updated", flat=True)),
+            Statement.objects.filter(consumer_element=root_element_id)
+                .aggregate(count=Count("id"), updated=Max("updated"), producer_updated=Max("producer_element__updated")),
+            ElementControl.objects.filter(element=root_element_id)
+                .aggregate(count=Count("id"), updated=Max("updated")),
+            CatalogData.objects.aggregate(count=Count("id"), updated=Max("updated")),
+            sorted(OrganizationalSetting.objects.filter(organization=project["organization_id"])
+                .values_list("catalog_key", "parameter_key", "value")),
+        ]
+    raise ValueError(kind)
+
+def get_task_state_read_closure(task_ids):
+    # Add the Tasks that the cached state of the Tasks was computed from,
+    # since reading a Task's cached state doesn't record what it was computed from.
+    from .models import Task
+    through = Task.cached_state_reads.through
+    task_ids = set(task_ids)
+    new_task_ids = set(task_ids)
+    while new_task_ids:
+        new_task_ids = set(through.objects.filter(from_task__in=new_task_ids)
+            .values_list("to_task_id", flat=True)) - task_ids
+        task_ids |= new_task_ids
+    return task_ids
+
+def get_or_render_document(document, module_answers, output_format, render_func, use_data_urls=False):
+    cache = get_render_cache()
+    task = module_answers.task
+    if cache is None or task is None or task.id is None:
+        return render_func()
+
+    document_key = get_render_cache_document_key(document, module_answers, output_format, use_data_urls)
+    reads_key = "render-reads:{}:{}".format(task.id, document_key)
+
+    # If we know what the document read when it was last rendered, look
+    # for a render from the same answers and other data.
+    reads = cache.get(reads_key)
+    if reads is not None:
+        content_key = "render:{}:{}".format(document_key, get_render_cache_fingerprint(reads))
+        content = cache.get(content_key)
+        if content is not None:
+            RENDER_CACHE_STATS["hits"] += 1
+            # Whatever is caching this render depends on the same reads.
+            record_task_state_reads(reads["tasks"])
+            record_task_answer_reads(reads["answers"])
+            record_other_data_reads(reads["other"])
+            record_task_state_reads([task.id])
+            return content
+
+    # Render and remember what was read.
+    RENDER_CACHE_STATS["misses"] += 1
+    with TaskStateReadRecorder() as recorder:
+        content = render_func()
+    reads = {
+        "tasks": get_task_state_read_closure(recorder.state_task_ids),
+        "answers": recorder.answer_reads,
+        "other": recorder.other_reads,
+    }
+    content_key = "render:{}:{}".format(document_key, get_render_cache_fingerprint(reads))
+    cache.set(reads_key, reads, None)
+    cache.set(content_key, content, None)
+    return content
+
+
 class UndefinedReference:
     def __init__(self, varname, errorfunc, path=[]):
         self.varname = varname
@@ -1520,11 +2034,18 @@ class TemplateContext(Mapping):
             # The question might or might not be answered. If not, its value is None.
             self.module_answers.as_dict() # trigger lazy-loading
             _, is_answered, answerobj, answervalue = self.module_answers.answertuples.get(item, (None, None, None, None))
+            record_task_answer_read(self.module_answers.task, question)
             return RenderedAnswer(self.module_answers.task, question, is_answered, answerobj, answervalue, self)
 
         # The context also provides the project and organization that the Task belongs to,
         # and other task attributes, assuming the keys are not overridden by question IDs.
         if self.module_answers and self.module_answers.task:
+            # The project, organization and other data don't come from this
+            # context's Task. Anything else comes from its answers or attributes.
+            if item in ("control_catalog", "system", "oscal"):
+                record_other_data_read("project-system", self.module_answers.task.project_id)
+            elif item not in ("task_link", "project", "organization"):
+                record_task_state_read(self.module_answers.task)
             if item == "title" and (not self.is_computing_title or not self.root):
                 return self.module_answers.task.title
             if item == "task_link":
@@ -1694,6 +2215,8 @@ class RenderedProject(TemplateContext):
         return "<TemplateContext for %s - %s>" % (self.project, self.module_answers)
 
     def as_raw_value(self):
+        # The project's title comes from its root Task.
+        record_task_state_read(self.project.root_task)
         if self.is_computing_title:
             # When we're computing the title for "instance-name", prevent
             # infinite recursion.
@@ -1722,6 +2245,7 @@ class RenderedOrganization(TemplateContext):
         return "<TemplateContext for %s - %s>" % (self.organization, self.module_answers)
 
     def as_raw_value(self):
+        record_other_data_read("organization", self.organization.id)
         return self.organization.name
     def __html__(self):
         return self.escapefunc(None, None, None, None, self.as_raw_value())
@@ -1,7 +1,7 @@
 from django.contrib.auth.models import Permission
 from django.core.files import File
 from django.db.models import Q
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 from controls.models import Element, System
 from siteapp.enums.assets import AssetTypeEnum
@@ -52,6 +52,12 @@ class TestCaseWithFixtureData(TestCase):
     def getModule(self, module_name):
         return self.fixture_app.modules.get(module_name=module_name)
 
+    def save_answer(self, task, question_key, value):
+        from .models import TaskAnswer
+        taskans, _ = TaskAnswer.objects.get_or_create(task=task, question=task.module.questions.get(key=question_key))
+        taskans.save_answer(value, [], None, self.user, "web")
+        return taskans
+
 class ImputeConditionTests(TestCaseWithFixtureData):
     # Tests that expressions have the expected value in impute conditions
     # and that they have the *same* truthy-ness when used in {% if ... %}
@@ -248,6 +254,806 @@ class ImputeConditionTests(TestCaseWithFixtureData):
         self.assertEqual(answers.get("im_templ_1"), '1')
         self.assertEqual(answers.get("im_templ_2"), '2')
 
+class IncrementalModuleStateTests(TestCaseWithFixtureData):
+    # Tests that re-evaluating a Task's module state after an answer changes
+    # re-runs only the impute conditions downstream of the change and gives
+    # the same result as a full evaluation.
+
+    def setUp(self):
+        super().setUp()
+        clear_module_state_cache()
+        self.module = self.getModule("impute_chain")
+        self.task = Task.objects.create(module=self.module, project=self.project, editor=self.user)
+
+    def evaluate(self):
+        # Count the impute conditions that are actually run.
+        import guidedmodules.module_logic
+        with patch.object(guidedmodules.module_logic, "run_impute_conditions", wraps=run_impute_conditions) as run:
+            answers = self.task.get_answers().with_extended_info()
+        return answers, run.call_count
+
+    def test_incremental_evaluation(self):
+        answers, num_runs = self.evaluate()
+        self.assertEqual([q.key for q in answers.can_answer], ["_introduction", "q_start", "q_independent"])
+        self.assertEqual(num_runs, 3) # the other questions are blocked on unanswered questions
+
+        # Nothing changed, so no impute conditions are re-run except the one
+        # that looks at the organization, which is still blocked.
+        answers, num_runs = self.evaluate()
+        self.assertEqual(num_runs, 0)
+
+        # Answering q_start re-runs the impute conditions of it and the
+        # questions downstream of it.
+        self.save_answer(self.task, "q_start", "skip")
+        answers, num_runs = self.evaluate()
+        self.assertEqual(answers.as_dict()["q_follows_start"], "no")
+        self.assertEqual(answers.as_dict()["q_follows_follows_start"], "skip and then no")
+        self.assertEqual(num_runs, 3)
+
+        # Answering an unrelated question doesn't re-run the chain downstream
+        # of q_start, but does run the question that looks at the organization.
+        self.save_answer(self.task, "q_independent", "yes")
+        answers, num_runs = self.evaluate()
+        self.assertEqual(answers.as_dict()["q_organization"], "My Supreme Organization")
+        self.assertEqual(answers.as_dict()["q_follows_follows_start"], "skip and then no")
+        self.assertEqual(num_runs, 2)
+
+        # Changing q_start again updates the imputed values downstream of it.
+        self.save_answer(self.task, "q_start", "go")
+        answers, num_runs = self.evaluate()
+        self.assertNotIn("q_follows_follows_start", answers.as_dict())
+        self.assertEqual([q.key for q in answers.can_answer], ["_introduction", "q_follows_start"])
+        self.assertEqual(num_runs, 3)
+
+    @override_settings(GR_MODULE_STATE_DIFFERENTIAL_CHECK=True)
+    def test_incremental_evaluation_matches_full_evaluation(self):
+        # Differential test mode raises an error if an incremental
+        # evaluation differs from a full evaluation.
+        self.evaluate()
+        for question_key, value in [("q_start", "skip"), ("q_independent", "yes"), ("q_start", "go"),
+                                    ("q_follows_start", "yes"), ("q_start", "skip"), ("q_independent", None)]:
+            self.save_answer(self.task, question_key, value)
+            self.evaluate()
+            self.evaluate()
+
+    def test_differential_check_detects_mismatch(self):
+        self.save_answer(self.task, "q_start", "go")
+        self.evaluate()
+
+        # Corrupt the cached impute results and check that differential
+        # test mode notices.
+        module_state_cache[self.task.id]["impute_results"]["q_follows_start"] = ("yes",)
+        with self.settings(GR_MODULE_STATE_DIFFERENTIAL_CHECK=True):
+            with self.assertRaises(AssertionError):
+                self.evaluate()
+
+class QuestionDependencyCacheTests(TestCaseWithFixtureData):
+    # Tests that the question dependency graph is stored with the Module
+    # when the app is loaded and that cached copies are keyed by version.
+
+    def setUp(self):
+        super().setUp()
+        clear_module_question_cache()
+        self.module = self.getModule("impute_chain")
+
+    def get_dependencies(self, module):
+        # Return the dependency graph by question key and the number of
+        # templates that were parsed to get it.
+        import guidedmodules.module_logic
+        with patch.object(guidedmodules.module_logic, "get_jinja2_template_vars", wraps=get_jinja2_template_vars) as parse:
+            dependencies, root_questions = get_all_question_dependencies(module)
+        return (
+            { q.key: { qq.key for qq in deps } for q, deps in dependencies.items() },
+            { q.key for q in root_questions },
+            parse.call_count
+        )
+
+    def test_stored_dependency_graph(self):
+        self.assertEqual(self.module.question_dependencies["q_follows_follows_start"], {
+            "dependencies": ["q_follows_start", "q_start"],
+            "impute-vars": ["q_follows_start", "q_start"],
+        })
+
+        # A cold cache uses the stored graph without parsing any templates.
+        dependencies, root_questions, num_parsed = self.get_dependencies(self.module)
+        self.assertEqual(num_parsed, 0)
+        self.assertEqual(dependencies["q_follows_start"], { "q_start" })
+        self.assertEqual(root_questions, { "_introduction", "q_follows_follows_start", "q_organization" })
+        self.assertEqual(get_question_dependents(self.module)[1], { "q_organization" })
+
+        # Modules loaded before the graph was stored compute it once and store it.
+        Module.objects.filter(id=self.module.id).update(question_dependencies=None)
+        clear_module_question_cache()
+        module = Module.objects.get(id=self.module.id)
+        self.assertEqual(self.get_dependencies(module)[0], dependencies)
+        self.assertEqual(Module.objects.get(id=self.module.id).question_dependencies, self.module.question_dependencies)
+
+    def test_cache_keyed_by_module_version(self):
+        self.get_dependencies(self.module)
+        dependencies, _, num_parsed = self.get_dependencies(self.module)
+        self.assertEqual(num_parsed, 0)
+        hits = question_dependencies_cache.hits
+
+        # Editing a question in place bumps the Module's version, so
+        # other Module instances don't see the old graph.
+        q = self.module.questions.get(key="q_independent")
+        q.spec["prompt"] = "{{q_start}}"
+        q.save()
+        clear_module_question_cache(self.module)
+        module = Module.objects.get(id=self.module.id)
+        self.assertIsNone(module.question_dependencies)
+        self.assertEqual(self.get_dependencies(module)[0]["q_independent"], { "q_start" })
+        self.assertEqual(question_dependencies_cache.hits, hits)
+
+    def test_expression_cache_is_bounded(self):
+        from siteapp.utils.caches import LRUCache
+        cache = LRUCache("test", 2)
+        for i in range(3):
+            cache.get_or_set(i, lambda : i * 10)
+        self.assertNotIn(0, cache)
+        self.assertEqual(cache.get(2), 20)
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertLessEqual(len(jinja2_expression_compile_cache), jinja2_expression_compile_cache.maxsize)
+        self.assertEqual(compile_jinja2_expression("1 + 1")(), 2)
+        self.assertIs(compile_jinja2_expression("1 + 1"), compile_jinja2_expression("1 + 1"))
+
+class CurrentAnswerRecordsTests(TestCaseWithFixtureData):
+    # Tests that the current answers of Tasks are loaded without loading
+    # their answer history.
+
+    def get_current_answers(self, tasks):
+        return {
+            (task.id, question.key): answer.stored_value
+            for task, question, answer in Task.get_all_current_answer_records(tasks)
+            if answer is not None
+        }
+
+    def test_current_answers(self):
+        module = self.getModule("impute_chain")
+        task1 = Task.objects.create(module=module, project=self.project, editor=self.user)
+        task2 = Task.objects.create(module=module, project=self.project, editor=self.user)
+        for i in range(5):
+            self.save_answer(task1, "q_start", "start {}".format(i))
+            self.save_answer(task2, "q_independent", "independent {}".format(i))
+        self.save_answer(task1, "q_independent", "yes").clear_answer(self.user)
+        self.assertEqual(self.get_current_answers([task1, task2]), {
+            (task1.id, "q_start"): "start 4",
+            (task2.id, "q_independent"): "independent 4",
+        })
+
+        # The questions of each Task are yielded in order.
+        self.assertEqual([question.key for task, question, answer in Task.get_all_current_answer_records([task1])],
+                         [q.key for q in module.questions.order_by("definition_order")])
+
+        # The number of queries doesn't depend on the length of the history.
+        with self.assertNumQueries(2):
+            self.get_current_answers([task1, task2])
+        from django.core.management import call_command
+        from io import StringIO
+        call_command("benchmark_answer_history", id=task1.id, revisions=100, repeat=1, stdout=StringIO())
+        with self.assertNumQueries(2):
+            self.assertEqual(len(self.get_current_answers([task1, task2])), 2)
+
+class LoadCachedStateTests(TestCaseWithFixtureData):
+    # Tests that the progress of a tree of Tasks is computed in bulk.
+
+    def test_load_cached_state(self):
+        root_task = self.project.root_task
+        subtask1 = root_task.get_or_create_subtask(self.user, "simple_module")
+        subtask2 = root_task.get_or_create_subtask(self.user, "simple_module_two")
+        self.save_answer(subtask1, "q1", "42")
+        self.save_answer(subtask1, "_introduction", None)
+        expected = { }
+        for task in (root_task, subtask1, subtask2):
+            task = Task.objects.get(id=task.id)
+            expected[task.id] = (task.is_finished(), tuple(task.get_progress_percent_tuple()))
+        self.assertEqual(expected[subtask1.id], (True, (2, 2)))
+        Task.clear_state([root_task, subtask1, subtask2])
+
+        # The sub-task tree is loaded and evaluated once per Task
+        # and the cached state of all of them is saved at once.
+        tasks = [Task.objects.get(id=root_task.id)]
+        with patch.object(Task, "save") as save:
+            Task.load_cached_state(tasks)
+        save.assert_not_called()
+        with self.assertNumQueries(0):
+            self.assertEqual((tasks[0].is_finished(), tuple(tasks[0].get_progress_percent_tuple())), expected[root_task.id])
+        for task in (root_task, subtask1, subtask2):
+            task = Task.objects.get(id=task.id)
+            self.assertEqual((task.cached_state["is_finished"], tuple(task.cached_state["progress_percent_tuple"])), expected[task.id])
+
+        # Changing a sub-task clears the cached state of its parent as before.
+        self.save_answer(subtask2, "q1", "1")
+        self.assertIsNone(Task.objects.get(id=root_task.id).cached_state)
+
+class ClearStateTests(TestCaseWithFixtureData):
+    # Tests that clearing a Task's cached state only clears the cached
+    # state of Tasks that depend on it.
+
+    def test_clear_state_of_dependents_only(self):
+        module = self.getModule("simple")
+        task1 = Task.objects.create(module=module, project=self.project, editor=self.user)
+        task2 = Task.objects.create(module=module, project=self.project, editor=self.user)
+        self.save_answer(task2, "q1", "42")
+
+        # Compute some cached state for task2. The title only reads task2's
+        # own answers. Something else peeks at the project.
+        self.assertEqual(task2.title, "42")
+        task2.is_finished()
+        task2._get_cached_state("project_title", lambda : render_content(
+            { "format": "text", "template": "{{project}}" },
+            task2.get_answers(), "text", "test"))
+        self.assertEqual(set(task2.cached_state_reads.all()), { self.project.root_task })
+
+        # Changing an answer in another Task in the same project that task2
+        # doesn't read from doesn't clear task2's cached state.
+        avoided = Task.get_clear_state_stats()["invalidations_avoided"]
+        self.save_answer(task1, "q1", "1")
+        task2.refresh_from_db()
+        self.assertIn("is_finished", task2.cached_state)
+        self.assertGreater(Task.get_clear_state_stats()["invalidations_avoided"], avoided)
+
+        # But a change to the project's root Task does.
+        self.project.root_task.on_answer_changed()
+        task2.refresh_from_db()
+        self.assertIsNone(task2.cached_state)
+        self.assertEqual(task2.cached_state_reads.count(), 0)
+
+    def test_clear_state_of_parent_tasks(self):
+        # Changing a sub-task's answers clears the cached state of the
+        # Task it is an answer to.
+        parent = self.project.root_task
+        subtask = parent.get_or_create_subtask(self.user, "simple_module")
+        self.assertFalse(parent.is_finished())
+        self.save_answer(subtask, "q1", "42")
+        parent.refresh_from_db()
+        self.assertIsNone(parent.cached_state)
+
+@override_settings(CACHES={
+    "default": { "BACKEND": "django.core.cache.backends.dummy.DummyCache" },
+    "renders": { "BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "render-cache-tests" },
+})
+class RenderCacheTests(TestCaseWithFixtureData):
+    # Tests that rendered output documents are cached by the answers they read.
+
+    def setUp(self):
+        get_render_cache().clear()
+
+    def render(self, task):
+        task.refresh_from_db()
+        return task.render_output_documents()[0]["html"]
+
+    def test_render_cache_survives_clear_state(self):
+        module = self.getModule("simple")
+        task1 = Task.objects.create(module=module, project=self.project, editor=self.user)
+        task2 = Task.objects.create(module=module, project=self.project, editor=self.user)
+        self.save_answer(task1, "q1", "41")
+
+        stats = dict(RENDER_CACHE_STATS)
+        html = self.render(task1)
+        self.assertIn(">41</span>", html)
+        self.assertEqual(RENDER_CACHE_STATS["misses"], stats["misses"] + 1)
+
+        # After the Task's cached state is cleared, the document isn't re-rendered.
+        Task.clear_state([task1])
+        with patch("guidedmodules.module_logic.render_content") as render_content:
+            self.assertEqual(self.render(task1), html)
+            render_content.assert_not_called()
+        self.assertEqual(RENDER_CACHE_STATS["hits"], stats["hits"] + 1)
+
+        # The same document of another Task with other answers isn't a hit.
+        self.save_answer(task2, "q1", "42")
+        self.assertIn(">42</span>", self.render(task2))
+
+        # Nor is it after the Task's answer changes.
+        self.save_answer(task1, "q1", "43")
+        self.assertIn(">43</span>", self.render(task1))
+        self.assertEqual(RENDER_CACHE_STATS["hits"], stats["hits"] + 1)
+        self.assertEqual(RENDER_CACHE_STATS["misses"], stats["misses"] + 3)
+
+    def test_render_cache_reads(self):
+        task = Task.objects.create(module=self.getModule("simple"), project=self.project, editor=self.user)
+        document = { "format": "text", "template": "{{project}}" }
+        def render():
+            return get_or_render_document(document, task.get_answers(), "text",
+                lambda : render_content(document, task.get_answers(), "text", "test"))
+
+        # A cache hit records the same Task reads as rendering the document.
+        with TaskStateReadRecorder() as miss_reads:
+            content = render()
+        with TaskStateReadRecorder() as hit_reads:
+            self.assertEqual(render(), content)
+        self.assertIn(self.project.root_task.id, miss_reads.task_ids)
+        self.assertEqual(hit_reads.task_ids, miss_reads.task_ids | { task.id })
+
+        # Changing an answer the document didn't read is a cache hit, and
+        # changing an answer of a Task whose state it read is a miss.
+        stats = dict(RENDER_CACHE_STATS)
+        self.save_answer(task, "q1", "42")
+        render()
+        self.assertEqual(RENDER_CACHE_STATS["hits"], stats["hits"] + 1)
+        self.project.root_task.get_or_create_subtask(self.user, "simple_module")
+        render()
+        self.assertEqual(RENDER_CACHE_STATS["misses"], stats["misses"] + 1)
+
+    def test_render_cache_answer_reads(self):
+        # Only the answers a document read are in its fingerprint.
+        task = Task.objects.create(module=self.getModule("question_types_text"), project=self.project, editor=self.user)
+        document = { "format": "text", "template": "{{q_text}}" }
+        def render():
+            return get_or_render_document(document, task.get_answers(), "text",
+                lambda : render_content(document, task.get_answers(), "text", "test"))
+        self.save_answer(task, "q_text", "hello")
+        self.assertEqual(render(), "hello")
+
+        stats = dict(RENDER_CACHE_STATS)
+        self.save_answer(task, "q_url", "https://example.com")
+        self.assertEqual(render(), "hello")
+        self.assertEqual(RENDER_CACHE_STATS["hits"], stats["hits"] + 1)
+        self.save_answer(task, "q_text", "goodbye")
+        self.assertEqual(render(), "goodbye")
+        self.assertEqual(RENDER_CACHE_STATS["misses"], stats["misses"] + 1)
+
+    def test_render_cache_other_data(self):
+        # Renders that read data other than answers are cached with a
+        # version of that data.
+        task = Task.objects.create(module=self.getModule("simple"), project=self.project, editor=self.user)
+        document = { "format": "text", "template": "{{organization}}" }
+        def render():
+            return get_or_render_document(document, task.get_answers(), "text",
+                lambda : render_content(document, task.get_answers(), "text", "test"))
+        name = render()
+        self.assertEqual(name, self.organization.name)
+
+        stats = dict(RENDER_CACHE_STATS)
+        self.assertEqual(render(), name)
+        self.assertEqual(RENDER_CACHE_STATS["hits"], stats["hits"] + 1)
+        self.organization.name = "Renamed Organization"
+        self.organization.save()
+        self.assertEqual(render(), "Renamed Organization")
+        self.assertEqual(RENDER_CACHE_STATS["misses"], stats["misses"] + 1)
+
+        # The version of the project's system changes with its statements.
+        from controls.enums.statements import StatementTypeEnum
+        from controls.models import Element, Statement, System
+        root_element = Element.objects.create(name="Render Cache System", element_type="system")
+        self.project.system = System.objects.create(root_element=root_element)
+        self.project.save()
+        version = get_render_cache_other_data_version("project-system", self.project.id)
+        Statement.objects.create(sid="ac-1", sid_class="NIST_SP-800-53_rev4", body="Implemented.",
+            statement_type=StatementTypeEnum.CONTROL_IMPLEMENTATION.name, consumer_element=root_element)
+        self.assertNotEqual(get_render_cache_other_data_version("project-system", self.project.id), version)
+
+
+@override_settings(CACHES={
+    "default": { "BACKEND": "django.core.cache.backends.dummy.DummyCache" },
+    "derived-assets": { "BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "derived-asset-tests" },
+})
+class DerivedAssetCacheTests(TestCaseWithFixtureData):
+    # Tests that thumbnail data URLs are cached by image content and size.
+
+    def setUp(self):
+        from .models import get_derived_asset_cache
+        get_derived_asset_cache().clear()
+
+    def make_png(self, color):
+        from io import BytesIO
+        from PIL import Image
+        buf = BytesIO()
+        Image.new("RGB", (800, 600), color).save(buf, "png")
+        return buf.getvalue()
+
+    def test_cached_image_to_dataurl(self):
+        from .models import DERIVED_ASSET_CACHE_STATS, cached_image_to_dataurl, image_to_dataurl
+        red = self.make_png("red")
+        dataurl = cached_image_to_dataurl(red, 640)
+        self.assertEqual(dataurl, image_to_dataurl(red, 640))
+
+        # The same content is a hit, and a different size or content is a miss.
+        stats = dict(DERIVED_ASSET_CACHE_STATS)
+        with patch("guidedmodules.models.image_to_dataurl") as generate:
+            self.assertEqual(cached_image_to_dataurl(self.make_png("red"), 640), dataurl)
+            generate.assert_not_called()
+        self.assertNotEqual(cached_image_to_dataurl(red, 128), dataurl)
+        self.assertNotEqual(cached_image_to_dataurl(self.make_png("blue"), 640), dataurl)
+        self.assertEqual(DERIVED_ASSET_CACHE_STATS["hits"], stats["hits"] + 1)
+        self.assertEqual(DERIVED_ASSET_CACHE_STATS["misses"], stats["misses"] + 2)
+
+    def test_file_answer_dataurl_and_prewarm(self):
+        from io import StringIO
+        from django.core.files.base import ContentFile
+        from django.core.management import call_command
+        from .models import TaskAnswer, image_to_dataurl
+
+        task = Task.objects.create(module=self.getModule("question_types_media"), project=self.project, editor=self.user)
+        question = task.module.questions.get(key="q_file")
+        question.spec["file-type"] = "image"
+        question.save()
+        png = self.make_png("green")
+        taskans, _ = TaskAnswer.objects.get_or_create(task=task, question=question)
+        taskans.save_answer(None, [], ContentFile(png, name="image.png"), self.user, "web")
+        answer = taskans.get_current_answer()
+
+        # The pre-warm command caches the data URL of the image answer.
+        stdout = StringIO()
+        with patch("sys.stdout", stdout):
+            call_command("prewarm_derived_assets", project=[self.project.id])
+        self.assertIn("Cached 1 images (0 were already cached)", stdout.getvalue())
+
+        # So rendering the answer doesn't generate it again.
+        with patch("guidedmodules.models.image_to_dataurl") as generate:
+            self.assertEqual(answer.get_value()["content_dataurl"], image_to_dataurl(png, 640))
+            generate.assert_not_called()
+
+
+class FileAnswerValueTests(TestCaseWithFixtureData):
+    # Tests that the values of file answers load their metadata in one
+    # query per Task and generate thumbnails only when they are read.
+
+    def test_file_answer_values(self):
+        import json
+        from django.core.files.base import ContentFile
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .models import ModuleQuestion, TaskAnswer
+
+        task = Task.objects.create(module=self.getModule("question_types_media"), project=self.project, editor=self.user)
+        ModuleQuestion.objects.create(module=task.module, key="q_file2", definition_order=100,
+            spec={ "id": "q_file2", "title": "second file", "type": "file" })
+        for key, content in (("q_file", b"Hello."), ("q_file2", b"Hello again.")):
+            taskans, _ = TaskAnswer.objects.get_or_create(task=task, question=task.module.questions.get(key=key))
+            taskans.save_answer(None, [], ContentFile(content, name="file.txt"), self.user, "web")
+
+        def count_storedfile_queries(queries):
+            return len([q for q in queries.captured_queries if "dbstorage_storedfile" in q["sql"]])
+
+        with patch("guidedmodules.models.TaskAnswerHistory.make_file_thumbnail") as make_file_thumbnail, \
+             patch("guidedmodules.models.cached_image_to_dataurl") as generate:
+            with CaptureQueriesContext(connection) as queries:
+                answers = task.get_answers().as_dict()
+                self.assertEqual(count_storedfile_queries(queries), 0)
+                self.assertEqual(answers["q_file"]["type_display"], "plain text")
+                self.assertEqual(answers["q_file2"]["size"], len(b"Hello again."))
+                self.assertEqual(answers["q_file2"].get("type"), "text/plain")
+                self.assertTrue(answers["q_file"]["url"].endswith("/question/q_file/history/{}/media".format(
+                    TaskAnswer.objects.get(task=task, question__key="q_file").get_current_answer().id)))
+            self.assertEqual(count_storedfile_queries(queries), 1)
+            make_file_thumbnail.assert_not_called()
+            generate.assert_not_called()
+
+            # Comparing, printing and copying values doesn't load their items.
+            answers2 = task.get_answers().as_dict()
+            self.assertEqual(answers2["q_file"], answers["q_file"])
+            self.assertNotEqual(answers2["q_file2"], answers["q_file"])
+            self.assertIn("file=", repr(answers["q_file"]))
+            self.assertEqual(answers["q_file"].copy()["size"], len(b"Hello."))
+            make_file_thumbnail.assert_not_called()
+            generate.assert_not_called()
+
+            # Reading the thumbnail generates it, and serializing the value
+            # reads every item.
+            self.assertIsNone(answers["q_file"]["thumbnail_url"])
+            make_file_thumbnail.assert_called_once_with("text/plain")
+            value = json.loads(json.dumps(answers["q_file2"]))
+            self.assertEqual(value, dict(answers["q_file2"]))
+            self.assertEqual(value["type_display"], "plain text")
+            self.assertIsNone(value["content_dataurl"])
+
+
+class TaskChangesTests(TestCaseWithFixtureData):
+    # Tests that get_task_timetamp summarizes new answers from the
+    # Project's change log.
+
+    def test_task_changes(self):
+        import time
+        from django.urls import reverse
+        from .models import ProjectAnswerChange, TaskAnswer
+
+        root = self.project.root_task
+        subtask = root.get_or_create_subtask(self.user, "question_types_text")
+        time.sleep(.01)
+        since = time.time()
+        time.sleep(.01)
+        taskans = self.save_answer(subtask, "q_text", "hello")
+        self.assertEqual(ProjectAnswerChange.objects.filter(project=self.project).count(), 2)
+
+        self.client.force_login(self.user)
+        def poll(since):
+            resp = self.client.post(reverse("task_get_timestamp"), dict(id=root.id, get_changes_since=since))
+            self.assertEqual(resp.status_code, 200)
+            return resp.json()
+        # The paths to the changed sub-tasks are found from TaskParent
+        # without checking each answer.
+        with patch("guidedmodules.models.TaskAnswerHistory.is_latest") as is_latest:
+            self.assertEqual(poll(since)["changes"], "'{} → text' was answered by {} (using Web).".format(subtask.title, self.user))
+        is_latest.assert_not_called()
+
+        # Cleared answers and answers in Tasks that are no longer sub-tasks
+        # aren't changes.
+        taskans.clear_answer(self.user)
+        self.assertEqual(poll(since)["changes"], "")
+        taskans.save_answer("hello again", [], None, self.user, "web")
+        root_taskans = TaskAnswer.objects.get(task=root, question__key="question_types_text")
+        root_taskans.save_answer(None, [], None, self.user, "web")
+        self.assertEqual(poll(since)["changes"], "'{}' was answered by {} (using Web).".format(
+            root_taskans.question.spec["title"], self.user))
+
+
+class TaskAncestorTests(TestCaseWithFixtureData):
+    # Tests that access to Tasks comes from the Tasks they are current
+    # answers of, through the maintained TaskAncestor records.
+
+    def test_access_through_answers(self):
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        from .models import TaskAncestor, TaskAnswer
+
+        # The fixture project's root task is answered by a task in another
+        # project, whose question is answered by a third task.
+        other_user = User.objects.create(username="other.user", email="other@example.org")
+        outsider = User.objects.create(username="outsider", email="outsider@example.org")
+        other_project = Project.objects.create(organization=self.organization)
+        middle = Task.objects.create(module=self.getModule("question_types_module"), project=other_project, editor=other_user)
+        leaf = Task.objects.create(module=self.getModule("simple"), project=other_project, editor=other_user)
+        root_taskans, _ = TaskAnswer.objects.get_or_create(task=self.project.root_task, question=self.project.root_task.module.questions.get(key="question_types_module"))
+        root_taskans.save_answer(None, [middle], None, self.user, "web")
+        middle_taskans, _ = TaskAnswer.objects.get_or_create(task=middle, question=middle.module.questions.get(key="q_module"))
+        middle_taskans.save_answer(None, [leaf], None, other_user, "web")
+
+        self.assertEqual(set(TaskAncestor.objects.filter(task=leaf).values_list("ancestor", flat=True)), {middle.id, self.project.root_task.id})
+        self.assertEqual(leaf.get_access_level(self.user), "WRITE")
+        self.assertEqual(leaf.get_access_level(outsider), None)
+        self.assertEqual(set(Task.get_all_tasks_readable_by(self.user, recursive=True).filter(project=other_project)), {middle, leaf})
+        call_command("rebuild_task_ancestors", verify=True)
+
+        # Replacing and clearing answers removes the access.
+        other_leaf = Task.objects.create(module=self.getModule("simple"), project=other_project, editor=other_user)
+        middle_taskans.save_answer(None, [other_leaf], None, other_user, "web")
+        self.assertEqual(leaf.get_access_level(self.user), None)
+        self.assertEqual(other_leaf.get_access_level(self.user), "WRITE")
+        root_taskans.clear_answer(self.user)
+        self.assertEqual(other_leaf.get_access_level(self.user), None)
+        self.assertEqual(Task.get_all_tasks_readable_by(self.user, recursive=True).filter(project=other_project).count(), 0)
+        call_command("rebuild_task_ancestors", verify=True)
+
+        # The command finds and fixes records that aren't current.
+        TaskAncestor.objects.all().delete()
+        with self.assertRaises(CommandError):
+            call_command("rebuild_task_ancestors", verify=True)
+        call_command("rebuild_task_ancestors")
+        call_command("rebuild_task_ancestors", verify=True)
+        self.assertEqual(set(TaskAncestor.objects.filter(task=other_leaf).values_list("ancestor", flat=True)), {middle.id})
+
+    def test_compute_cycles(self):
+        from .models import TaskAncestor
+        self.assertEqual(
+            TaskAncestor.compute({1, 2, 3}, {1: {2}, 2: {1, 4}, 3: {2}}, {4: {5}}),
+            {1: {2, 4, 5}, 2: {1, 4, 5}, 3: {1, 2, 4, 5}})
+
+
+def stub_document_converter(output_format, html, reference_doc, timeout=None):
+    # Runs in a guidedmodules.conversion worker process.
+    if "fail conversion" in html:
+        raise ValueError("stub conversion failed")
+    if "slow conversion" in html:
+        import time
+        time.sleep(2)
+    return "{}/{}/{}".format(output_format, len(reference_doc or b""), html).encode("utf8")
+
+class DocumentConversionTests(TestCaseWithFixtureData):
+    # Tests that output documents are converted in the background by the
+    # worker pool and that conversions are reused.
+
+    def setUp(self):
+        import tempfile
+        conversion_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(conversion_dir.cleanup)
+        settings_override = override_settings(
+            GR_DOCUMENT_CONVERTER="guidedmodules.tests.stub_document_converter",
+            GR_DOCUMENT_CONVERSION_DIR=conversion_dir.name,
+            GR_DOCUMENT_CONVERSION_TIMEOUT=30)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_conversion_jobs(self):
+        from . import conversion
+        job_id = conversion.submit("docx", "<p>Hello</p>", b"reference")
+        self.assertEqual(conversion.wait(job_id), b"docx/9/<p>Hello</p>")
+        self.assertEqual(conversion.get_status(job_id), "done")
+
+        # The same conversion is the same job and isn't run again.
+        with patch("guidedmodules.conversion._get_pool") as get_pool:
+            self.assertEqual(conversion.submit("docx", "<p>Hello</p>", b"reference"), job_id)
+            get_pool.assert_not_called()
+
+        # Changing the HTML, the format, or the reference document is a new job.
+        self.assertNotEqual(conversion.get_job_id("docx", "<p>Hello!</p>", b"reference"), job_id)
+        self.assertNotEqual(conversion.get_job_id("pdf", "<p>Hello</p>", b"reference"), job_id)
+        self.assertNotEqual(conversion.get_job_id("docx", "<p>Hello</p>", b"reference 2"), job_id)
+        self.assertIsNone(conversion.get_status(conversion.get_job_id("pdf", "<p>Hello</p>", b"reference")))
+
+        # Failed conversions are reported and retried when submitted again.
+        job_id = conversion.submit("docx", "<p>fail conversion</p>")
+        with self.assertRaisesRegex(conversion.ConversionError, "stub conversion failed"):
+            conversion.wait(job_id)
+        self.assertEqual(conversion.get_status(job_id), "failed")
+        with patch("guidedmodules.conversion._get_pool") as get_pool:
+            conversion.submit("docx", "<p>fail conversion</p>")
+            get_pool.assert_called_once()
+
+        # Only the most recently used results are kept.
+        old_job_id = conversion.submit("plain", "<p>1</p>")
+        conversion.wait(old_job_id)
+        new_job_id = conversion.submit("plain", "<p>2</p>")
+        conversion.wait(new_job_id)
+        import os
+        os.utime(conversion._get_path(old_job_id, ".result"), (0, 0))
+        conversion.prune_results(1)
+        self.assertIsNone(conversion.get_status(old_job_id))
+        self.assertEqual(conversion.get_status(new_job_id), "done")
+
+    def test_download_output_document(self):
+        task = Task.objects.create(module=self.getModule("simple"), project=self.project, editor=self.user)
+        html = task.render_output_documents()[0]["html"]
+
+        # The HTML is converted with the project's SSP reference document.
+        blob, filename, mime_type, conversion = task.prepare_output_document_download(0, "docx")
+        self.assertIsNone(blob)
+        self.assertEqual(filename, "00000.docx")
+        self.assertEqual(conversion[:2], ("docx", html))
+        asset = self.project.assets.get_default(asset_type=AssetTypeEnum.SSP_EXPORT)
+        self.assertEqual(conversion[2], asset.file.read())
+
+        blob, filename, mime_type = task.download_output_document(0, "docx")
+        self.assertEqual(blob, "docx/{}/{}".format(len(conversion[2]), html).encode("utf8"))
+        self.assertEqual(mime_type, "application/octet-stream")
+
+        # HTML isn't converted.
+        blob, filename, mime_type, conversion = task.prepare_output_document_download(0, "html")
+        self.assertEqual(blob, html.encode("utf8"))
+        self.assertIsNone(conversion)
+
+    @override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+    def test_download_view(self):
+        from . import conversion
+        task = Task.objects.create(module=self.getModule("simple"), project=self.project, editor=self.user)
+        self.client.force_login(self.user)
+        url = task.get_absolute_url() + "/download/document/my_document/docx"
+
+        # The view returns the conversion job immediately.
+        with patch.object(Task, "render_output_documents", return_value=[{ "id": "my_document", "format": "markdown", "html": "<p>Hello</p>" }]):
+            resp = self.client.get(url, { "async": "1" })
+        job_id = resp.json()["job"]
+        self.assertIn(resp.json()["status"], ("pending", "done"))
+        blob = conversion.wait(job_id)
+
+        # And then its status and the converted document.
+        resp = self.client.get(url, { "job": job_id, "async": "1" })
+        self.assertEqual(resp.json(), { "status": "done", "job": job_id, "url": url + "?job=" + job_id })
+        resp = self.client.get(url, { "job": job_id })
+        self.assertEqual(resp.content, blob)
+        self.assertEqual(resp["Content-Disposition"], "inline; filename=my_document.docx")
+
+        # A job is only served for the task, document and format it was
+        # started for.
+        other_task = Task.objects.create(module=self.getModule("simple"), project=self.project, editor=self.user)
+        for other_url in (other_task.get_absolute_url() + "/download/document/my_document/docx",
+                          task.get_absolute_url() + "/download/document/other_document/docx",
+                          task.get_absolute_url() + "/download/document/my_document/odt"):
+            self.assertEqual(self.client.get(other_url, { "job": job_id }).status_code, 404)
+            self.assertEqual(self.client.get(other_url, { "job": job_id, "async": "1" }).status_code, 404)
+
+        # Without async=1, the request only waits GR_DOCUMENT_CONVERSION_SYNC_TIMEOUT
+        # seconds and the conversion continues in the background.
+        with patch.object(Task, "render_output_documents", return_value=[{ "id": "my_document", "format": "markdown", "html": "<p>slow conversion</p>" }]), \
+             override_settings(GR_DOCUMENT_CONVERSION_SYNC_TIMEOUT=0):
+            resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 503)
+        job_id = conversion.get_job_id("docx", "<p>slow conversion</p>", self.project.assets.get_default(asset_type=AssetTypeEnum.SSP_EXPORT).file.read())
+        self.assertEqual(conversion.get_status(job_id), "pending")
+        conversion.wait(job_id)
+        resp = self.client.get(url, { "job": job_id })
+        self.assertEqual(resp["Content-Disposition"], "inline; filename=my_document.docx")
+
+    def test_stop_xvfb(self):
+        import subprocess
+        from . import conversion
+        proc = subprocess.Popen(["sleep", "60"])
+        conversion._xvfb = (proc, ":99")
+        conversion._stop_xvfb()
+        self.assertIsNotNone(proc.poll())
+        self.assertIsNone(conversion._xvfb)
+
+    def test_converter_timeout(self):
+        # A converter that takes too long is killed.
+        import subprocess
+        from . import conversion
+        with subprocess.Popen(["sleep", "60"], stdin=subprocess.PIPE) as proc:
+            with self.assertRaises(subprocess.TimeoutExpired):
+                conversion._communicate(proc, b"", 0.1)
+            self.assertIsNotNone(proc.poll())
+
+
+class GitAppSourceTests(TestCase):
+    # Tests that git AppSources are fetched into a persistent mirror and that
+    # modules whose files haven't changed aren't read again.
+
+    def setUp(self):
+        import os, shutil, tempfile
+        import git
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        self.mirror_dir = os.path.join(tempdir.name, "mirrors")
+        settings_override = override_settings(GR_GIT_MIRROR_DIR=self.mirror_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        # Push the fixture apps to a local bare repository.
+        self.url = os.path.join(tempdir.name, "apps.git")
+        git.Repo.init(self.url, bare=True)
+        self.work_dir = os.path.join(tempdir.name, "work")
+        shutil.copytree("fixtures/modules/other", os.path.join(self.work_dir, "apps"))
+        self.work = git.Repo.init(self.work_dir)
+        self.work.create_remote("origin", self.url)
+        self.commit("Add apps.")
+
+        from .app_source_connections import _module_spec_cache
+        _module_spec_cache.clear()
+
+    def commit(self, message):
+        self.work.git.add("-A")
+        self.work.git.execute([self.work.git.git_exec_name,
+            "-c", "user.name=Test", "-c", "user.email=test@example.org",
+            "commit", "-q", "-m", message])
+        self.work.git.push("origin", "HEAD:refs/heads/master")
+
+    def get_modules(self):
+        # Return the modules of the app and the number of module YAML files
+        # that were read to get them.
+        from .models import AppSource
+        from .app_source_connections import AppSourceConnection, read_yaml_file
+        source = AppSource(slug="git-test", spec={ "type": "git", "url": self.url, "branch": "master", "path": "apps" })
+        with AppSourceConnection.create(source, source.spec) as store:
+            app = store.get_app("simple_project")
+            with patch("guidedmodules.app_source_connections.read_yaml_file", wraps=read_yaml_file) as reads:
+                modules = dict(app.get_modules())
+        return modules, reads.call_count
+
+    def test_mirror(self):
+        import os
+        from .app_source_connections import GitRepositoryFilesystem
+        modules, reads = self.get_modules()
+        self.assertEqual(modules["simple"]["id"], "simple")
+        self.assertEqual(reads, len(modules))
+
+        # The mirror is kept, and an unchanged tree is listed from its index
+        # and its modules aren't read again.
+        self.assertEqual(len([fn for fn in os.listdir(self.mirror_dir) if not fn.endswith(".lock")]), 1)
+        with patch.object(GitRepositoryFilesystem, "build_index") as build_index:
+            self.assertEqual(self.get_modules(), (modules, 0))
+        build_index.assert_not_called()
+
+        # After a module changes, only it is read again.
+        fn = os.path.join(self.work_dir, "apps/simple_project/simple.yaml")
+        with open(fn) as f:
+            spec = f.read()
+        with open(fn, "w") as f:
+            f.write(spec.replace("title: A Simple Module", "title: A Changed Module"))
+        self.commit("Change a module.")
+        modules2, reads = self.get_modules()
+        self.assertEqual(reads, 1)
+        self.assertEqual(modules2["simple"]["title"], "A Changed Module")
+        self.assertEqual(modules2["app"], modules["app"])
+
+    def test_missing_path(self):
+        from .models import AppSource
+        from .app_source_connections import AppSourceConnection, AppSourceConnectionError
+        source = AppSource(slug="git-test", spec={ "type": "git", "url": self.url, "path": "nonexistent" })
+        with self.assertRaises(AppSourceConnectionError):
+            with AppSourceConnection.create(source, source.spec):
+                pass
+
+
 class RenderTests(TestCaseWithFixtureData):
     ## GENERAL RENDER TESTS ##
 
@@ -414,6 +1220,26 @@ class RenderTests(TestCaseWithFixtureData):
             str(self), # source
         ).strip()
 
+    def test_render_prepared_template_cache(self):
+        # Templates are converted from Markdown and compiled once, and
+        # executed with the answers on every render.
+        template = "# Hello\n\n*{{q_text}}*"
+        self.assertEqual(
+            self.render_content("question_types_text", "markdown", template, { "q_text": "first" }, "html"),
+            "<h2>Hello</h2>\n<p><em>first</em></p>")
+        with patch("guidedmodules.module_logic._convert_markdown_template_to_html") as convert:
+            hits = jinja2_template_compile_cache.hits
+            self.assertEqual(
+                self.render_content("question_types_text", "markdown", template, { "q_text": "second" }, "html"),
+                "<h2>Hello</h2>\n<p><em>second</em></p>")
+            convert.assert_not_called()
+            self.assertEqual(jinja2_template_compile_cache.hits, hits + 1)
+
+        # Headings are only demoted if asked for.
+        self.assertNotEqual(
+            convert_markdown_template_to_html(template, demote_headings=False),
+            convert_markdown_template_to_html(template))
+
     ## RENDERING ANSWERS ##
     #
     # Render {{question}}, which yields (a display form of) the raw value,
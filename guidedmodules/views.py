@@ -29,11 +29,13 @@ from siteapp.models import Invitation, Project
 from siteapp.views import project_navigation
 
 import guidedmodules.answer_validation as answer_validation
+import guidedmodules.conversion as document_conversion
 import guidedmodules.module_logic as module_logic
 from guidedmodules.forms import ExportCSVTemplateSSPForm
 
-from .models import (InstrumentationEvent, Module, ModuleQuestion, Task,
-                     TaskAnswer, TaskAnswerHistory)
+from .models import (InstrumentationEvent, Module, ModuleQuestion,
+                     ProjectAnswerChange, Task, TaskAncestor, TaskAnswer,
+                     TaskAnswerHistory, TaskParent)
 
 logging.basicConfig()
 import csv
@@ -1289,7 +1291,7 @@ def download_answer_file(request, task, answered, context, q, history_id):
     # if it exists.
     blob = tah.answered_by_file
     if request.GET.get("thumbnail"):
-        tah.get_value() # populate lazy-created thumbnail
+        tah.get_value()["thumbnail_url"] # populate lazy-created thumbnail
         if not tah.thumbnail.name: raise Http404()
         blob = tah.thumbnail
 
@@ -1328,8 +1330,37 @@ def download_answer_file(request, task, answered, context, q, history_id):
 
 @task_view
 def download_module_output(request, task, answered, context, question, document_id, download_format):
+    # Documents that must be converted to PDF, DOCX, etc. are converted in
+    # the background (see guidedmodules.conversion). With ?async=1, the
+    # conversion job's status is returned as JSON and the page polls it
+    # with ?job=...&async=1 and then downloads the document with ?job=....
+    # Otherwise the request waits for the conversion to finish, for at most
+    # GR_DOCUMENT_CONVERSION_SYNC_TIMEOUT seconds. A job is only served for
+    # the task, document and format that it was started for.
     if document_id in (None, ""):
         raise Http404()
+    if download_format not in Task.output_document_download_formats:
+        raise Http404("Problem processing document request.")
+    is_async = request.GET.get("async") == "1"
+    download = { "task": task.id, "document": document_id, "format": download_format }
+
+    job_id = request.GET.get("job")
+    if job_id is not None:
+        if not document_conversion.is_job_id(job_id):
+            raise Http404()
+        owner = document_conversion.get_owner(job_id, download)
+        if owner is None:
+            raise Http404()
+        if is_async:
+            return conversion_job_status(request, job_id)
+        try:
+            blob = document_conversion.wait(job_id, timeout=settings.GR_DOCUMENT_CONVERSION_SYNC_TIMEOUT)
+        except document_conversion.ConversionTimeout:
+            return conversion_pending_response()
+        except document_conversion.ConversionError:
+            raise Http404("Problem processing document request.")
+        return document_download_response(blob, owner["filename"], owner["mime_type"])
+
     try:
         # Force refresh of content associated with this Task.
         # Clear module questions since ModuleQuestions may have changed.
@@ -1338,10 +1369,43 @@ def download_module_output(request, task, answered, context, question, document_
         # Since impute conditions, output documents, and other generated
         # data may have changed, clear all cached Task state for project.
         Task.clear_state(Task.objects.filter(module__app=task.project.root_task.module.app.id))
-        blob, filename, mime_type= task.download_output_document(document_id, download_format, answers=answered)
-    except ValueError:
+        blob, filename, mime_type, conversion = task.prepare_output_document_download(document_id, download_format, answers=answered)
+        if conversion is not None:
+            job_id = document_conversion.submit(*conversion)
+            document_conversion.add_owner(job_id, dict(download, filename=filename, mime_type=mime_type))
+            if not is_async:
+                blob = document_conversion.wait(job_id, timeout=settings.GR_DOCUMENT_CONVERSION_SYNC_TIMEOUT)
+    except document_conversion.ConversionTimeout:
+        return conversion_pending_response()
+    except (ValueError, document_conversion.ConversionError):
         raise Http404("Problem processing document request.")
 
+    if is_async:
+        if job_id is None:
+            # The document didn't need to be converted.
+            return JsonResponse({ "status": "done", "url": request.path })
+        return conversion_job_status(request, job_id)
+
+    return document_download_response(blob, filename, mime_type)
+
+def conversion_job_status(request, job_id):
+    import urllib.parse
+    status = document_conversion.get_status(job_id) or "failed"
+    return JsonResponse({
+        "status": status,
+        "job": job_id,
+        "url": request.path + "?" + urllib.parse.urlencode({ "job": job_id }),
+    }, status=202 if status == "pending" else 200)
+
+def conversion_pending_response():
+    # The conversion continues in the background, so the same request made
+    # again later finds its result.
+    resp = HttpResponse("The document is still being converted. Try again in a minute.",
+        content_type="text/plain", status=503)
+    resp["Retry-After"] = "60"
+    return resp
+
+def document_download_response(blob, filename, mime_type):
     resp = HttpResponse(blob, mime_type)
     resp['Content-Disposition'] = 'inline; filename=' + filename
     return resp
@@ -1757,7 +1821,7 @@ def authoring_new_question(request, task):
 
     # Clear cache...
     from .module_logic import clear_module_question_cache
-    clear_module_question_cache()
+    clear_module_question_cache(task.module)
 
     # Return status. The browser will reload/redirect --- if the question key
     # changed, this sends the new key.
@@ -1773,6 +1837,8 @@ def authoring_edit_question(request, task):
     if request.POST.get("delete") == "1":
         try:
             question.delete()
+            from .module_logic import clear_module_question_cache
+            clear_module_question_cache(task.module)
             return JsonResponse({ "status": "ok", "redirect": task.get_absolute_url() })
         except Exception as e:
             # The only reason it would fail is a protected foreign key.
@@ -1878,7 +1944,7 @@ def authoring_edit_question(request, task):
 
     # Clear cache...
     from .module_logic import clear_module_question_cache
-    clear_module_question_cache()
+    clear_module_question_cache(question.module)
 
     # Return status. The browser will reload/redirect --- if the question key
     # changed, this sends the new key.
@@ -1965,11 +2031,88 @@ def delete_task(request):
 
     return HttpResponse("ok")
 
+def get_task_path(task_id, root_task, parents, seen_tasks):
+    # Return the IDs of the Tasks from root_task (exclusive) down to task_id
+    # (inclusive), following the current answers to module questions, or
+    # None if the task isn't a sub-task of root_task. parents maps the IDs
+    # of Tasks to the IDs of the Tasks they are current answers of.
+    if task_id == root_task.id:
+        return []
+    if task_id in seen_tasks:
+        # Prevent infinite recursion.
+        return None
+    seen_tasks.add(task_id)
+    for parent_id in sorted(parents.get(task_id, ())):
+        path = get_task_path(parent_id, root_task, parents, seen_tasks)
+        if path is not None:
+            return path + [task_id]
+    return None
+
+def summarize_task_changes(task, since):
+    # Summarize the answers in the task and its sub-tasks that are new
+    # since the given POSIX time, using the Project's change log.
+    changes = OrderedDict()
+    for answer in ProjectAnswerChange.get_current_answers_since(task.project, since):
+        changes.setdefault(answer.taskanswer.task, []).append(answer)
+    if not changes:
+        return []
+
+    # Find the path from the task to each changed sub-task through the
+    # parents of the task's sub-tasks, read with one query.
+    parents = { }
+    for task_id, parent_id in TaskParent.objects \
+            .filter(task__in=TaskAncestor.objects.filter(ancestor=task).values("task")) \
+            .values_list("task_id", "parent_id"):
+        parents.setdefault(task_id, []).append(parent_id)
+    paths = {
+        subtask: get_task_path(subtask.id, task, parents, set())
+        for subtask in changes
+    }
+    path_tasks = { subtask.id: subtask for subtask in changes }
+    path_tasks.update(Task.objects.in_bulk({
+        task_id
+        for path in paths.values() if path is not None
+        for task_id in path
+    } - set(path_tasks)))
+
+    ret = []
+    for subtask, answers in changes.items():
+        if paths[subtask] is None:
+            # The answer isn't in this task or its sub-tasks.
+            continue
+        path = [path_tasks[task_id].title for task_id in paths[subtask]]
+
+        all_authors = set()
+        task_ret = []
+        for a in sorted(answers, key=lambda a: a.taskanswer.question.definition_order):
+            # Construct string for the author.
+            author = "{} (using {})".format(
+                str(a.answered_by),
+                a.get_answered_by_method_display()
+            )
+            all_authors.add(author)
+
+            # Construct string for this question being changed.
+            task_ret.append("'{}' was answered by {}.".format(
+                " → ".join(path + [a.taskanswer.question.spec['title']]),
+                author,
+            ))
+
+        # If there are a lot of changes, summarize.
+        if len(task_ret) >= 5:
+            task_ret = ["{} questions in {} were answered by {}.".format(
+                len(task_ret),
+                " → ".join(path) or "this task",
+                ", ".join(sorted(all_authors)),
+            )]
+        ret.extend(task_ret)
+
+    return ret
+
 @login_required
 def get_task_timetamp(request):
     # Get the 'updated' timestamp on the task and if 'get_changes_since'
-    # is passed, scan for new answers within this project and return a
-    # summary of the changes.
+    # is passed, summarize the new answers within this project.
 
     # Check access.
     if request.method != "POST":
@@ -1978,68 +2121,20 @@ def get_task_timetamp(request):
     if not task.has_read_priv(request.user):
         return HttpResponseForbidden()
 
+    try:
+        get_changes_since = float(request.POST.get("get_changes_since"))
+    except:
+        get_changes_since = None
+
     # Form response.
     ret = {
         "timestamp": task.updated.timestamp()
     }
 
     # If get_changes_since is provided and it doesn't match the current
-    # timestamp of the task, scan the project recursively for new answers
-    # since the given time.
-    try:
-        get_changes_since = float(request.POST.get("get_changes_since"))
-    except:
-        get_changes_since = None
+    # timestamp of the task, summarize the new answers since the given time.
     if get_changes_since and get_changes_since != ret["timestamp"]:
-
-        def summarize_task_changes(task, path, seen_tasks):
-            if task in seen_tasks:
-                # Prevent infinite recursion. If we've done
-                # this task already, pretend is has no changes
-                # on later visits.
-                return []
-            seen_tasks.add(task)
-
-            # What are the new answers?
-            ret = []
-            all_authors = set()
-            for q, a in task.get_current_answer_records():
-                # This question is not yet answered.
-                if a is None:
-                    continue
-
-                # This question has a new answer.
-                if a.created.timestamp() > get_changes_since:
-                    # Construct string for the author.
-                    author = "{} (using {})".format(
-                        str(a.answered_by),
-                        a.get_answered_by_method_display()
-                    )
-                    all_authors.add(author)
-
-                    # Construct string for this question being changed.
-                    ret.append("'{}' was answered by {}.".format(
-                        " → ".join(path + [q.spec['title']]),
-                        author,
-                    ))
-                    continue
-
-                # Scan sub-tasks for new answers.
-                for subtask in a.answered_by_task.all():
-                    ret.extend(summarize_task_changes(subtask, path+[subtask.title], seen_tasks))
-
-            # If there are a lot of changes, summarize.
-            if len(ret) >= 5 and all_authors:
-                return ["{} questions in {} were answered by {}.".format(
-                    len(ret),
-                    " → ".join(path) or "this task",
-                    ", ".join(all_authors),
-                )]
-
-            return ret
-
-
-        ret["changes"] = " ".join(summarize_task_changes(task, [], set()))
+        ret["changes"] = " ".join(summarize_task_changes(task, get_changes_since))
 
     return JsonResponse(ret)
 
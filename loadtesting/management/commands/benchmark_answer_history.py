@@ -0,0 +1,76 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from guidedmodules.models import Task, TaskAnswer, TaskAnswerHistory
+
+class RollBack(Exception):
+    pass
+
+class Command(BaseCommand):
+    help = 'Times loading the current answers of a Task after adding a long history of revisions to its answers. The added revisions are rolled back afterwards.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--id', type=int, required=True, help="the ID of a Task that has at least one answered question")
+        parser.add_argument('--revisions', type=int, default=10000, help="the number of revisions to add to the Task's answer history (default 10000)")
+        parser.add_argument('--repeat', type=int, default=5, help="the number of timed runs (default 5)")
+
+    def handle(self, *args, **options):
+        task = Task.objects.filter(id=options['id']).first()
+        if task is None:
+            raise CommandError("There is no Task with ID {}.".format(options['id']))
+        taskanswers = list(TaskAnswer.objects.filter(task=task, answer_history__isnull=False).distinct())
+        if not taskanswers:
+            raise CommandError("Task {} has no answers to add revisions to.".format(task.id))
+
+        try:
+            with transaction.atomic():
+                self.run(task, taskanswers, options)
+                raise RollBack()
+        except RollBack:
+            pass
+
+    def run(self, task, taskanswers, options):
+        # Add revisions spread evenly over the Task's answered questions,
+        # copying each question's current answer so that the current answers
+        # don't change.
+        current = { ta.id: ta.get_current_answer() for ta in taskanswers }
+        def make_revision(i):
+            taskanswer = taskanswers[i % len(taskanswers)]
+            ansh = current[taskanswer.id]
+            return TaskAnswerHistory(
+                taskanswer=taskanswer,
+                answered_by=ansh.answered_by,
+                answered_by_method="imp",
+                stored_value=ansh.stored_value,
+                cleared=ansh.cleared)
+        TaskAnswerHistory.objects.bulk_create(
+            [make_revision(i) for i in range(options['revisions'])],
+            batch_size=1000)
+        history_count = TaskAnswerHistory.objects.filter(taskanswer__task=task).count()
+        print("Task {} has {} questions and {} answer revisions.".format(
+            task.id, len(taskanswers), history_count))
+
+        # Time loading the full history, which is what loading the
+        # current answers used to require, for comparison.
+        self.time("full answer history", options['repeat'], lambda : list(
+            TaskAnswerHistory.objects
+                .select_related('taskanswer', 'taskanswer__question')
+                .filter(taskanswer__task=task)
+                .order_by('-id')))
+
+        # Time loading just the current answers.
+        self.time("get_all_current_answer_records", options['repeat'], lambda : list(
+            Task.get_all_current_answer_records([task])))
+
+    def time(self, label, repeat, func):
+        timings = []
+        for i in range(repeat):
+            with CaptureQueriesContext(connection) as queries:
+                start = perf_counter()
+                func()
+                timings.append(perf_counter() - start)
+        print("{}: best {:.1f} ms, mean {:.1f} ms, {} queries".format(
+            label, min(timings) * 1000, sum(timings) / len(timings) * 1000, len(queries)))
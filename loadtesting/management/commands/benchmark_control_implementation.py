@@ -0,0 +1,71 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from controls.enums.statements import StatementTypeEnum
+from controls.models import Element, ElementControl, Statement, System
+
+class RollBack(Exception):
+    pass
+
+class Command(BaseCommand):
+    help = 'Times building the control implementation statements of a synthetic System, as when an SSP is rendered. The synthetic System is rolled back afterwards.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--controls', type=int, default=325, help="the number of controls selected for the System (default 325, about a moderate baseline)")
+        parser.add_argument('--components', type=int, default=10, help="the number of components with a statement for every control (default 10)")
+        parser.add_argument('--parts', type=int, default=2, help="the number of statement parts per control and component (default 2)")
+        parser.add_argument('--repeat', type=int, default=5, help="the number of timed runs (default 5)")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise RollBack()
+        except RollBack:
+            pass
+
+    def run(self, options):
+        catalog_key = "NIST_SP-800-53_rev4"
+        root_element = Element.objects.create(name="Benchmark System", element_type="system")
+        system = System.objects.create(root_element=root_element)
+        sids = ["xx-{}".format(i + 1) for i in range(options['controls'])]
+        ElementControl.objects.bulk_create([
+            ElementControl(element=root_element, oscal_ctl_id=sid, oscal_catalog_key=catalog_key)
+            for sid in sids
+        ])
+        statements = []
+        for c in range(options['components']):
+            component = Element.objects.create(name="Benchmark Component {}".format(c + 1), element_type="system_element")
+            for sid in sids:
+                for p in range(options['parts']):
+                    statements.append(Statement(
+                        sid=sid,
+                        sid_class=catalog_key,
+                        pid=chr(ord('a') + p),
+                        body="Benchmark Component {} implements part {} of {}.\nIt does so thoroughly.".format(c + 1, p + 1, sid),
+                        statement_type=StatementTypeEnum.CONTROL_IMPLEMENTATION.name,
+                        status="Implemented",
+                        producer_element=component,
+                        consumer_element=root_element))
+        Statement.objects.bulk_create(statements, batch_size=1000)
+        print("System {} has {} controls and {} control implementation statements.".format(
+            system.id, len(sids), len(statements)))
+
+        def build():
+            # control_implementation_as_dict is a cached_property, so
+            # use a fresh System instance each time.
+            return System.objects.select_related('root_element').get(id=system.id).control_implementation_as_dict
+        self.time("control_implementation_as_dict", options['repeat'], build)
+
+    def time(self, label, repeat, func):
+        timings = []
+        for i in range(repeat):
+            with CaptureQueriesContext(connection) as queries:
+                start = perf_counter()
+                func()
+                timings.append(perf_counter() - start)
+        print("{}: best {:.1f} ms, mean {:.1f} ms, {} queries".format(
+            label, min(timings) * 1000, sum(timings) / len(timings) * 1000, len(queries)))
@@ -0,0 +1,77 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from guidedmodules.app_loading import load_app_into_database
+from guidedmodules.app_source_connections import MultiplexedAppSourceConnection
+from guidedmodules.models import AppSource
+from guidedmodules import module_logic
+
+class RollBack(Exception):
+    pass
+
+class Command(BaseCommand):
+    help = 'Times render_content on the output documents of the bundled q-files apps, with and without prepared templates cached. The loaded apps are rolled back afterwards.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='q-files/vendors/govready/govready-q-files-startpack/q-files', help="the directory of apps to load")
+        parser.add_argument('--repeat', type=int, default=5, help="the number of timed runs (default 5)")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise RollBack()
+        except RollBack:
+            pass
+
+    def run(self, options):
+        source = AppSource.objects.create(slug="benchmark-render-content", spec={ "type": "local", "path": options['path'] })
+        modules = []
+        with MultiplexedAppSourceConnection([source]) as store:
+            for app in store.list_apps():
+                try:
+                    appver = load_app_into_database(app)
+                except Exception as e:
+                    print("Skipping app {}: {}".format(app.name, e))
+                    continue
+                modules.extend(appver.modules.all())
+
+        # Render every output document with no answers, as HTML and text.
+        renders = []
+        for module in modules:
+            answers = module_logic.ModuleAnswers(module, None, None)
+            for i, document in enumerate(module.spec.get("output", [])):
+                if document.get("format") not in ("markdown", "text", "html"):
+                    continue
+                for output_format in ("html", "text"):
+                    renders.append((document, answers, output_format, "{} output {}".format(module, i)))
+        print("Rendering {} output documents of {} modules.".format(len(renders), len(modules)))
+
+        def render_all():
+            errors = 0
+            for document, answers, output_format, source in renders:
+                try:
+                    module_logic.render_content(document, answers, output_format, source)
+                except Exception:
+                    errors += 1
+            return errors
+
+        def clear_caches():
+            module_logic.markdown_template_cache.clear()
+            module_logic.jinja2_template_compile_cache.clear()
+
+        self.time("render_content, templates prepared every time", options['repeat'], render_all, before=clear_caches)
+        self.time("render_content, prepared templates cached", options['repeat'], render_all)
+
+    def time(self, label, repeat, func, before=None):
+        timings = []
+        for i in range(repeat):
+            if before:
+                before()
+            start = perf_counter()
+            errors = func()
+            timings.append(perf_counter() - start)
+        print("{}: best {:.1f} ms, mean {:.1f} ms, {} errors".format(
+            label, min(timings) * 1000, sum(timings) / len(timings) * 1000, errors))
@@ -4,13 +4,22 @@ from django.conf import settings
 from django.utils import timezone
 
 import time, uuid
+from datetime import timedelta
 
 from exclusiveprocess import Lock
+from structlog import get_logger
 
 from notifications.models import Notification
 
+from siteapp.models import Invitation
+
+logger = get_logger()
+
+# How long to wait before trying again to send an invitation that failed to send.
+INVITATION_RETRY_DELAY = timedelta(minutes=15)
+
 class Command(BaseCommand):
-    help = 'Sends emails for notifications.'
+    help = 'Sends emails for notifications and queued invitations.'
 
     def add_arguments(self, parser):
         parser.add_argument('forever', nargs='?', type=bool)
@@ -51,6 +60,32 @@ class Command(BaseCommand):
         for notif in notifs:
             self.send_it_out(notif)
 
+        # Send the invitations that were queued to be sent in the background,
+        # except those that failed to send recently.
+        invitations = Invitation.objects\
+            .filter(sent_at=None, revoked_at=None, queued_at__lte=timezone.now())\
+            .order_by('id')
+        for inv in invitations:
+            self.send_invitation(inv)
+
+    def send_invitation(self, inv):
+        # Re-check the database to make sure the invitation is still unsent
+        # and lock it while sending the email, in case this runs on multiple
+        # instances/containers of GovReady-Q.
+        try:
+            with transaction.atomic():
+                inv = Invitation.objects.select_for_update().get(id=inv.id)
+                if inv.sent_at is None:
+                    inv.send()
+        except Exception as e:
+            # Don't let one invitation that can't be sent hold up the others.
+            # Move it to the back of the queue so it is tried again later.
+            logger.error(
+                event="send invitation",
+                object={"object": "invitation", "id": inv.id, "status": "error", "message": str(e)},
+            )
+            Invitation.objects.filter(id=inv.id).update(queued_at=timezone.now() + INVITATION_RETRY_DELAY)
+
     def send_it_out(self, notif):
         # If the Notification's target does not have an 'organization' attribute
         # and a 'get_absolute_url' attribute, then we can't generate a link back
@@ -60,9 +95,6 @@ class Command(BaseCommand):
         organization = getattr(notif.target, 'organization', None)
         if not organization: return
 
-        # Let the actor render appropriately.
-        notif.actor.preload_profile()
-
         # If the target supports receiving email replies (like replying to an email
         # about a discussion), then store a secret in the notif.data dictionary so
         # that we can tell that a user has replied to something we sent them (and
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.5 on 2026-10-18 13:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('siteapp', '0053_invitation_queued_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectSummary',
+            fields=[
+                ('project', models.OneToOneField(help_text='The Project this is a summary of.', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='siteapp.project')),
+                ('acronym', models.TextField(blank=True, help_text="The Project's system acronym, from its system_basic_info Task.", null=True)),
+                ('total_controls_count', models.IntegerField(default=0, help_text="The number of controls selected for the Project's system.")),
+                ('controls_addressed_count', models.IntegerField(default=0, help_text='The number of those controls that are assessed or ready for assessment.')),
+                ('stale', models.BooleanField(default=False, help_text='Have the acronym or controls changed since the summary was computed?')),
+                ('lifecycle_stage_code', models.TextField(blank=True, help_text="The text of the root Task's govready_lifecycle_stage_code output document.", null=True)),
+                ('lifecycle_stage_stale', models.BooleanField(default=True, help_text="Have the Project's answers changed since the lifecycle stage was computed?")),
+                ('updated', models.DateTimeField(auto_now=True, db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.5 on 2026-10-18 14:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('siteapp', '0054_project_summary'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='invitation',
+            name='queued_at',
+            field=models.DateTimeField(blank=True, help_text='If the invitation is to be sent by email in the background by the send_notification_emails command, when it was queued, or when to try again if sending it failed.', null=True),
+        ),
+    ]
@@ -681,63 +681,35 @@ class Project(TagModelMixin):
         # Gets all projects a user has read priv to, excluding
         # account and organization profile projects, and sorted
         # in reverse chronological order by modified date.
-        # TODO: This could probably be optimized with prefetch related
-        projects = set()
-
         if not user.is_authenticated:
-            return projects
-
-        # Add all of the Projects the user is a member of.
-        for pm in ProjectMembership.objects \
-                .filter(user=user) \
-                .filter(**{"project__" + k: v for k, v in filters.items()}) \
-                .exclude(**{"project__" + k: v for k, v in excludes.items()}) \
-                .select_related('project__root_task__module', 'project__portfolio') \
-                .prefetch_related('project__root_task__module'):
-            projects.add(pm.project)
-            if pm.is_admin:
-                # Annotate with whether the user is an admin of the project.
-                pm.project.user_is_admin = True
-
-        # Add projects that the user is the editor of a task in, even if
-        # the user isn't a team member of that project.
-        from guidedmodules.models import Task
-        for task in Task.get_all_tasks_readable_by(user) \
-                .filter(**{"project__" + k: v for k, v in filters.items()}) \
-                .exclude(**{"project__" + k: v for k, v in excludes.items()}) \
-                .order_by('-created') \
-                .select_related('project__root_task__module', 'project__portfolio') \
-                .prefetch_related('project__root_task__module'):
-            projects.add(task.project)
-
-        # Add projects that the user is participating in a Discussion in
-        # as a guest.
-        from discussion.models import Discussion
-        for d in Discussion.objects.filter(guests=user):
-            if d.attached_to is not None:  # because it is generic there is no cascaded delete and the Discussion can become dangling
-                if not filters or d.attached_to.task.project in Project.objects.filter(**filters):
-                    if not excludes or d.attached_to.task.project not in Project.objects.exclude(**filters):
-                        projects.add(d.attached_to.task.project)
-
-        # Add projects the user has permissions for
-        for project in Project.objects.all():
-            user_permissions = get_user_perms(user, project)
-            if len(user_permissions):
-                projects.add(project)
-
-        # Add projects the user has permissions for through a portfolio
-        for portfolio in Portfolio.objects.prefetch_related('projects').all():
-            user_permissions = get_user_perms(user, portfolio)
-            if len(user_permissions):
-                for project in portfolio.projects.all():
-                    projects.add(project)
+            return set()
+
+        # The ids of the projects the user is a member of, is the editor
+        # of a task in or is a guest in a discussion in, which the filters
+        # and excludes apply to, and of the projects the user has permissions
+        # for directly or through a portfolio, which they don't.
+        access = get_project_access(user)
+        project_ids = access["related"]
+        if project_ids and (filters or excludes):
+            project_ids = set(Project.objects
+                .filter(id__in=project_ids)
+                .filter(**filters)
+                .exclude(**excludes)
+                .values_list("id", flat=True))
+        project_ids = project_ids | access["permitted"]
 
         # Don't show system projects.
-        system_projects = set(p for p in projects if p.is_organization_project or p.is_account_project)
-        projects -= system_projects
-
-        # Sort.
-        projects = sorted(projects, key=lambda x: x.updated, reverse=True)
+        projects = list(Project.objects
+            .filter(id__in=project_ids)
+            .exclude(is_organization_project=True)
+            .exclude(is_account_project=True)
+            .select_related('root_task__module', 'portfolio', 'summary')
+            .order_by('-updated'))
+
+        # Annotate with whether the user is an admin of the project.
+        for project in projects:
+            if project.id in access["admin"]:
+                project.user_is_admin = True
 
         return projects
 
@@ -755,14 +727,13 @@ class Project(TagModelMixin):
         # Get all tasks that the user might want to continue working on
         # (except for the project root task).
         from guidedmodules.models import Task
-        return [
-            task for task in
-            Task.get_all_tasks_readable_by(user)
+        tasks = list(Task.get_all_tasks_readable_by(user)
                 .filter(project=self, editor=user) \
+                .exclude(id=self.root_task_id) \
                 .order_by('-updated') \
-                .select_related('project')
-            if not task.is_finished()
-               and task != self.root_task]
+                .select_related('project', 'module'))
+        Task.load_cached_state(tasks)
+        return [task for task in tasks if not task.is_finished()]
 
     def set_root_task(self, module, editor, expected_module_type="project"):
         # create task and set it as the project root task
@@ -1226,6 +1197,214 @@ class ProjectMembership(models.Model):
         unique_together = [('project', 'user')]
 
 
+# The sets of ids of the projects each user can read, for
+# Project.get_projects_with_read_priv. They are kept on the User instance
+# for the rest of the request and, when GR_PROJECT_ACCESS_CACHE_TTL is set,
+# in the default cache for that many seconds. Both are dropped when a
+# membership, permission, task, portfolio or discussion guest changes.
+PROJECT_ACCESS_VERSION_KEY = "project-access-version"
+project_access_local_version = 0
+
+def get_project_access(user):
+    memo = getattr(user, "_project_access", None)
+    if memo is not None and memo[0] == project_access_local_version:
+        return memo[1]
+
+    access = None
+    ttl = settings.GR_PROJECT_ACCESS_CACHE_TTL
+    if ttl:
+        from django.core.cache import cache
+        key = "project-access:{}:{}".format(user.id, get_project_access_version())
+        access = cache.get(key)
+    if access is None:
+        access = compute_project_access(user)
+        if ttl:
+            cache.set(key, access, ttl)
+
+    user._project_access = (project_access_local_version, access)
+    return access
+
+def compute_project_access(user):
+    from django.db.models.functions import Cast
+    from guardian.models import UserObjectPermission
+    from guidedmodules.models import Task, TaskAnswer
+    from discussion.models import Discussion
+
+    # The projects the user is a member of.
+    related = set()
+    admin = set()
+    for project_id, is_admin in ProjectMembership.objects.filter(user=user).values_list("project_id", "is_admin"):
+        related.add(project_id)
+        if is_admin:
+            admin.add(project_id)
+
+    # The projects the user is the editor of a task in, even if the user
+    # isn't a team member of that project, and the projects the user is
+    # participating in a Discussion in as a guest. (Discussions are attached
+    # to TaskAnswers by a generic relation, which can be dangling.)
+    guest_answers = Discussion.objects\
+        .filter(guests=user, attached_to_content_type=ContentType.objects.get_for_model(TaskAnswer))\
+        .values("attached_to_object_id")
+    related.update(Task.objects
+        .filter(editor=user, deleted_at=None)
+        .values_list("project_id", flat=True)
+        .union(TaskAnswer.objects
+            .filter(id__in=guest_answers)
+            .values_list("task__project_id", flat=True)))
+
+    # The projects the user has permissions for, directly or through a
+    # portfolio. Guardian stores object ids as strings.
+    def permitted_ids(model):
+        return UserObjectPermission.objects\
+            .filter(user=user, content_type=ContentType.objects.get_for_model(model))\
+            .annotate(object_id=Cast("object_pk", models.IntegerField()))\
+            .values("object_id")
+    permitted = set(Project.objects
+        .filter(models.Q(id__in=permitted_ids(Project)) | models.Q(portfolio__in=permitted_ids(Portfolio)))
+        .values_list("id", flat=True))
+
+    return {
+        "related": related,
+        "admin": admin,
+        "permitted": permitted,
+    }
+
+def get_project_access_version():
+    from django.core.cache import cache
+    version = cache.get(PROJECT_ACCESS_VERSION_KEY)
+    if version is None:
+        # Start from the current time if the counter is missing or was
+        # evicted, so that it doesn't go back to a version that was used.
+        import time
+        version = int(time.time() * 1000)
+        if not cache.add(PROJECT_ACCESS_VERSION_KEY, version, None):
+            version = cache.get(PROJECT_ACCESS_VERSION_KEY, version)
+    return version
+
+def on_project_access_changed(**kwargs):
+    global project_access_local_version
+    project_access_local_version += 1
+    if settings.GR_PROJECT_ACCESS_CACHE_TTL:
+        from django.core.cache import cache
+        try:
+            cache.incr(PROJECT_ACCESS_VERSION_KEY)
+        except ValueError:
+            # The counter is missing, so there are no cached sets to drop.
+            pass
+
+def on_project_access_m2m_changed(action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        on_project_access_changed()
+
+def connect_project_access_signals():
+    from django.db.models.signals import m2m_changed, post_delete, post_save
+    # Task and Discussion are given by name because their apps import this one.
+    for model in (ProjectMembership, Project, "guardian.UserObjectPermission", "guidedmodules.Task"):
+        post_save.connect(on_project_access_changed, sender=model, dispatch_uid="project-access")
+        post_delete.connect(on_project_access_changed, sender=model, dispatch_uid="project-access")
+    m2m_changed.connect(on_project_access_m2m_changed, sender="discussion.Discussion_guests", dispatch_uid="project-access")
+
+connect_project_access_signals()
+
+
+class ProjectSummary(models.Model):
+    # What the project list shows about each Project, which would otherwise
+    # be computed from its answers, controls and output documents on every
+    # page load. Changes to the answers and controls mark it stale, and it is
+    # recomputed the next time it is shown (see ProjectSummary.assign).
+    project = models.OneToOneField(Project, primary_key=True, related_name="summary", on_delete=models.CASCADE,
+                                   help_text="The Project this is a summary of.")
+    acronym = models.TextField(blank=True, null=True, help_text="The Project's system acronym, from its system_basic_info Task.")
+    total_controls_count = models.IntegerField(default=0, help_text="The number of controls selected for the Project's system.")
+    controls_addressed_count = models.IntegerField(default=0, help_text="The number of those controls that are assessed or ready for assessment.")
+    stale = models.BooleanField(default=False, help_text="Have the acronym or controls changed since the summary was computed?")
+    lifecycle_stage_code = models.TextField(blank=True, null=True, help_text="The text of the root Task's govready_lifecycle_stage_code output document.")
+    lifecycle_stage_stale = models.BooleanField(default=True, help_text="Have the Project's answers changed since the lifecycle stage was computed?")
+    updated = models.DateTimeField(auto_now=True, db_index=True)
+
+    @property
+    def percent_compliant(self):
+        # Approximate compliance, as a percent.
+        if self.total_controls_count == 0:
+            return 0
+        return self.controls_addressed_count / self.total_controls_count * 100
+
+    @staticmethod
+    def assign(projects, lifecycle_stage=False):
+        # Set the summary of each of the Projects, recomputing the ones that
+        # are missing or stale. Load the Projects with select_related("summary")
+        # so that the summaries that are up to date don't need a query.
+        for project in projects:
+            try:
+                summary = project.summary
+            except ProjectSummary.DoesNotExist:
+                summary = ProjectSummary(project=project)
+            if summary._state.adding or summary.stale or (lifecycle_stage and summary.lifecycle_stage_stale):
+                summary.update(lifecycle_stage=lifecycle_stage)
+                project.summary = summary
+
+    def update(self, lifecycle_stage=False):
+        import controls.utils as control_utils
+        import guidedmodules.utils as guided_modules_utils
+        project = self.project
+
+        # Clear the stale flags in the database before recomputing, and only
+        # save the recomputed fields, so that a mark_stale that happens while
+        # the summary is recomputed isn't overwritten and marks it stale again.
+        flags = {"stale": False}
+        if lifecycle_stage:
+            flags["lifecycle_stage_stale"] = False
+        if not ProjectSummary.objects.filter(project=project).update(**flags):
+            ProjectSummary.objects.get_or_create(project=project, defaults=flags)
+        for field, value in flags.items():
+            setattr(self, field, value)
+        update_fields = ["acronym", "total_controls_count", "controls_addressed_count", "updated"]
+
+        self.acronym = guided_modules_utils.get_project_acronym(project)
+        if project.system is not None:
+            stats = control_utils.get_control_compliance_stats(project)
+            self.total_controls_count = stats["total_controls_count"]
+            self.controls_addressed_count = stats["controls_addressed_count"]
+        else:
+            self.total_controls_count = 0
+            self.controls_addressed_count = 0
+        if lifecycle_stage:
+            self.lifecycle_stage_code = ProjectSummary.get_lifecycle_stage_code(project)
+            update_fields.append("lifecycle_stage_code")
+        self._state.adding = False
+        self.save(update_fields=update_fields)
+
+    @staticmethod
+    def get_lifecycle_stage_code(project):
+        # The lifecycle stage is computed by the project's root task's app's
+        # output document named govready_lifecycle_stage_code.
+        if project.root_task is None:
+            return None
+        for doc in project.root_task.render_output_documents():
+            if doc.get("id") == "govready_lifecycle_stage_code":
+                return doc["text"].strip()
+        return None
+
+    @staticmethod
+    def mark_stale(projects, lifecycle_stage=False):
+        # Mark the summaries of the Projects (a queryset or ids) as stale.
+        fields = {"lifecycle_stage_stale": True} if lifecycle_stage else {"stale": True}
+        ProjectSummary.objects.filter(project__in=projects).update(**fields)
+
+    @staticmethod
+    def on_element_control_changed(instance, **kwargs):
+        ProjectSummary.mark_stale(Project.objects.filter(system__root_element_id=instance.element_id).values("id"))
+
+
+def connect_project_summary_signals():
+    from django.db.models.signals import post_delete, post_save
+    from controls.models import ElementControl
+    post_save.connect(ProjectSummary.on_element_control_changed, sender=ElementControl, dispatch_uid="project-summary")
+    post_delete.connect(ProjectSummary.on_element_control_changed, sender=ElementControl, dispatch_uid="project-summary")
+
+connect_project_summary_signals()
+
+
 class Invitation(models.Model):
     # who is sending the invitation
     from_user = models.ForeignKey(User, related_name="invitations_sent", on_delete=models.CASCADE,
@@ -1257,6 +1436,8 @@ class Invitation(models.Model):
     # what state is this invitation in?
     sent_at = models.DateTimeField(blank=True, null=True,
                                    help_text="If the invitation has been sent by email, when it was sent.")
+    queued_at = models.DateTimeField(blank=True, null=True,
+                                     help_text="If the invitation is to be sent by email in the background by the send_notification_emails command, when it was queued, or when to try again if sending it failed.")
     accepted_at = models.DateTimeField(blank=True, null=True,
                                        help_text="If the invitation has been accepted, when it was accepted.")
     revoked_at = models.DateTimeField(blank=True, null=True,
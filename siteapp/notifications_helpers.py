@@ -3,24 +3,50 @@ from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
 
-def issue_notification(acting_user, verb, target, recipients='WATCHERS', **notification_kwargs):
-    # Create a notification *from* acting_user *to*
-    # all users who are watching target.
-    from notifications.signals import notify
+def make_notifications(acting_user, verb, target, recipients='WATCHERS', description=None, **notification_kwargs):
+    # Make unsaved notifications *from* acting_user *to*
+    # all users who are watching target, the same as the
+    # ones notifications.signals.notify creates, so that
+    # they can be created together with bulk_create. Like
+    # notify, notification_kwargs are only stored in data
+    # if django-notifications' USE_JSONFIELD is set in
+    # DJANGO_NOTIFICATIONS_CONFIG.
+    from django.contrib.contenttypes.models import ContentType
+    from django.utils import timezone
+    from notifications.models import Notification
+    from notifications.settings import get_config
+    data = notification_kwargs if notification_kwargs and get_config()["USE_JSONFIELD"] else None
     if recipients == 'WATCHERS':
         recipients = target.get_notification_watchers()
-    for user in recipients:
+    actor_content_type = ContentType.objects.get_for_model(acting_user)
+    target_content_type = ContentType.objects.get_for_model(target)
+    timestamp = timezone.now()
+    return [
+        # TODO: Associate this notification with an organization?
+        Notification(
+            recipient=user,
+            actor_content_type=actor_content_type,
+            actor_object_id=acting_user.pk,
+            verb=str(verb),
+            description=description,
+            timestamp=timestamp,
+            target_content_type=target_content_type,
+            target_object_id=target.pk,
+            data=data,
+        )
+        for user in recipients
+
         # Don't notify the acting user about an
         # action they took.
-        if user == acting_user:
-            continue
+        if user != acting_user
+    ]
 
-        # Create the notification.
-        # TODO: Associate this notification with an organization?
-        notify.send(
-            acting_user, verb=verb, target=target,
-            recipient=user,
-            **notification_kwargs)
+def issue_notification(acting_user, verb, target, recipients='WATCHERS', **notification_kwargs):
+    # Create a notification *from* acting_user *to*
+    # all users who are watching target.
+    from notifications.models import Notification
+    Notification.objects.bulk_create(
+        make_notifications(acting_user, verb, target, recipients=recipients, **notification_kwargs))
 
 @login_required
 def mark_notifications_as_read(request):
@@ -297,13 +297,38 @@ CACHES = {
 	'default': {
 		'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
 		'LOCATION': '127.0.0.1:11211',
-	}
+	},
+	# Rendered output documents (see guidedmodules.module_logic.get_or_render_document).
+	# The least recently used are evicted when the cache is full.
+	'renders': {
+		'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+		'LOCATION': 'renders',
+		'OPTIONS': {
+			'MAX_ENTRIES': environment.get('render-cache-max-entries', 1000),
+		},
+	},
+	# Thumbnails of images (see guidedmodules.models.cached_image_to_dataurl).
+	# Kept on disk so that they are shared by all of the processes on the host
+	# and survive restarts. Entries are culled when the cache is full.
+	'derived-assets': {
+		'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+		'LOCATION': environment.get('derived-asset-cache-dir', local('derived-assets')),
+		'TIMEOUT': None,
+		'OPTIONS': {
+			'MAX_ENTRIES': environment.get('derived-asset-cache-max-entries', 5000),
+		},
+	},
 }
 if environment.get('memcached'):
 	# But if the 'memcached' environment setting is true,
 	# enable a memcached cache using the default host/port
 	# (see above) *and* enable the cached_db session backend.
 	CACHES['default']['BACKEND'] = 'django.core.cache.backends.memcached.MemcachedCache'
+	CACHES['renders'] = {
+		'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+		'LOCATION': '127.0.0.1:11211',
+		'KEY_PREFIX': 'renders',
+	}
 	SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
 
 # Logging.
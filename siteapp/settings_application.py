@@ -124,6 +124,45 @@ if GR_IMG_GENERATOR not in GR_IMG_GENERATOR_SUPPORTED:
 else:
     logger.info("GR_IMG_GENERATOR set to %s", GR_IMG_GENERATOR)
 
+# Module state evaluation settings
+# When set, every incremental evaluation of a Task's module state is checked
+# against a full evaluation and an error is raised if they differ. For testing only.
+GR_MODULE_STATE_DIFFERENTIAL_CHECK = bool(environment.get("gr-module-state-differential-check", False))
+
+# Catalog snapshot settings
+# Directory where each catalog is stored as a precompiled snapshot that worker
+# processes memory-map instead of loading and parsing the catalog from the
+# database. Set to an empty string to turn snapshots off.
+GR_CATALOG_SNAPSHOT_DIR = environment.get("gr-catalog-snapshot-dir", local("catalog-snapshots"))
+
+# Document conversion settings
+# Output documents are converted to PDF, DOCX, etc. in a pool of worker
+# processes (see guidedmodules.conversion). Converted documents are kept in
+# a directory shared by all of the processes on the host. Downloads without
+# async=1 wait at most GR_DOCUMENT_CONVERSION_SYNC_TIMEOUT seconds, so that
+# they don't outlast the web server's worker timeout, and longer conversions
+# must be polled for with async=1.
+GR_DOCUMENT_CONVERTER = environment.get("gr-document-converter", "guidedmodules.conversion.convert_document")
+GR_DOCUMENT_CONVERSION_WORKERS = int(environment.get("gr-document-conversion-workers", 2))
+GR_DOCUMENT_CONVERSION_TIMEOUT = int(environment.get("gr-document-conversion-timeout", 300))
+GR_DOCUMENT_CONVERSION_SYNC_TIMEOUT = int(environment.get("gr-document-conversion-sync-timeout", 30))
+GR_DOCUMENT_CONVERSION_DIR = environment.get("gr-document-conversion-dir", local("document-conversions"))
+GR_DOCUMENT_CONVERSION_MAX_RESULTS = int(environment.get("gr-document-conversion-max-results", 200))
+
+# Project access settings
+# The number of seconds that the ids of the projects each user can read (see
+# siteapp.models.get_project_access) are kept in the default cache. Changes are
+# only seen by other processes when the default cache is shared by them, e.g.
+# memcached. By default they are computed once per request.
+GR_PROJECT_ACCESS_CACHE_TTL = int(environment.get("gr-project-access-cache-ttl", 0))
+
+# Git app source settings
+# Directory where each git AppSource's repository is mirrored between
+# connections, so that loading its apps only fetches what changed (see
+# guidedmodules.app_source_connections.GitRepositoryFilesystem). Set to an
+# empty string to fetch into a temporary directory each time.
+GR_GIT_MIRROR_DIR = environment.get("gr-git-mirror-dir", local("git-mirrors"))
+
 MIDDLEWARE += [
     'debug_toolbar.middleware.DebugToolbarMiddleware',
     'siteapp.middleware.ContentSecurityPolicyMiddleware',
@@ -142,11 +181,20 @@ TESTING_MODE = 'test' in sys.argv # Are we running tests with test mode and debu
 if TESTING_MODE or ENABLE_TOOLBAR == False:
     DISABLE_DJANGO_DEBUG_TOOLBAR = True
     # Prevent caching when we are testing
-    CACHES = {
-        'default': {
-            'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
-        }
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    }
+if TESTING_MODE:
+    # The rendered document and derived asset caches keep the backends set in
+    # settings.py except in tests, which turn them on with override_settings.
+    CACHES['renders'] = {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    }
+    CACHES['derived-assets'] = {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
     }
+    # Tests that use catalog snapshots write them to a temporary directory.
+    GR_CATALOG_SNAPSHOT_DIR = ""
 
 def DEBUG_TOOLBAR_SHOW_TOOLBAR_CALLBACK(r):
     # return True # Force debug toolbar to be true regardless of INTERNAL_IPS settings
@@ -18,8 +18,10 @@ import tempfile
 import time
 import unittest
 import json
+from unittest.mock import patch
 
 from django.contrib.auth import authenticate
+from django.test import override_settings
 from django.test.client import RequestFactory
 
 import selenium.webdriver
@@ -1302,3 +1304,196 @@ class ProjectTests(TestCaseWithFixtureData):
         self.assertEqual(edit_project.title, 'Test Project v2')
         self.assertEqual(edit_project.version, "1.1")
         self.assertEqual(edit_project.version_comment, "A new comment!")
+
+
+class ProjectAccessTests(TestCaseWithFixtureData):
+    """
+    Test the projects that Project.get_projects_with_read_priv finds
+    """
+
+    def test_get_projects_with_read_priv(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from guardian.shortcuts import assign_perm
+        from discussion.models import Discussion
+        from guidedmodules.models import Task, TaskAnswer
+
+        def make_projects(count):
+            portfolio = Portfolio.objects.create(title="Other Portfolio {}".format(Portfolio.objects.count()))
+            return [Project.objects.create(organization=self.organization, portfolio=portfolio) for i in range(count)]
+        unrelated = make_projects(3)
+        member, admin, editor, guest, permitted = make_projects(5)
+        portfolio = Portfolio.objects.create(title="Permitted Portfolio")
+        in_portfolio = Project.objects.create(organization=self.organization, portfolio=portfolio)
+
+        ProjectMembership.objects.create(project=member, user=self.user)
+        ProjectMembership.objects.create(project=admin, user=self.user, is_admin=True)
+        ProjectMembership.objects.create(project=self.organization.get_organization_project(), user=self.user)
+        Task.objects.create(module=self.getModule("question_types_text"), project=editor, editor=self.user)
+        task = Task.objects.create(module=self.getModule("question_types_text"), project=guest, editor=self.superuser)
+        answer = TaskAnswer.objects.create(task=task, question=task.module.questions.get(key="q_text"))
+        Discussion.get_for(self.organization, answer, create=True).guests.add(self.user)
+        assign_perm("view_project", self.user, permitted)
+        assign_perm("view_portfolio", self.user, portfolio)
+
+        def get_projects(**kwargs):
+            user = User.objects.get(id=self.user.id)
+            with CaptureQueriesContext(connection) as queries:
+                projects = Project.get_projects_with_read_priv(user, **kwargs)
+            return projects, len(queries.captured_queries)
+
+        # The fixture project's root task is edited by the user.
+        projects, queries = get_projects()
+        self.assertEqual(set(projects), {self.project, member, admin, editor, guest, permitted, in_portfolio})
+        self.assertEqual([p for p in projects if getattr(p, "user_is_admin", False)], [admin])
+
+        # Excludes only apply to the projects that the user doesn't have
+        # permissions for.
+        projects, _ = get_projects(excludes={"contained_in_folders": None})
+        self.assertEqual(set(projects), {permitted, in_portfolio})
+
+        # The number of queries doesn't depend on the number of projects.
+        for project in make_projects(5):
+            assign_perm("view_project", self.user, project)
+        self.assertEqual(get_projects()[1], queries)
+
+        # The projects are found once per request until access changes.
+        user = User.objects.get(id=self.user.id)
+        Project.get_projects_with_read_priv(user)
+        with CaptureQueriesContext(connection) as queries:
+            Project.get_projects_with_read_priv(user)
+        self.assertEqual(len(queries.captured_queries), 1)
+        ProjectMembership.objects.filter(project=member, user=self.user).delete()
+        self.assertNotIn(member, Project.get_projects_with_read_priv(user))
+
+
+@override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+class ProjectSummaryTests(TestCaseWithFixtureData):
+    """
+    Test that the project list shows the projects' summaries
+    """
+
+    def make_project(self):
+        from guardian.shortcuts import assign_perm
+        from controls.models import ElementControl
+        element = Element.objects.create(name="Summary System {}".format(Element.objects.count()), element_type="system")
+        project = Project.objects.create(organization=self.organization, system=System.objects.create(root_element=element))
+        assign_perm("view_project", self.user, project)
+        for ctl_id in ("ac-1", "ac-2", "ac-3", "ac-4"):
+            ElementControl.objects.create(element=element, oscal_ctl_id=ctl_id, oscal_catalog_key="NIST_SP-800-53_rev4")
+        return project
+
+    def test_project_list(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from controls.models import ElementControl
+        from guidedmodules.models import Task
+        from siteapp.models import ProjectSummary
+        self.client.force_login(self.user)
+
+        def get_projects():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse("projects"))
+            self.assertEqual(response.status_code, 200)
+            return { p.id: p.percent_compliant for p in response.context["projects"] }, len(queries.captured_queries)
+
+        project = self.make_project()
+        get_projects()
+        percents, queries = get_projects()
+        self.assertEqual(percents[project.id], 0)
+
+        # The number of queries doesn't depend on the number of projects
+        # once their summaries are computed.
+        for i in range(3):
+            self.make_project()
+        get_projects()
+        self.assertEqual(get_projects()[1], queries)
+
+        # Changing a control's status updates the summary.
+        control = ElementControl.objects.filter(element=project.system.root_element).first()
+        control.status = ElementControl.Statuses.ASSESSED
+        control.save()
+        self.assertTrue(ProjectSummary.objects.get(project=project).stale)
+        self.assertEqual(get_projects()[0][project.id], 25)
+        self.assertFalse(ProjectSummary.objects.get(project=project).stale)
+
+        # A change made while the summary is being recomputed leaves it stale.
+        ProjectSummary.mark_stale([project.id])
+        def get_project_acronym(project):
+            control.save()
+            return None
+        with patch("guidedmodules.utils.get_project_acronym", get_project_acronym):
+            self.assertEqual(get_projects()[0][project.id], 25)
+        self.assertTrue(ProjectSummary.objects.get(project=project).stale)
+        get_projects()
+        self.assertFalse(ProjectSummary.objects.get(project=project).stale)
+
+        # Changing an answer makes the lifecycle stage stale.
+        ProjectSummary.objects.filter(project=project).update(lifecycle_stage_stale=False)
+        project.root_task = Task.objects.create(module=self.getModule("app"), project=project, editor=self.user)
+        project.save()
+        project.root_task.get_or_create_subtask(self.user, "question_types_text")
+        self.assertTrue(ProjectSummary.objects.get(project=project).lifecycle_stage_stale)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "apps-catalog-tests"}})
+class AppsCatalogTests(TestCaseWithFixtureData):
+    """
+    Test the cached compliance app catalog
+    """
+
+    def test_catalog(self):
+        from django.core.cache import cache
+        from guidedmodules.models import AppSource, AppVersion
+        from siteapp.views import get_compliance_apps_catalog_for_user
+        cache.clear()
+
+        # The catalog entries were rendered when the apps were loaded.
+        self.assertTrue(AppVersion.objects.filter(source__slug="fixture", catalog_entry__isnull=False).exists())
+        def get_keys():
+            return {app["key"] for app in get_compliance_apps_catalog_for_user(self.superuser)}
+        self.assertIn("fixture/simple_project", get_keys())
+
+        # The catalog is cached, and entries aren't rendered again.
+        with patch("guidedmodules.models.AppVersion.render_catalog_entry") as render:
+            get_keys()
+            with self.assertNumQueries(2):
+                self.assertIn("fixture/simple_project", get_keys())
+        render.assert_not_called()
+
+        # Changing an AppSource's availability drops the cached catalog.
+        source = AppSource.objects.get(slug="fixture")
+        source.available_to_all_individuals = False
+        source.save()
+        self.assertNotIn("fixture/simple_project", get_keys())
+        source.available_to_individual.add(self.superuser)
+        self.assertIn("fixture/simple_project", get_keys())
+
+        # Renaming an AppSource changes the keys of its apps without
+        # rendering their entries again.
+        source.slug = "renamed-fixture"
+        source.save()
+        with patch("guidedmodules.models.AppVersion.render_catalog_entry") as render:
+            self.assertIn("renamed-fixture/simple_project", get_keys())
+        render.assert_not_called()
+
+class CacheSettingsTests(unittest.TestCase):
+    """
+    Test the cache backends of the production settings
+    """
+
+    def test_cache_backends(self):
+        # The settings are loaded in a new process, since 'test' in
+        # sys.argv turns the caches off.
+        import subprocess, sys
+        script = "\n".join([
+            "import json",
+            "from django.conf import settings",
+            "print(json.dumps({ name: cfg['BACKEND'] for name, cfg in settings.CACHES.items() }))",
+        ])
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE="siteapp.settings")
+        output = subprocess.check_output([sys.executable, "-c", script], env=env,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        backends = json.loads(output.decode("utf8").strip().splitlines()[-1])
+        self.assertEqual(backends["renders"], "django.core.cache.backends.locmem.LocMemCache")
+        self.assertEqual(backends["derived-assets"], "django.core.cache.backends.filebased.FileBasedCache")
@@ -119,6 +119,7 @@ urlpatterns = [
 
     # health
     url(r'^health/$', views_health.index),
+    url(r'^health/caches$', views_health.caches),
     url(r'^health/check-system$', views_health.check_system),
     url(r'^health/check-vendor-resources$', views_health.check_vendor_resources),
     url(r'^health/list-vendor-resources$', views_health.list_vendor_resources),
@@ -0,0 +1,140 @@
+import sys
+import threading
+from collections import OrderedDict
+
+# All of the LRUCaches created in this process, by name, so that their
+# size and hit rates can be reported (see siteapp.views_health.caches).
+caches = OrderedDict()
+
+class LRUCache:
+    # A bounded, thread-safe, in-process cache that evicts the least recently
+    # used entry when it is full and keeps hit/miss/eviction counts. Callers
+    # are responsible for choosing keys that change when the cached value
+    # would change (e.g. by including the updated timestamp of a record) so
+    # that entries never need to be invalidated one by one.
+    #
+    # If sizeof is given, it is called with each value to estimate how many
+    # bytes the value holds, and entries are also evicted to keep the total
+    # under maxbytes (always keeping at least the newest entry).
+
+    def __init__(self, name, maxsize, maxbytes=None, sizeof=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.data = OrderedDict()
+        self.sizes = { }
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        caches[name] = self
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __getitem__(self, key):
+        # Doesn't count as a hit or mark the entry as recently used.
+        return self.data[key]
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.data:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.data.move_to_end(key)
+            return self.data[key]
+
+    def set(self, key, value):
+        size = self.sizeof(value) if self.sizeof else 0
+        with self.lock:
+            self.bytes -= self.sizes.pop(key, 0)
+            self.data[key] = value
+            self.data.move_to_end(key)
+            self.sizes[key] = size
+            self.bytes += size
+            self._evict()
+
+    def add_bytes(self, key, value, size):
+        # Count size more bytes for an entry whose value has grown since it
+        # was set (e.g. because it fills in parts of itself lazily), if value
+        # is still the cached value for key, and evict entries if the cache
+        # is now over maxbytes.
+        with self.lock:
+            if self.data.get(key) is not value:
+                return
+            self.sizes[key] += size
+            self.bytes += size
+            self._evict()
+
+    def _evict(self):
+        # Called with the lock held.
+        while len(self.data) > self.maxsize \
+            or (self.maxbytes is not None and self.bytes > self.maxbytes and len(self.data) > 1):
+            evicted_key, _ = self.data.popitem(last=False)
+            self.bytes -= self.sizes.pop(evicted_key)
+            self.evictions += 1
+
+    def get_or_set(self, key, func):
+        # Return the cached value for key, or else compute it with
+        # func(), store it, and return it.
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = func()
+            self.set(key, value)
+        return value
+
+    def pop(self, key, default=None):
+        with self.lock:
+            self.bytes -= self.sizes.pop(key, 0)
+            return self.data.pop(key, default)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.sizes.clear()
+            self.bytes = 0
+
+    def stats(self):
+        stats = {
+            "name": self.name,
+            "size": len(self.data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+        if self.sizeof:
+            stats["bytes"] = self.bytes
+            stats["maxbytes"] = self.maxbytes
+        return stats
+
+def get_cache_stats():
+    return [cache.stats() for cache in caches.values()]
+
+def approximate_sizeof(obj, exclude=()):
+    # Estimate the number of bytes held by a structure of dicts, lists,
+    # and scalars, counting objects reachable more than once only once.
+    # Objects whose ids are in exclude (e.g. because they are shared
+    # with something that has already been counted) are not counted.
+    seen = set(exclude)
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+    return size
@@ -0,0 +1,38 @@
+from django.core.serializers.json import DjangoJSONEncoder
+
+class JSONArrayStream:
+    # Wraps an iterable, such as a generator over a queryset iterator, that
+    # iter_json_object writes as a JSON array one item at a time, so that the
+    # whole array is never held in memory.
+
+    def __init__(self, iterable):
+        self.iterable = iterable
+
+def iter_json_object(items, indent=2, encoder=DjangoJSONEncoder):
+    # Yields chunks of the JSON encoding of an object whose (key, value)
+    # items are given by an iterable, formatted the same as json.dumps with
+    # the given indent. Values that are JSONArrayStreams are encoded one
+    # item at a time. Each item is encoded only when the previous chunks
+    # have been consumed.
+    enc = encoder(indent=indent)
+    pad = " " * indent
+
+    def encode(value, level):
+        # Encode a value nested at the given level. JSON strings never contain
+        # raw newlines, so every newline is the start of an indented line.
+        return enc.encode(value).replace("\n", "\n" + pad * level)
+
+    yield "{"
+    first = True
+    for key, value in items:
+        yield ("\n" if first else ",\n") + pad + enc.encode(str(key)) + ": "
+        first = False
+        if isinstance(value, JSONArrayStream):
+            empty = True
+            for item in value.iterable:
+                yield ("[\n" if empty else ",\n") + pad * 2 + encode(item, 2)
+                empty = False
+            yield "[]" if empty else "\n" + pad + "]"
+        else:
+            yield encode(value, 1)
+    yield "}" if first else "\n}"
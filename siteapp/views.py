@@ -45,7 +45,7 @@ from .forms import AccountSettingsForm, EditProjectForm, PortfolioForm
 from .good_settings_helpers import \
     AllauthAccountAdapter  # ensure monkey-patch is loaded
 from .models import (Folder, Invitation, Organization, Portfolio, Project,
-                     ProjectAsset, Support, Tag, User)
+                     ProjectAsset, ProjectSummary, Support, Tag, User)
 from .notifications_helpers import *
 
 logging.basicConfig()
@@ -252,14 +252,12 @@ def assign_project_lifecycle_stage(projects):
     # Load each project's lifecycle stage, which is computed by each project's
     # root task's app's output document named govready_lifecycle_stage_code.
     # That output document yields a string identifying a lifecycle stage.
+    # It's kept in each project's ProjectSummary.
+    ProjectSummary.assign(projects, lifecycle_stage=True)
     for project in projects:
-        outputs = project.root_task.render_output_documents()
-        for doc in outputs:
-            if doc.get("id") == "govready_lifecycle_stage_code":
-                value = doc["text"].strip()
-                if value in lifecycle_stage_code_mapping:
-                    project.lifecycle_stage = lifecycle_stage_code_mapping[value]
-                    break
+        value = project.summary.lifecycle_stage_code
+        if value in lifecycle_stage_code_mapping:
+            project.lifecycle_stage = lifecycle_stage_code_mapping[value]
         else:
             # No matching output document with a non-empty value.
             project.lifecycle_stage = lifecycle_stage_code_mapping["none_none"]
@@ -286,10 +284,6 @@ class ProjectList(ListView):
             self.request.user,
             excludes={"contained_in_folders": None})
 
-        for project in projects:
-            project.acronym = guided_modules_utils.get_project_acronym(project)
-            project.percent_compliant = control_utils.get_control_compliance_stats(project).get('percent_compliant')
-
         # Log listing
         logger.info(
             event="project_list",
@@ -299,9 +293,19 @@ class ProjectList(ListView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['projects_access'] = Project.get_projects_with_read_priv(
-            self.request.user,
-            excludes={"contained_in_folders": None})
+        context['projects_access'] = self.object_list
+
+        # Assign the summaries and the user's permissions of the projects on
+        # this page, which were loaded with the projects.
+        projects = context['projects']
+        ProjectSummary.assign(projects)
+        checker = ObjectPermissionChecker(self.request.user)
+        if projects:
+            checker.prefetch_perms(projects)
+        for project in projects:
+            project.acronym = project.summary.acronym
+            project.percent_compliant = project.summary.percent_compliant
+            project.user_perms = checker.get_perms(project)
         return context
 
 def project_list_lifecycle(request):
@@ -365,96 +369,36 @@ def get_compliance_apps_catalog_for_user(user):
 def get_compliance_apps_catalog(organization, userid):
     # Load the compliance apps available to the given organization.
 
-    from collections import defaultdict
-
     from guidedmodules.models import AppVersion
 
-    appvers = AppVersion.get_startable_apps(organization, userid)
-
-    # Group the AppVersions into apps. An app is a unique source+appname pair.
-    # For each app, one or more versions may be available.
-    apps = defaultdict(lambda: [])
-    for av in appvers:
-        apps[(av.source, av.appname)].append(av)
-
-    # Replace each app entry with a list of AppVersions sorted by reverse database
-    # row created date (since we don't necessarily have sortable version numbers).
+    # The apps are cached per organization and role. Filter them to the
+    # apps available to the user.
+    user = User.objects.filter(id=userid).first()
+    role_bool = user.has_perm("guidedmodules.view_appsource")
     apps = [
-        sorted(appvers, key=lambda av: av.created, reverse=True)
-        for appvers in apps.values()
+        app
+        for app in AppVersion.get_catalog(organization, role_bool)
+        if app["individuals"] is None or userid in app["individuals"]
     ]
 
     # Collect catalog display metadata for each app from the most recent version
     # of each app.
     apps = [
-        render_app_catalog_entry(appvers[0], appvers, organization)
-        for appvers in apps
+        render_app_catalog_entry(app["versions"][0], app["versions"], organization)
+        for app in apps
     ]
 
     return apps
 
 
 def render_app_catalog_entry(appversion, appversions, organization):
-    from guidedmodules.models import image_to_dataurl
-    from guidedmodules.module_logic import render_content
-
-    key = "{source}/{name}".format(source=appversion.source.slug, name=appversion.appname)
-
-    catalog = appversion.catalog_metadata
-    if not isinstance(catalog, dict): catalog = {}
-
-    app_module = appversion.modules.filter(module_name="app").first()
-
-    return {
+    # The catalog entry was rendered when the app was loaded.
+    entry = dict(appversion.get_catalog_entry())
+    del entry["entry_version"]
+    entry.update({
         # app identification
         "appsource_id": appversion.source.id,
-        "key": key,
-
-        # main display fields
-        "title": catalog.get('title') or appversion.appname,
-        "description": {  # rendered as markdown
-            "short": render_content(
-                {
-                    "template": catalog.get("description", {}).get("short") or "",
-                    "format": "markdown",
-                },
-                None,
-                "html",
-                "%s %s" % (key, "short description")
-            ),
-            "long": render_content(
-                {
-                    "template": catalog.get("description", {}).get("long")
-                                or catalog.get("description", {}).get("short")
-                                or "",
-                    "format": "markdown",
-                },
-                None,
-                "html",
-                "%s %s" % (key, "short description")
-            )
-        },
-
-        # catalog page metadata
-        "categories": catalog.get("categories", [catalog.get("category")]),
-        "search_haystak": "".join([  # free text search uses this
-            appversion.appname,
-            catalog.get('title', ""),
-            catalog.get("vendor", ""),
-            catalog.get("description", {}).get("short", ""),
-            catalog.get("description", {}).get("long", ""),
-        ]),
-        "icon": None if "icon" not in catalog
-        else image_to_dataurl(appversion.get_asset(catalog["icon"]), 128),
-        "protocol": app_module.spec.get("protocol", []) if app_module else [],
-
-        # catalog detail page metadata
-        "vendor": catalog.get("vendor"),
-        "vendor_url": catalog.get("vendor_url"),
-        "source_url": catalog.get("source_url"),
-        "status": catalog.get("status"),
-        "version": appversion.version_number,
-        "recommended_for": catalog.get("recommended_for", []),
+        "key": "{source}/{name}".format(source=appversion.source.slug, name=appversion.appname),
 
         # versions that can be started
         "versions": appversions,
@@ -464,7 +408,8 @@ def render_app_catalog_entry(appversion, appversions, organization):
 
         # placeholder for future logic
         "authz": "none",
-    }
+    })
+    return entry
 
 
 def get_task_question(request):
@@ -1011,6 +956,9 @@ def project(request, project):
         for column in columns:
             column["questions"] = []
 
+        # Compute whether the tasks are finished in bulk.
+        Task.load_cached_state([question["task"] for question in main_area_questions if "task" in question])
+
         for question in main_area_questions:
             if "task" not in question:
                 col = 0
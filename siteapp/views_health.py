@@ -7,6 +7,7 @@ from django.conf import settings
 def index(request):
     html = (
         '<html><body><ul>'
+        '<li><a href="/health/caches">caches</a> - View the size and hit rates of in-process caches.</li>'
         '<li><a href="/health/check-system">check-system</a> - View OS health (from "top").</li>'
         '<li><a href="/health/check-vendor-resources">check-vendor-resources</a> - Checksum fetched vendor resources.</li>'
         '<li><a href="/health/list-vendor-resources">list-vendor-resources</a> - List fetched vendor resources.</li>'
@@ -16,6 +17,19 @@ def index(request):
         '</body></html>' )
     return HttpResponse(html)
 
+def caches(request):
+    from pprint import pformat
+    from siteapp.utils.caches import get_cache_stats
+    import guidedmodules.models
+    import guidedmodules.module_logic # register its caches
+    stats = get_cache_stats()
+    stats.append(dict(name="renders", **guidedmodules.module_logic.RENDER_CACHE_STATS))
+    stats.append(dict(name="derived-assets", **guidedmodules.models.DERIVED_ASSET_CACHE_STATS))
+    stats.append(dict(name="task-state", **guidedmodules.models.Task.get_clear_state_stats()))
+    output = pformat(stats, sort_dicts=False)
+    html = "<html><body><pre>{}</pre></body></html>".format(output)
+    return HttpResponse(html)
+
 def check_system(request):
     output = subprocess.check_output(["./check-system.sh"]).decode("utf-8")
     html = "<html><body><pre>{}</pre></body></html>".format(output)